@@ -0,0 +1,48 @@
+"""
+   Compares the old two pass response decoding (json.loads followed by
+   _unicode_convert) with agol.jsonutils.loads on a query page of 2000
+   polygon features.
+"""
+import json
+import random
+import timeit
+from agol import jsonutils
+
+#----------------------------------------------------------------------
+def make_page(feature_count=2000, vertices=200):
+    """ builds a query response similar to a large polygon page """
+    features = []
+    for oid in xrange(feature_count):
+        ring = [[random.uniform(-180, 180), random.uniform(-90, 90)]
+                for i in xrange(vertices)]
+        ring.append(ring[0])
+        features.append({
+            "attributes": {"OBJECTID": oid,
+                           "NAME": u"Parcel %s \u00e9" % oid,
+                           "STATUS": "Active",
+                           "AREA": random.random() * 10000},
+            "geometry": {"rings": [ring]}
+        })
+    return json.dumps({"objectIdFieldName": "OBJECTID",
+                       "geometryType": "esriGeometryPolygon",
+                       "spatialReference": {"wkid": 4326},
+                       "fields": [{"name": "OBJECTID",
+                                   "type": "esriFieldTypeOID"},
+                                  {"name": "NAME",
+                                   "type": "esriFieldTypeString"}],
+                       "features": features})
+
+if __name__ == "__main__":
+    page = make_page()
+    print "page size: %.1f MB, json backend: %s" % (len(page) / 1048576.0,
+                                                    jsonutils.json.__name__)
+    assert jsonutils.loads(page) == \
+           jsonutils.unicode_convert(json.loads(page))
+    old = min(timeit.repeat(
+        lambda: jsonutils.unicode_convert(json.loads(page)),
+        number=1, repeat=5))
+    new = min(timeit.repeat(lambda: jsonutils.loads(page),
+                            number=1, repeat=5))
+    print "json.loads + _unicode_convert: %.3f s" % old
+    print "jsonutils.loads:               %.3f s" % new
+    print "speed up: %.1fx" % (old / new)
@@ -0,0 +1,104 @@
+"""
+   Checks that POSTs survive keep-alive connections the server closed
+   while they sat idle in connection.default_pool.  The local server
+   drops a connection after it was idle for IDLE seconds, like Apache
+   (5 s) or a load balancer would.
+
+      - a POST sent after a longer pause gets a new connection, because
+        acquire() sees the idle socket was closed
+      - a POST that still goes out on a dropped connection, when it
+        closes between that check and the send, is sent again on a new
+        connection; the server reads it once
+
+   Usage:
+      python _check_keepalive.py [idle]
+"""
+import sys
+import time
+import threading
+import BaseHTTPServer
+import SocketServer
+from agol import base
+from agol import connection
+
+IDLE = 0.5
+#----------------------------------------------------------------------
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+########################################################################
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ answers every POST with {} and closes idle connections """
+    protocol_version = "HTTP/1.1"
+    lock = threading.Lock()
+    connections = [0]
+    posts = [0]
+    #----------------------------------------------------------------------
+    def setup(self):
+        self.timeout = IDLE
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        with self.lock:
+            self.connections[0] += 1
+    #----------------------------------------------------------------------
+    def log_message(self, *args):
+        pass
+    #----------------------------------------------------------------------
+    def do_POST(self):
+        length = int(self.headers.getheader('content-length') or 0)
+        self.rfile.read(length)
+        with self.lock:
+            self.posts[0] += 1
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write("{}")
+#----------------------------------------------------------------------
+def _post(client, url, pause):
+    """ posts twice with a pause, returns the error or None and the
+        (connections, posts) the server saw
+    """
+    _Handler.connections[0] = _Handler.posts[0] = 0
+    connection.default_pool.clear()
+    try:
+        client._do_post(url, {"f": "json"})
+        time.sleep(pause)
+        client._do_post(url, {"f": "json"})
+        error = None
+    except Exception, e:
+        error = e
+    return error, (_Handler.connections[0], _Handler.posts[0])
+#----------------------------------------------------------------------
+def check():
+    """ runs the checks, returns the number that failed """
+    server = _Server(("127.0.0.1", 0), _Handler)
+    worker = threading.Thread(target=server.serve_forever)
+    worker.daemon = True
+    worker.start()
+    url = "http://127.0.0.1:%s/applyEdits" % server.server_address[1]
+    client = base.BaseAGOLClass()
+    failed = 0
+    cases = [("POST after %.1f s idle" % (IDLE * 3), None),
+             ("POST on a connection dropped unseen", lambda conn: False)]
+    dropped = connection._dropped
+    for name, check_idle in cases:
+        if check_idle is not None:
+            connection._dropped = check_idle
+        try:
+            error, seen = _post(client, url, IDLE * 3)
+        finally:
+            connection._dropped = dropped
+        ok = error is None and seen == (2, 2)
+        failed += not ok
+        print "%-40s %s" % (name, "ok" if ok else "FAILED")
+        print "   %s connections, %s posts read%s" % \
+              (seen[0], seen[1], "" if error is None else ", %r" % error)
+    connection.default_pool.clear()
+    server.shutdown()
+    server.server_close()
+    return failed
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        IDLE = float(sys.argv[1])
+    sys.exit(check())
@@ -0,0 +1,95 @@
+"""
+   Checks agol.pbf against the samples in fixtures/pbf.  Each sample is
+   a pair of files holding the same query answered with f=pbf (.pbf) and
+   with f=json (.json); the decoded buffer must match the JSON response,
+   coordinates within the tolerance of the buffer's quantization.
+
+   The samples cover feature sets (polygon with an upper left transform,
+   polyline with a lower left transform, points with Z and M, a polyline
+   with Z, multipoints), a count and an object id response.
+
+   Usage:
+      python _check_pbf_fixtures.py [tolerance]
+      python _check_pbf_fixtures.py record <layer url> <name> [where]
+         saves a new sample pair queried from a public layer
+"""
+import os
+import sys
+import urllib
+import urllib2
+from agol import pbf
+from agol import jsonutils
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "fixtures", "pbf")
+KEYS = ("objectIdFieldName", "geometryType", "hasZ", "hasM",
+        "exceededTransferLimit", "count", "objectIds")
+#----------------------------------------------------------------------
+def compare(decoded, expected, tolerance, path="", errors=None):
+    """ returns the differences between a decoded value and the JSON one """
+    if errors is None:
+        errors = []
+    if isinstance(expected, dict) and isinstance(decoded, dict):
+        for key in set(expected.keys()) | set(decoded.keys()):
+            compare(decoded.get(key), expected.get(key), tolerance,
+                    "%s.%s" % (path, key), errors)
+    elif isinstance(expected, list) and isinstance(decoded, list):
+        if len(expected) != len(decoded):
+            errors.append("%s: %s items, expected %s" %
+                          (path, len(decoded), len(expected)))
+        for index, (a, b) in enumerate(zip(decoded, expected)):
+            compare(a, b, tolerance, "%s[%s]" % (path, index), errors)
+    elif isinstance(expected, float) or isinstance(decoded, float):
+        if expected is None or decoded is None or \
+           abs(decoded - expected) > tolerance:
+            errors.append("%s: %r, expected %r" % (path, decoded, expected))
+    elif decoded != expected:
+        errors.append("%s: %r, expected %r" % (path, decoded, expected))
+    return errors
+#----------------------------------------------------------------------
+def normalize(result):
+    """ keeps the parts of a response both formats carry """
+    value = dict((k, result[k]) for k in KEYS if k in result)
+    if 'spatialReference' in result:
+        value['spatialReference'] = dict(
+            (k, v) for k, v in result['spatialReference'].iteritems()
+            if k in ('wkid', 'latestWkid'))
+    if 'fields' in result:
+        value['fields'] = [(f['name'], f['type']) for f in result['fields']]
+    if 'features' in result:
+        value['features'] = result['features']
+    return value
+#----------------------------------------------------------------------
+def check(tolerance=1e-6):
+    """ decodes every sample and compares it to its JSON response """
+    failed = 0
+    for name in sorted(os.listdir(FIXTURES)):
+        if not name.endswith(".pbf"):
+            continue
+        base = os.path.join(FIXTURES, name[:-4])
+        with open(base + ".pbf", 'rb') as reader:
+            decoded = pbf.decode(reader.read())
+        with open(base + ".json", 'rb') as reader:
+            expected = jsonutils.loads(reader.read())
+        errors = compare(normalize(decoded), normalize(expected), tolerance)
+        print "%-32s %s" % (name[:-4], "ok" if not errors else "FAILED")
+        for error in errors:
+            print "   " + error
+        failed += len(errors) > 0
+    return failed
+#----------------------------------------------------------------------
+def record(url, name, where="1=1"):
+    """ queries a public layer with f=json and f=pbf and saves the pair """
+    for f in ("json", "pbf"):
+        params = urllib.urlencode({"where": where, "outFields": "*",
+                                   "returnGeometry": True, "f": f})
+        data = urllib2.urlopen(url.rstrip('/') + "/query?" + params).read()
+        with open(os.path.join(FIXTURES, "%s.%s" % (name, f)), 'wb') as writer:
+            writer.write(data)
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "record":
+        record(*sys.argv[2:])
+    else:
+        tolerance = float(sys.argv[1]) if len(sys.argv) > 1 else 1e-6
+        sys.exit(check(tolerance))
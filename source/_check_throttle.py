@@ -0,0 +1,172 @@
+"""
+   Checks agol.throttle against a local stub server.  The server answers
+   429 once more than a number of requests arrived within the last
+   second, and has endpoints failing once with a given status, so the
+   retry policy can be seen per method:
+
+      - GETs from several threads slow down to the server's rate and all
+        complete
+      - a POST answered with 502 is not sent again, a GET is
+      - a POST answered with 503 or 429 is sent again
+      - a POST to a closed port fails with connection.NotSentError and is
+        retried
+
+   Usage:
+      python _check_throttle.py [requests] [threads] [rate]
+"""
+import sys
+import time
+import socket
+import threading
+import BaseHTTPServer
+import SocketServer
+from collections import deque
+from agol import connection
+from agol import throttle
+
+RATE = 20
+#----------------------------------------------------------------------
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+########################################################################
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ /rate is limited to RATE requests per second, /fail/<status>/<key>
+        answers status on the first request of each key
+    """
+    protocol_version = "HTTP/1.1"
+    lock = threading.Lock()
+    recent = deque()
+    hits = {}
+    throttled = [0]
+    #----------------------------------------------------------------------
+    def log_message(self, *args):
+        pass
+    #----------------------------------------------------------------------
+    def _answer(self, status, body="{}"):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    #----------------------------------------------------------------------
+    def _handle(self):
+        length = int(self.headers.getheader('content-length') or 0)
+        if length:
+            self.rfile.read(length)
+        with self.lock:
+            self.hits[self.path] = self.hits.get(self.path, 0) + 1
+            hits = self.hits[self.path]
+            now = time.time()
+            self.recent.append(now)
+            while self.recent and self.recent[0] < now - 1.0:
+                self.recent.popleft()
+            busy = len(self.recent) > RATE
+            if self.path == "/rate" and busy:
+                self.throttled[0] += 1
+        if self.path == "/rate":
+            self._answer(429 if busy else 200)
+        elif self.path.startswith("/fail/"):
+            status = int(self.path.split("/")[2])
+            self._answer(status if hits == 1 else 200)
+        else:
+            self._answer(404)
+    do_GET = _handle
+    do_POST = _handle
+#----------------------------------------------------------------------
+def _free_port():
+    """ returns a port nothing listens on """
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+#----------------------------------------------------------------------
+def check(requests=200, threads=8):
+    """ runs the checks, returns the number that failed """
+    server = _Server(("127.0.0.1", 0), _Handler)
+    worker = threading.Thread(target=server.serve_forever)
+    worker.daemon = True
+    worker.start()
+    base = "http://127.0.0.1:%s" % server.server_address[1]
+    pool = connection.ConnectionPool(timeout=10)
+    failed = 0
+    def send(method, url):
+        scheduler = throttle.RequestScheduler(retries=8, backoff=0.05,
+                                              max_backoff=2)
+        return scheduler.execute(
+            url, lambda: pool.request(method, url,
+                                      "f=json" if method == "POST" else None),
+            method)
+    # many GETs through one scheduler
+    scheduler = throttle.RequestScheduler(retries=8, backoff=0.05,
+                                          max_backoff=2)
+    url = base + "/rate"
+    statuses = []
+    errors = []
+    lock = threading.Lock()
+    counter = iter(xrange(requests))
+    def run():
+        while True:
+            with lock:
+                if next(counter, None) is None:
+                    return
+            try:
+                res = scheduler.execute(url, lambda: pool.request("GET", url))
+                with lock:
+                    statuses.append(res.status)
+            except Exception, e:
+                with lock:
+                    errors.append(e)
+    started = time.time()
+    workers = [threading.Thread(target=run) for i in xrange(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    ok = statuses.count(200) == requests and not errors
+    failed += not ok
+    print "%-40s %s" % ("%s GETs from %s threads" % (requests, threads),
+                        "ok" if ok else "FAILED")
+    print "   %.1f s, %s throttled, %s errors, final rate %s" % \
+          (time.time() - started, _Handler.throttled[0], len(errors),
+           scheduler.host(url).rate)
+    # retry policy per method
+    cases = [("GET", 502, 2, 200), ("POST", 502, 1, 502),
+             ("POST", 503, 2, 200), ("POST", 429, 2, 200)]
+    for method, status, hits, expected in cases:
+        path = "/fail/%s/%s" % (status, method)
+        res = send(method, base + path)
+        ok = _Handler.hits.get(path) == hits and res.status == expected
+        failed += not ok
+        print "%-40s %s" % ("%s answered %s" % (method, status),
+                            "ok" if ok else "FAILED")
+        print "   sent %s times, returned %s" % (_Handler.hits.get(path),
+                                                 res.status)
+    # a connection that can not be opened
+    url = "http://127.0.0.1:%s/" % _free_port()
+    scheduler = throttle.RequestScheduler(retries=2, backoff=0.01)
+    attempts = []
+    def refused():
+        attempts.append(1)
+        return pool.request("POST", url, "f=json")
+    try:
+        scheduler.execute(url, refused, "POST")
+        ok = False
+    except connection.NotSentError:
+        ok = len(attempts) == 3
+    failed += not ok
+    print "%-40s %s" % ("POST to a closed port",
+                        "ok" if ok else "FAILED")
+    print "   sent %s times" % len(attempts)
+    pool.clear()
+    time.sleep(0.1)
+    server.shutdown()
+    server.server_close()
+    return failed
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:]]
+    if len(args) > 2:
+        RATE = args.pop()
+    sys.exit(check(*args))
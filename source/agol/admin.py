@@ -10,20 +10,18 @@ import mimetypes
 from arcpy import mapping
 from arcpy import env
 from base import BaseAGOLClass
+import jsonutils
 class AGOL(BaseAGOLClass):
     """ publishes to AGOL """
     _username = None
     _password = None
-    _token = None
     _url = "http://www.arcgis.com/sharing/rest"
     def __init__(self, username, password, token_url=None):
         """ constructor """
         self._username = username
         self._password = password
-        if token_url is None:
-            self._token = self.generate_token()[0]
-        else:
-            self._token = self.generate_token()[0]
+        self._token_url = token_url
+        self._token = self.generate_token(tokenURL=token_url)[0]
     #----------------------------------------------------------------------
     @property
     def contentRootURL(self):
@@ -80,7 +78,7 @@ class AGOL(BaseAGOLClass):
             "token" : self._token
         }
         url = self.contentRootURL + "/items/%s" % item_id
-        return self._do_get(url, params)
+        return self._get_metadata(url, params)
     #----------------------------------------------------------------------
     def _prep_mxd(self, mxd):
         """ ensures the requires mxd properties are set to something """
@@ -112,14 +110,14 @@ class AGOL(BaseAGOLClass):
         data = {"token": self._token,
                 "f": "json"}
         url = "http://www.arcgis.com/sharing/content/users/%s" % (self._username,)
-        jres = self._do_get(url=url, param_dict=data, header={"Accept-Encoding":""})
+        jres = self._do_get(url=url, param_dict=data)
         return jres
     def getUserInfo(self):
         """ gets a user's info on agol """
         data = {"token": self._token,
                 "f": "json"}
         url = "http://www.arcgis.com/sharing/rest/community/users/%s" % (self._username,)
-        jres = self._do_get(url=url, param_dict=data, header={"Accept-Encoding":""})
+        jres = self._do_get(url=url, param_dict=data)
         return jres
 
     #----------------------------------------------------------------------
@@ -146,7 +144,7 @@ class AGOL(BaseAGOLClass):
                                    files = files,
                                    fields=params,
                                    ssl=parsed.scheme.lower() == 'https')
-        res = self._unicode_convert(json.loads(res))
+        res = jsonutils.loads(res)
         return res
     #----------------------------------------------------------------------
     def deleteItem(self, item_id):
@@ -444,7 +442,6 @@ class AGOL(BaseAGOLClass):
            os.path.isfile(thumbnail):
 
             params['thumbnail'] = os.path.basename(thumbnail)
-            content = open(thumbnail, 'rb').read()
             parsed = urlparse.urlparse(uURL)
             port = parsed.port
             files = []
@@ -0,0 +1,161 @@
+"""
+   Server side statistics (outStatistics) for FeatureLayer.statistics.
+   Builds the statistics request, reads the response into columns and
+   combines the results of several partitions (object id ranges or
+   where clauses) into one, so an aggregate the server would truncate
+   can be computed in pieces.
+
+   count, sum, min and max are combined directly.  avg, var and stddev
+   are combined from per partition counts and averages, which are
+   requested alongside them.  Percentiles and having clauses can not be
+   combined across partitions.
+"""
+import math
+from collections import OrderedDict
+
+STATISTICS = ("count", "sum", "min", "max", "avg", "stddev", "var")
+_HELPER = "agol_%s_%s"
+#----------------------------------------------------------------------
+def normalize(stats):
+    """ returns a list of (statistic, field, alias) tuples from specs
+        given as tuples of two or three values
+    """
+    specs = []
+    for spec in stats:
+        if len(spec) == 2:
+            statistic, field = spec
+            alias = "%s_%s" % (statistic, field)
+        else:
+            statistic, field, alias = spec
+        specs.append((statistic.lower(), field, alias))
+    return specs
+#----------------------------------------------------------------------
+def out_statistics(specs, partitioned=False):
+    """ returns the outStatistics list of specs.  When partitioned, the
+        counts and averages needed to combine avg, var and stddev are
+        requested as well.
+    """
+    values = []
+    names = set()
+    def add(statistic, field, alias):
+        if alias not in names:
+            names.add(alias)
+            values.append({"statisticType": statistic,
+                           "onStatisticField": field,
+                           "outStatisticFieldName": alias})
+    for statistic, field, alias in specs:
+        add(statistic, field, alias)
+        if partitioned and statistic in ("avg", "var", "stddev"):
+            add("count", field, _HELPER % ("count", field))
+            if statistic != "avg":
+                add("avg", field, _HELPER % ("avg", field))
+    return values
+#----------------------------------------------------------------------
+def check_partitioned(specs, having):
+    """ raises ValueError for requests that can not be partitioned """
+    if having is not None:
+        raise ValueError("a having clause can not be combined across "
+                         "partitions")
+    for statistic, field, alias in specs:
+        if statistic not in STATISTICS:
+            raise ValueError("%s can not be combined across partitions" %
+                             statistic)
+#----------------------------------------------------------------------
+def _value(attributes, name):
+    """ reads an attribute, ignoring the case the server returned """
+    if name in attributes:
+        return attributes[name]
+    lower = name.lower()
+    for key, value in attributes.iteritems():
+        if key.lower() == lower:
+            return value
+    return None
+#----------------------------------------------------------------------
+def rows(result, group_by, names):
+    """ returns the (group key, {name: value}) rows of a response """
+    if 'error' in result:
+        raise ValueError(result)
+    values = []
+    for feature in result.get('features', []):
+        attributes = feature.get('attributes', {})
+        key = tuple(_value(attributes, field) for field in group_by)
+        values.append((key, dict((name, _value(attributes, name))
+                                 for name in names)))
+    return values
+#----------------------------------------------------------------------
+def columns(group_rows, group_by, specs):
+    """ turns (group key, values) rows into an ordered dictionary of
+        column name -> list, group by fields first
+    """
+    result = OrderedDict()
+    for index, field in enumerate(group_by):
+        result[field] = [key[index] for key, values in group_rows]
+    for statistic, field, alias in specs:
+        result[alias] = [values.get(alias) for key, values in group_rows]
+    return result
+#----------------------------------------------------------------------
+def _merge(statistic, a, b):
+    """ combines two partial count, sum, min or max values """
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if statistic in ("count", "sum"):
+        return a + b
+    if statistic == "min":
+        return min(a, b)
+    return max(a, b)
+#----------------------------------------------------------------------
+def combine(partitions, specs):
+    """ combines the rows of several partitions into one row per group,
+        sorted by the group key
+    """
+    groups = OrderedDict()
+    for partition in partitions:
+        for key, values in partition:
+            groups.setdefault(key, []).append(values)
+    combined = []
+    for key in sorted(groups.keys()):
+        parts = groups[key]
+        values = {}
+        for statistic, field, alias in specs:
+            if statistic in ("count", "sum", "min", "max"):
+                value = None
+                for part in parts:
+                    value = _merge(statistic, value, part.get(alias))
+                values[alias] = value
+                continue
+            count_name = _HELPER % ("count", field)
+            avg_name = alias if statistic == "avg" else \
+                       _HELPER % ("avg", field)
+            n = 0
+            mean = 0.0
+            m2 = 0.0
+            for part in parts:
+                part_n = part.get(count_name) or 0
+                if part_n == 0 or part.get(avg_name) is None:
+                    continue
+                part_mean = float(part[avg_name])
+                part_m2 = 0.0
+                if statistic != "avg" and part_n > 1:
+                    part_var = part.get(alias) or 0.0
+                    if statistic == "stddev":
+                        part_var = part_var ** 2
+                    part_m2 = part_var * (part_n - 1)
+                delta = part_mean - mean
+                total = n + part_n
+                mean += delta * part_n / total
+                m2 += part_m2 + delta ** 2 * n * part_n / total
+                n = total
+            if n == 0:
+                values[alias] = None
+            elif statistic == "avg":
+                values[alias] = mean
+            elif n < 2:
+                values[alias] = 0.0
+            elif statistic == "var":
+                values[alias] = m2 / (n - 1)
+            else:
+                values[alias] = math.sqrt(m2 / (n - 1))
+        combined.append((key, values))
+    return combined
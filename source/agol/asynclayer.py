@@ -0,0 +1,134 @@
+"""
+   Concurrent flavour of the FeatureLayer and FeatureService operations.
+   Each call is run on a bounded pool of worker threads and returns an
+   AsyncResult right away, so many layers or pages can be requested at
+   once.  The calls go through the regular sync methods, so parameters
+   and results are identical.
+
+   Example:
+      fl = layer.FeatureLayer(url)
+      afl = asynclayer.AsyncFeatureLayer(fl, max_concurrency=6)
+      pending = [afl.query(where="OBJECTID >= %s and OBJECTID < %s" %
+                           (i, i + 1000)) for i in xrange(0, 10000, 1000)]
+      pages = asynclayer.gather(pending)
+"""
+from multiprocessing.pool import ThreadPool
+
+#----------------------------------------------------------------------
+def gather(results, timeout=None):
+    """ waits for a list of AsyncResult objects and returns their values
+        in the same order.  The first error raised by a call is re-raised.
+    """
+    return [result.get(timeout) for result in results]
+########################################################################
+class _AsyncBase(object):
+    """ owns the worker pool shared by the async wrappers """
+    _pool = None
+    _max_concurrency = None
+    #----------------------------------------------------------------------
+    def __init__(self, max_concurrency=6, pool=None):
+        """Constructor"""
+        self._max_concurrency = max_concurrency
+        if pool is None:
+            pool = ThreadPool(max_concurrency)
+        self._pool = pool
+    #----------------------------------------------------------------------
+    @property
+    def max_concurrency(self):
+        """ number of requests run at once """
+        return self._max_concurrency
+    #----------------------------------------------------------------------
+    def _submit(self, func, *args, **kwargs):
+        """ runs func on the worker pool and returns an AsyncResult """
+        return self._pool.apply_async(func, args, kwargs)
+    #----------------------------------------------------------------------
+    def close(self):
+        """ waits for pending calls and stops the worker threads """
+        self._pool.close()
+        self._pool.join()
+    #----------------------------------------------------------------------
+    def __enter__(self):
+        return self
+    #----------------------------------------------------------------------
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+########################################################################
+class AsyncFeatureLayer(_AsyncBase):
+    """ runs FeatureLayer operations concurrently
+        Inputs:
+           featureLayer - layer.FeatureLayer or layer.TableLayer object
+           max_concurrency - number of requests run at once.  Keep this
+                             at or below the connection pool's
+                             max_per_host.
+           pool - optional ThreadPool to share between several wrappers
+    """
+    _layer = None
+    #----------------------------------------------------------------------
+    def __init__(self, featureLayer, max_concurrency=6, pool=None):
+        """Constructor"""
+        super(AsyncFeatureLayer, self).__init__(max_concurrency, pool)
+        self._layer = featureLayer
+    #----------------------------------------------------------------------
+    @property
+    def layer(self):
+        """ returns the wrapped FeatureLayer """
+        return self._layer
+    #----------------------------------------------------------------------
+    def query(self, *args, **kwargs):
+        """ FeatureLayer.query, returns an AsyncResult """
+        return self._submit(self._layer.query, *args, **kwargs)
+    #----------------------------------------------------------------------
+    def query_related_records(self, *args, **kwargs):
+        """ FeatureLayer.query_related_records, returns an AsyncResult """
+        return self._submit(self._layer.query_related_records,
+                            *args, **kwargs)
+    #----------------------------------------------------------------------
+    def applyEdits(self, *args, **kwargs):
+        """ FeatureLayer.applyEdits, returns an AsyncResult """
+        return self._submit(self._layer.applyEdits, *args, **kwargs)
+    #----------------------------------------------------------------------
+    def addAttachment(self, *args, **kwargs):
+        """ FeatureLayer.addAttachment, returns an AsyncResult """
+        return self._submit(self._layer.addAttachment, *args, **kwargs)
+    #----------------------------------------------------------------------
+    def listAttachments(self, *args, **kwargs):
+        """ FeatureLayer.listAttachments, returns an AsyncResult """
+        return self._submit(self._layer.listAttachments, *args, **kwargs)
+########################################################################
+class AsyncFeatureService(_AsyncBase):
+    """ runs FeatureService operations concurrently
+        Inputs:
+           featureService - featureservice.FeatureService object
+           max_concurrency - number of requests run at once.  Keep this
+                             at or below the connection pool's
+                             max_per_host.
+           pool - optional ThreadPool to share between several wrappers
+    """
+    _service = None
+    #----------------------------------------------------------------------
+    def __init__(self, featureService, max_concurrency=6, pool=None):
+        """Constructor"""
+        super(AsyncFeatureService, self).__init__(max_concurrency, pool)
+        self._service = featureService
+    #----------------------------------------------------------------------
+    @property
+    def service(self):
+        """ returns the wrapped FeatureService """
+        return self._service
+    #----------------------------------------------------------------------
+    def query(self, *args, **kwargs):
+        """ FeatureService.query, returns an AsyncResult """
+        return self._submit(self._service.query, *args, **kwargs)
+    #----------------------------------------------------------------------
+    def query_related_records(self, *args, **kwargs):
+        """ FeatureService.query_related_records, returns an AsyncResult """
+        return self._submit(self._service.query_related_records,
+                            *args, **kwargs)
+    #----------------------------------------------------------------------
+    def layers(self):
+        """ returns a list of AsyncFeatureLayer objects, one per layer of
+            the service, sharing this object's worker pool.  Closing
+            any of them closes the shared pool.
+        """
+        return [AsyncFeatureLayer(l, self._max_concurrency, self._pool)
+                for l in self._service.layers]
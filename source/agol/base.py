@@ -2,17 +2,28 @@
    Base Class from which AGOL function inherit from.
 """
 import os
+import time
 import urllib
 import urllib2
 import json
-import httplib
 import zipfile
 import glob
 import calendar
 import datetime
 import mimetypes
 import mimetools
+import urlparse
+import hashlib
 from cStringIO import StringIO
+import connection
+import tokens
+import multipart
+import download
+import jsonutils
+import throttle
+import instrument
+import metacache
+import querycache
 
 ########################################################################
 class Geometry(object):
@@ -20,10 +31,13 @@ class Geometry(object):
     pass
 ########################################################################
 class BaseAGOLClass(object):
+    __slots__ = ()
     _token_url = None
-    _token = None
+    _static_token = None
     _username = None
     _password = None
+    _referer = tokens.DEFAULT_REFERER
+    _max_url_length = 2000
     #----------------------------------------------------------------------
     def _unzip_file(self, zip_file, out_folder):
         """ unzips a file to a given folder """
@@ -50,34 +64,52 @@ class BaseAGOLClass(object):
         files.sort()
         return files
     #----------------------------------------------------------------------
-    def _download_file(self, url, save_path, file_name):
-        """ downloads a file """
-        file_data = urllib2.urlopen(url)
-        with open(save_path + os.sep + file_name, 'wb') as writer:
-            writer.write(file_data.read())
-        return save_path + os.sep + file_name
+    def _download_file(self, url, save_path, file_name, parallel=1):
+        """ downloads a file to disk in blocks, resuming interrupted
+            transfers.  parallel > 1 fetches large files as several range
+            requests at once.
+        """
+        downloader = download.Downloader(parallel=parallel)
+        return downloader.download(url=url,
+                                   file_path=save_path + os.sep + file_name)
     #----------------------------------------------------------------------
     def generate_token(self, tokenURL=None):
-        """ generates a token for a feature service """
-        referer='https://www.arcgis.com'
+        """ generates a token for a feature service.  Tokens are cached
+            per credential by tokens.default_manager, so objects sharing
+            a login share one token.
+        """
         if tokenURL is None:
-            tokenUrl  = 'https://arcgis.com/sharing/rest/generateToken'
-        query_dict = {'username': self._username,
-                      'password': self._password,
-                      'expiration': str(60),
-                      'referer': referer,
-                      'f': 'json'}
-        query_string = urllib.urlencode(query_dict)
-        token = json.loads(urllib.urlopen(tokenUrl + "?f=json", query_string).read())
-        if "token" not in token:
-            self._token = None
+            tokenURL = self._token_url
+        token = tokens.default_manager.get_token(username=self._username,
+                                                 password=self._password,
+                                                 token_url=tokenURL,
+                                                 referer=self._referer)
+        if token is None:
             return None
         else:
             httpPrefix = "http://www.arcgis.com/sharing/rest"
-            if token['ssl'] == True:
+            if token[1] == True:
                 httpPrefix = "https://www.arcgis.com/sharing/rest"
-            self._token = token['token']
-            return token['token'], httpPrefix
+            return token[0], httpPrefix
+    #----------------------------------------------------------------------
+    @property
+    def _token(self):
+        """ returns the current token.  When the object has credentials
+            the token comes from the shared token manager, which keeps it
+            refreshed.
+        """
+        if self._username is not None and \
+           self._password is not None:
+            token = self.generate_token()
+            if token is None:
+                return None
+            return token[0]
+        return self._static_token
+    #----------------------------------------------------------------------
+    @_token.setter
+    def _token(self, value):
+        """ sets a token for objects without credentials """
+        self._static_token = value
     #----------------------------------------------------------------------
     @property
     def username(self):
@@ -99,22 +131,142 @@ class BaseAGOLClass(object):
         """ sets the username's password """
         self._password = value
     #----------------------------------------------------------------------
-    def _do_post(self, url, param_dict):
+    def _request(self, method, url, body=None, headers=None, info=None):
+        """ sends a request over the shared keep-alive connection pool
+            and returns the response body.  Requests are paced by the
+            host's budget in throttle.default_scheduler, which retries
+            throttled and transient failures.  HTTP errors are raised as
+            urllib2.HTTPError.  info is the instrument record of the
+            call; if None the request is recorded on its own.
+        """
+        return self._send(method, url, body, headers, info).data
+    #----------------------------------------------------------------------
+    def _send(self, method, url, body=None, headers=None, info=None):
+        """ same as _request, but returns the connection.Response """
+        record = info
+        if record is None:
+            record = instrument.before(method, url, body)
+        try:
+            send = lambda: connection.default_pool.request(method, url,
+                                                           body, headers)
+            res = throttle.default_scheduler.execute(url, send, method)
+            instrument.response(record, res)
+            if res.status >= 400:
+                raise urllib2.HTTPError(res.url, res.status, res.reason,
+                                        res.headers, StringIO(res.data))
+            return res
+        except Exception, e:
+            record['error'] = e
+            raise
+        finally:
+            if info is None:
+                instrument.after(record)
+    #----------------------------------------------------------------------
+    def _json_request(self, method, url, body=None, headers=None):
+        """ sends a request and decodes its JSON response, recording the
+            request and the decode time for the instrument hooks
+        """
+        info = instrument.before(method, url, body)
+        try:
+            result = self._request(method, url, body, headers, info)
+            started = time.time()
+            value = jsonutils.loads(result)
+            info['decode'] = time.time() - started
+            return value
+        except Exception, e:
+            info['error'] = e
+            raise
+        finally:
+            instrument.after(info)
+    #----------------------------------------------------------------------
+    def _do_post(self, url, param_dict, header={}):
         """ performs the POST operation and returns dictionary result """
-        request = urllib2.Request(url, urllib.urlencode(param_dict))
-        result = urllib2.urlopen(request).read()
-        jres = json.loads(result)
-        return self._unicode_convert(jres)
+        headers = dict(header)
+        headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        return self._json_request("POST", url, urllib.urlencode(param_dict),
+                                  headers)
     #----------------------------------------------------------------------
     def _do_get(self, url, param_dict, header={}):
-        """ performs a get operation """
-        url = url + "?%s" % urllib.urlencode(param_dict)
-        request = urllib2.Request(url, headers=header)
-        result = urllib2.urlopen(request).read()
-        jres = json.loads(result)
-        return self._unicode_convert(jres)
+        """ performs a get operation.  Requests whose url would be longer
+            than _max_url_length characters (long where clauses, large
+            objectIds lists, detailed geometries) are sent as a POST.
+        """
+        query = urllib.urlencode(param_dict)
+        if len(url) + len(query) + 1 > self._max_url_length:
+            return self._do_post(url, param_dict, header)
+        return self._json_request("GET", url + "?%s" % query,
+                                  headers=dict(header))
+    #----------------------------------------------------------------------
+    def _get_metadata(self, url, param_dict):
+        """ GETs a service, layer or item JSON document through
+            metacache.default_cache.  Fresh entries are returned without a
+            request, stale ones are revalidated with a conditional GET.
+            Falls back to _do_get when the cache is off.
+        """
+        cache = metacache.default_cache
+        if not cache.enabled:
+            return self._do_get(url, param_dict)
+        key = cache.key(url, param_dict, self._metadata_scope)
+        entry = cache.get(key)
+        if entry is not None and cache.is_fresh(entry):
+            return entry['value']
+        headers = {}
+        if entry is not None:
+            if entry['etag'] is not None:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified'] is not None:
+                headers['If-Modified-Since'] = entry['last_modified']
+        full_url = url + "?%s" % urllib.urlencode(param_dict)
+        info = instrument.before("GET", full_url)
+        try:
+            res = self._send("GET", full_url, headers=headers, info=info)
+            if res.status == 304 and entry is not None:
+                cache.touch(key, entry)
+                return entry['value']
+            started = time.time()
+            value = jsonutils.loads(res.data)
+            info['decode'] = time.time() - started
+        except Exception, e:
+            info['error'] = e
+            raise
+        finally:
+            instrument.after(info)
+        if isinstance(value, dict) and not 'error' in value:
+            cache.put(key, value,
+                      etag=res.headers.getheader('etag'),
+                      last_modified=res.headers.getheader('last-modified'))
+        return value
+    #----------------------------------------------------------------------
+    def _cached_get(self, url, param_dict):
+        """ _do_get through querycache.default_cache.  Results are
+            returned from the cache when a backend is configured and the
+            same request was answered before.
+        """
+        cache = querycache.default_cache
+        if not cache.enabled:
+            return self._do_get(url, param_dict)
+        value = cache.get(url, param_dict, self._metadata_scope)
+        if value is None:
+            value = self._do_get(url, param_dict)
+            if isinstance(value, dict) and not 'error' in value:
+                cache.put(url, param_dict, value, self._metadata_scope)
+        return value
+    #----------------------------------------------------------------------
+    def _invalidate_metadata(self, url, param_dict={"f": "json"}):
+        """ removes a document from metacache.default_cache """
+        cache = metacache.default_cache
+        cache.invalidate(cache.key(url, param_dict, self._metadata_scope))
+    #----------------------------------------------------------------------
+    @property
+    def _metadata_scope(self):
+        """ credential scope of the metadata cache keys """
+        if self._username is None:
+            if self._static_token is not None:
+                return "token:%s" % hashlib.sha1(self._static_token).hexdigest()
+            return "anonymous"
+        return "%s@%s" % (self._username,
+                          self._token_url or tokens.DEFAULT_TOKEN_URL)
     #----------------------------------------------------------------------
-
     def _post_multipart(self, host, selector, fields, files, ssl=False,port=None):
         """ performs a multi-post to AGOL or AGS
             Inputs:
@@ -142,35 +294,40 @@ class BaseAGOLClass(object):
         boundary, body = self._encode_multipart_formdata(fields, files)
         headers = {
         'User-Agent': "ArcREST",
-        'Content-Type': 'multipart/form-data; boundary=%s' % boundary
+        'Content-Type': 'multipart/form-data; boundary=%s' % boundary,
+        'Content-Length': str(len(body))
         }
         if ssl:
-            h = httplib.HTTPSConnection(host, port=port)
-            h.request('POST', selector, body, headers)
+            scheme = "https"
         else:
-            h = httplib.HTTPConnection(host, port=port)
-            h.request('POST', selector, body, headers)
-        return h.getresponse().read()
+            scheme = "http"
+        if port is not None:
+            host = "%s:%s" % (host, port)
+        url = urlparse.urlunparse((scheme, host, selector, '', '', ''))
+        try:
+            return self._request("POST", url, body, headers)
+        finally:
+            body.close()
 
     def _encode_multipart_formdata(self, fields, files):
+        """ builds a streaming multipart body.  Files are not read until
+            the body is sent, so large uploads use constant memory.
+        """
         boundary = mimetools.choose_boundary()
-        buf = StringIO()
+        body = multipart.MultipartBody()
         for (key, value) in fields.iteritems():
-            buf.write('--%s\r\n' % boundary)
-            buf.write('Content-Disposition: form-data; name="%s"' % key)
-            buf.write('\r\n\r\n' + self._tostr(value) + '\r\n')
+            body.add_data('--%s\r\n' % boundary +
+                          'Content-Disposition: form-data; name="%s"' % key +
+                          '\r\n\r\n' + self._tostr(value) + '\r\n')
         for (key, filepath, filename) in files:
-            buf.write('--%s\r\n' % boundary)
-            buf.write('Content-Disposition: form-data; name="%s"; filename="%s"\r\n' % (key, filename))
-            buf.write('Content-Type: %s\r\n' % (self._get_content_type(filename)))
-            file = open(filepath, "rb")
-            try:
-                buf.write('\r\n' + file.read() + '\r\n')
-            finally:
-                file.close()
-        buf.write('--' + boundary + '--\r\n\r\n')
-        buf = buf.getvalue()
-        return boundary, buf
+            body.add_data('--%s\r\n' % boundary +
+                          'Content-Disposition: form-data; name="%s"; filename="%s"\r\n' % (key, filename) +
+                          'Content-Type: %s\r\n' % (self._get_content_type(filename)) +
+                          '\r\n')
+            body.add_file(filepath)
+            body.add_data('\r\n')
+        body.add_data('--' + boundary + '--\r\n\r\n')
+        return boundary, body
 
     def _get_content_type(self, filename):
 
@@ -192,16 +349,9 @@ class BaseAGOLClass(object):
         if not obj:
             return ''
         if isinstance(obj, list):
-            return ', '.join(map(_tostr, obj))
+            return ', '.join(map(self._tostr, obj))
         return str(obj)
     #----------------------------------------------------------------------
     def _unicode_convert(self, obj):
         """ converts unicode to anscii """
-        if isinstance(obj, dict):
-            return {self._unicode_convert(key): self._unicode_convert(value) for key, value in obj.iteritems()}
-        elif isinstance(obj, list):
-            return [self._unicode_convert(element) for element in obj]
-        elif isinstance(obj, unicode):
-            return obj.encode('utf-8')
-        else:
-            return obj
+        return jsonutils.unicode_convert(obj)
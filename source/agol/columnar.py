@@ -0,0 +1,263 @@
+"""
+   Columnar query results backed by NumPy arrays.  A query response is
+   decoded straight into one array per field, typed from the response's
+   field list, instead of one common.Feature object per row:
+
+      esriFieldTypeOID, esriFieldTypeBigInteger - int64
+      esriFieldTypeInteger - int32
+      esriFieldTypeSmallInteger - int16
+      esriFieldTypeDouble - float64
+      esriFieldTypeSingle - float32
+      esriFieldTypeDate - datetime64[ms] (null is NaT)
+      other types (strings, GUIDs, blobs) - object
+
+   Integer columns holding nulls are returned as numpy.ma masked arrays.
+
+   Geometries are decoded into coordinate arrays.  Points give x and y
+   (and z/m) arrays with NaN for empty geometries.  Multipoints, lines
+   and polygons give one coords buffer of shape (n, dims) plus offsets:
+   feature i owns parts part_offsets[geometry_offsets[i]] to
+   part_offsets[geometry_offsets[i + 1]], and part j owns
+   coords[part_offsets[j]:part_offsets[j + 1]].  A multipoint has a
+   single part per feature.
+
+   Needs NumPy but not arcpy.
+"""
+import numpy
+
+FIELD_DTYPES = {
+    "esriFieldTypeOID": numpy.int64,
+    "esriFieldTypeBigInteger": numpy.int64,
+    "esriFieldTypeInteger": numpy.int32,
+    "esriFieldTypeSmallInteger": numpy.int16,
+    "esriFieldTypeDouble": numpy.float64,
+    "esriFieldTypeSingle": numpy.float32,
+    "esriFieldTypeDate": "datetime64[ms]",
+}
+_NAT = numpy.iinfo(numpy.int64).min
+#----------------------------------------------------------------------
+def _column(values, field_type):
+    """ converts a list of attribute values to an array for a field type """
+    dtype = FIELD_DTYPES.get(field_type, object)
+    if dtype is object:
+        column = numpy.empty(len(values), dtype=object)
+        column[:] = values
+        return column
+    if dtype == "datetime64[ms]":
+        return numpy.array([_NAT if v is None else v for v in values],
+                           dtype=numpy.int64).view("datetime64[ms]")
+    if numpy.issubdtype(dtype, numpy.floating):
+        return numpy.array([numpy.nan if v is None else v for v in values],
+                           dtype=dtype)
+    if None in values:
+        mask = [v is None for v in values]
+        return numpy.ma.masked_array([0 if v is None else v
+                                      for v in values],
+                                     mask=mask, dtype=dtype)
+    return numpy.array(values, dtype=dtype)
+########################################################################
+class ColumnarResult(object):
+    """ query results held as one NumPy array per field
+        Inputs:
+           featureset - a query response (esri JSON feature set
+                        dictionary)
+           fields - optional field list used when the response has none,
+                    e.g. FeatureLayer.fields
+    """
+    _columns = None
+    _fields = None
+    _geometryType = None
+    _spatialReference = None
+    _geometry = None
+    _count = None
+    #----------------------------------------------------------------------
+    def __init__(self, featureset=None, fields=None):
+        """Constructor"""
+        self._columns = {}
+        self._geometry = {}
+        self._fields = []
+        self._count = 0
+        if featureset is not None:
+            self._decode(featureset, fields)
+    #----------------------------------------------------------------------
+    def _decode(self, featureset, fields):
+        """ fills the columns from a query response """
+        features = featureset.get('features', [])
+        self._fields = featureset.get('fields') or fields or []
+        self._geometryType = featureset.get('geometryType')
+        self._spatialReference = featureset.get('spatialReference')
+        self._count = len(features)
+        types = dict((f['name'], f.get('type')) for f in self._fields)
+        names = [f['name'] for f in self._fields]
+        if len(features) > 0:
+            for name in features[0].get('attributes', {}).keys():
+                if name not in types:
+                    names.append(name)
+        attributes = [feature.get('attributes', {}) for feature in features]
+        for name in names:
+            values = [row.get(name) for row in attributes]
+            self._columns[name] = _column(values, types.get(name))
+        if len(features) > 0 and 'geometry' in features[0]:
+            geometries = [feature.get('geometry') for feature in features]
+            self._geometry = _decode_geometries(
+                geometries, self._geometryType,
+                featureset.get('hasZ', False), featureset.get('hasM', False))
+    #----------------------------------------------------------------------
+    def __len__(self):
+        """ number of features """
+        return self._count
+    #----------------------------------------------------------------------
+    def __getitem__(self, name):
+        """ returns the array of a field """
+        return self._columns[name]
+    #----------------------------------------------------------------------
+    def __contains__(self, name):
+        return name in self._columns
+    #----------------------------------------------------------------------
+    @property
+    def columns(self):
+        """ dictionary of field name -> array """
+        return self._columns
+    #----------------------------------------------------------------------
+    @property
+    def fields(self):
+        """ field list of the result """
+        return self._fields
+    #----------------------------------------------------------------------
+    @property
+    def geometryType(self):
+        """ esri geometry type of the result """
+        return self._geometryType
+    #----------------------------------------------------------------------
+    @property
+    def spatialReference(self):
+        """ spatial reference dictionary of the result """
+        return self._spatialReference
+    #----------------------------------------------------------------------
+    @property
+    def geometry(self):
+        """ dictionary of geometry arrays: x, y (z, m) for points, or
+            coords, part_offsets and geometry_offsets for other types.
+            Empty when the query returned no geometry.
+        """
+        return self._geometry
+    #----------------------------------------------------------------------
+    @classmethod
+    def concat(cls, results):
+        """ joins a list of ColumnarResult objects, e.g. the pages of a
+            query, into one
+        """
+        results = [r for r in results if len(r) > 0] or results[:1]
+        joined = cls()
+        if len(results) == 0:
+            return joined
+        first = results[0]
+        joined._fields = first._fields
+        joined._geometryType = first._geometryType
+        joined._spatialReference = first._spatialReference
+        joined._count = sum(len(r) for r in results)
+        for name in first._columns:
+            arrays = [r._columns[name] for r in results]
+            if any(isinstance(a, numpy.ma.MaskedArray) for a in arrays):
+                joined._columns[name] = numpy.ma.concatenate(arrays)
+            else:
+                joined._columns[name] = numpy.concatenate(arrays)
+        templates = [r._geometry for r in results if r._geometry]
+        if templates:
+            joined._geometry = _concat_geometries(
+                [r._geometry or _empty_geometry(templates[0], len(r))
+                 for r in results])
+        return joined
+#----------------------------------------------------------------------
+def _dims(geometries, hasZ=False, hasM=False):
+    """ number of coordinate values per vertex (2, 3 or 4), from the
+        feature set's hasZ/hasM or else the first geometry's
+    """
+    if hasZ or hasM:
+        return 2 + int(hasZ) + int(hasM)
+    for geometry in geometries:
+        if geometry:
+            dims = 2
+            if geometry.get('hasZ', False):
+                dims += 1
+            if geometry.get('hasM', False):
+                dims += 1
+            return dims
+    return 2
+#----------------------------------------------------------------------
+def _decode_geometries(geometries, geometry_type, hasZ=False, hasM=False):
+    """ converts a list of esri JSON geometries to coordinate arrays """
+    if geometry_type == "esriGeometryPoint":
+        x = numpy.array([g['x'] if g and g.get('x') is not None
+                         else numpy.nan for g in geometries],
+                        dtype=numpy.float64)
+        y = numpy.array([g['y'] if g and g.get('y') is not None
+                         else numpy.nan for g in geometries],
+                        dtype=numpy.float64)
+        result = {"x": x, "y": y}
+        for key, flag in (("z", hasZ), ("m", hasM)):
+            if flag or any(g and key in g for g in geometries):
+                result[key] = numpy.array(
+                    [g.get(key, numpy.nan) if g else numpy.nan
+                     for g in geometries], dtype=numpy.float64)
+        return result
+    if geometry_type == "esriGeometryMultipoint":
+        key = "points"
+    elif geometry_type == "esriGeometryPolyline":
+        key = "paths"
+    else:
+        key = "rings"
+    dims = _dims(geometries, hasZ, hasM)
+    coords = []
+    part_offsets = [0]
+    geometry_offsets = [0]
+    for geometry in geometries:
+        if not geometry:
+            parts = []
+        elif key == "points":
+            parts = [geometry.get('points', [])]
+        else:
+            parts = geometry.get(key, [])
+        for part in parts:
+            for vertex in part:
+                if len(vertex) < dims:
+                    vertex = list(vertex) + [numpy.nan] * (dims - len(vertex))
+                coords.append(vertex[:dims])
+            part_offsets.append(len(coords))
+        geometry_offsets.append(len(part_offsets) - 1)
+    return {"coords": numpy.array(coords, dtype=numpy.float64).reshape(
+                -1, dims),
+            "part_offsets": numpy.array(part_offsets, dtype=numpy.int64),
+            "geometry_offsets": numpy.array(geometry_offsets,
+                                            dtype=numpy.int64)}
+#----------------------------------------------------------------------
+def _empty_geometry(template, count):
+    """ geometry arrays of count features without geometry, shaped like
+        template
+    """
+    if "x" in template:
+        return dict((key, numpy.full(count, numpy.nan)) for key in template)
+    return {"coords": numpy.empty((0, template['coords'].shape[1]),
+                                  dtype=numpy.float64),
+            "part_offsets": numpy.zeros(1, dtype=numpy.int64),
+            "geometry_offsets": numpy.zeros(count + 1, dtype=numpy.int64)}
+#----------------------------------------------------------------------
+def _concat_geometries(geometries):
+    """ joins the geometry arrays of several results """
+    if "x" in geometries[0]:
+        return dict((key, numpy.concatenate([g[key] for g in geometries]))
+                    for key in geometries[0])
+    coords = []
+    part_offsets = [numpy.zeros(1, dtype=numpy.int64)]
+    geometry_offsets = [numpy.zeros(1, dtype=numpy.int64)]
+    vertex_base = 0
+    part_base = 0
+    for g in geometries:
+        coords.append(g['coords'])
+        part_offsets.append(g['part_offsets'][1:] + vertex_base)
+        geometry_offsets.append(g['geometry_offsets'][1:] + part_base)
+        vertex_base += len(g['coords'])
+        part_base += len(g['part_offsets']) - 1
+    return {"coords": numpy.concatenate(coords),
+            "part_offsets": numpy.concatenate(part_offsets),
+            "geometry_offsets": numpy.concatenate(geometry_offsets)}
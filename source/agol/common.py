@@ -1,8 +1,13 @@
 import os
 import copy
 import json
-import arcpy
+try:
+    import arcpy
+except ImportError:
+    # arcpy is only needed by the feature class and geometry helpers
+    arcpy = None
 from base import Geometry 
+import jsonutils
 import datetime
 import calendar
 
@@ -70,7 +75,7 @@ def featureclass_to_json(fc):
     """ converts a feature class to a json dictionary representation """
     featureSet = arcpy.FeatureSet(fc)# Load the feature layer into a feature set
     desc = arcpy.Describe(featureSet)# this will allow us to use the json property of the feature set
-    return json.loads(desc.json)   
+    return jsonutils.loads(desc.json)
 #----------------------------------------------------------------------
 def json_to_featureclass(json_file, out_fc):
     """ converts a json file (.json) to a feature class """
@@ -90,6 +95,50 @@ def merge_feature_class(merges, out_fc, cleanUp=True):
             del m
         return merged
 #----------------------------------------------------------------------
+def insert_json_features(fc, featureset):
+    """ appends the features of a query response (esri JSON feature set
+        dictionary) to an existing feature class.  Attributes are matched
+        by field name, dates are converted from epoch milliseconds and
+        geometries are created with the response's spatial reference.
+        Returns the number of rows inserted.
+    """
+    features = featureset.get('features', [])
+    if len(features) == 0:
+        return 0
+    date_fields = [f['name'] for f in featureset.get('fields', [])
+                   if f.get('type') == 'esriFieldTypeDate']
+    out_fields = [f.name for f in arcpy.ListFields(fc)
+                  if f.type not in ('OID', 'Geometry')]
+    names = [name for name in features[0]['attributes'].keys()
+             if name in out_fields]
+    has_shape = 'geometry' in features[0] and \
+                arcpy.Describe(fc).dataType in ('FeatureClass', 'ShapeFile')
+    cursor_fields = list(names)
+    if has_shape:
+        cursor_fields.append("SHAPE@")
+    sr = featureset.get('spatialReference')
+    count = 0
+    with arcpy.da.InsertCursor(fc, cursor_fields) as cursor:
+        for feature in features:
+            attributes = feature['attributes']
+            row = []
+            for name in names:
+                value = attributes.get(name)
+                if name in date_fields and value is not None:
+                    value = datetime.datetime.utcfromtimestamp(value / 1000.0)
+                row.append(value)
+            if has_shape:
+                geometry = feature.get('geometry')
+                if geometry is not None:
+                    geometry = dict(geometry)
+                    if sr is not None and not 'spatialReference' in geometry:
+                        geometry['spatialReference'] = sr
+                    geometry = arcpy.AsShape(geometry, True)
+                row.append(geometry)
+            cursor.insertRow(row)
+            count += 1
+    return count
+#----------------------------------------------------------------------
 def scratchFolder():
     """ returns the scratch foldre """
     return arcpy.env.scratchFolder
@@ -751,15 +800,4 @@ class Feature(object):
                 del row
         return features    
 #----------------------------------------------------------------------
-def _unicode_convert(obj):
-    """ converts unicode to anscii """
-    if isinstance(obj, dict):
-        return {_unicode_convert(key): \
-                _unicode_convert(value) \
-                for key, value in obj.iteritems()}
-    elif isinstance(obj, list):
-        return [_unicode_convert(element) for element in obj]
-    elif isinstance(obj, unicode):
-        return obj.encode('utf-8')
-    else:
-        return obj     
\ No newline at end of file
+_unicode_convert = jsonutils.unicode_convert
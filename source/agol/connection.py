@@ -0,0 +1,502 @@
+"""
+   Persistent (keep-alive) HTTP/HTTPS connection pool shared by every
+   REST call made through BaseAGOLClass.  Responses are requested with
+   gzip/deflate compression and decompressed as they are read.
+"""
+import sys
+import time
+import zlib
+import socket
+import select
+import httplib
+import urlparse
+import threading
+
+_REDIRECTS = (301, 302, 303, 307, 308)
+_MAX_REDIRECTS = 5
+_ACCEPT_ENCODING = "gzip, deflate"
+# methods that may be sent again after a response was lost
+_IDEMPOTENT = ("GET", "HEAD")
+########################################################################
+class NotSentError(socket.error):
+    """ raised when a request failed before it was sent, e.g. the
+        connection could not be opened, so it is safe to send it again
+        whatever its method
+    """
+    pass
+#----------------------------------------------------------------------
+def _connector(addresses):
+    """ returns a socket.create_connection replacement that connects to
+        the addresses of an earlier getaddrinfo call, so the host is
+        resolved once per connection
+    """
+    def create_connection(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT,
+                          source_address=None):
+        error = socket.error("getaddrinfo returned no address")
+        for family, socktype, proto, canonname, sockaddr in addresses:
+            sock = None
+            try:
+                sock = socket.socket(family, socktype, proto)
+                if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                    sock.settimeout(timeout)
+                if source_address:
+                    sock.bind(source_address)
+                sock.connect(sockaddr)
+                return sock
+            except socket.error, e:
+                error = e
+                if sock is not None:
+                    sock.close()
+        raise error
+    return create_connection
+#----------------------------------------------------------------------
+def _dropped(conn):
+    """ True if an idle connection can not be reused: it has no socket,
+        or the socket is readable, which for a connection waiting for
+        its next request means the server closed it (or sent data no
+        request asked for)
+    """
+    if conn.sock is None:
+        return True
+    try:
+        return len(select.select([conn.sock], [], [], 0)[0]) > 0
+    except (select.error, socket.error, ValueError):
+        return True
+#----------------------------------------------------------------------
+def _closed_unanswered(error):
+    """ True for a BadStatusLine raised because the connection closed
+        before any byte of the response was read, i.e. a keep-alive
+        connection the server dropped before it read the request
+    """
+    line = getattr(error, 'line', None)
+    return line in ("''", '""') or \
+           str(line).startswith("No status line received")
+########################################################################
+class Response(object):
+    """ the result of a request made through the ConnectionPool """
+    _url = None
+    _status = None
+    _reason = None
+    _headers = None
+    _data = None
+    _wire_bytes = None
+    _timings = None
+    #----------------------------------------------------------------------
+    def __init__(self, url, status, reason, headers, data, wire_bytes=None,
+                 timings=None):
+        """Constructor"""
+        self._url = url
+        self._status = status
+        self._reason = reason
+        self._headers = headers
+        self._data = data
+        if wire_bytes is None:
+            wire_bytes = len(data)
+        self._wire_bytes = wire_bytes
+        if timings is None:
+            timings = {}
+        self._timings = timings
+    #----------------------------------------------------------------------
+    @property
+    def url(self):
+        """ returns the final url of the request """
+        return self._url
+    #----------------------------------------------------------------------
+    @property
+    def status(self):
+        """ returns the HTTP status code """
+        return self._status
+    #----------------------------------------------------------------------
+    @property
+    def reason(self):
+        """ returns the HTTP reason phrase """
+        return self._reason
+    #----------------------------------------------------------------------
+    @property
+    def headers(self):
+        """ returns the response headers as a mimetools.Message """
+        return self._headers
+    #----------------------------------------------------------------------
+    @property
+    def data(self):
+        """ returns the response body """
+        return self._data
+    #----------------------------------------------------------------------
+    @property
+    def wire_bytes(self):
+        """ returns the number of body bytes received, before
+            decompression
+        """
+        return self._wire_bytes
+    #----------------------------------------------------------------------
+    @property
+    def decoded_bytes(self):
+        """ returns the number of body bytes after decompression """
+        return len(self._data)
+    #----------------------------------------------------------------------
+    @property
+    def timings(self):
+        """ returns a dictionary of the dns, connect and ttfb (time to
+            first byte) durations of the request in seconds
+        """
+        return self._timings
+########################################################################
+class ConnectionPool(object):
+    """ keeps persistent connections open per (scheme, host, port) so
+        repeated REST calls skip the TCP and TLS handshakes
+        Inputs:
+           max_size - total number of idle connections kept open
+           max_per_host - maximum number of connections (idle or in use)
+                          opened to a single host at any time. None means
+                          no limit.
+           idle_timeout - seconds an idle connection is kept before it is
+                          closed instead of reused
+           timeout - socket timeout in seconds for new connections
+    """
+    _max_size = None
+    _max_per_host = None
+    _idle_timeout = None
+    _timeout = None
+    #----------------------------------------------------------------------
+    def __init__(self, max_size=20, max_per_host=6,
+                 idle_timeout=60, timeout=120):
+        """Constructor"""
+        self._max_size = max_size
+        self._max_per_host = max_per_host
+        self._idle_timeout = idle_timeout
+        self._timeout = timeout
+        self._idle = {}
+        self._active = {}
+        self._wire_bytes = 0
+        self._decoded_bytes = 0
+        self._lock = threading.Condition(threading.Lock())
+    #----------------------------------------------------------------------
+    def configure(self, max_size=None, max_per_host=None,
+                  idle_timeout=None, timeout=None):
+        """ changes the pool settings, only the values given are set """
+        with self._lock:
+            if max_size is not None:
+                self._max_size = max_size
+            if max_per_host is not None:
+                self._max_per_host = max_per_host
+            if idle_timeout is not None:
+                self._idle_timeout = idle_timeout
+            if timeout is not None:
+                self._timeout = timeout
+            self._lock.notify_all()
+    #----------------------------------------------------------------------
+    @property
+    def max_size(self):
+        """ total number of idle connections kept """
+        return self._max_size
+    #----------------------------------------------------------------------
+    @property
+    def max_per_host(self):
+        """ maximum connections to a single host """
+        return self._max_per_host
+    #----------------------------------------------------------------------
+    @property
+    def idle_timeout(self):
+        """ seconds an idle connection is reused for """
+        return self._idle_timeout
+    #----------------------------------------------------------------------
+    @property
+    def timeout(self):
+        """ socket timeout in seconds """
+        return self._timeout
+    #----------------------------------------------------------------------
+    @property
+    def wire_bytes(self):
+        """ total response body bytes received by the pool """
+        return self._wire_bytes
+    #----------------------------------------------------------------------
+    @property
+    def decoded_bytes(self):
+        """ total response body bytes after decompression """
+        return self._decoded_bytes
+    #----------------------------------------------------------------------
+    def _count(self, wire_bytes, decoded_bytes):
+        """ adds a response to the byte counters """
+        with self._lock:
+            self._wire_bytes += wire_bytes
+            self._decoded_bytes += decoded_bytes
+    #----------------------------------------------------------------------
+    def _new_connection(self, key):
+        """ creates an unconnected httplib connection for a pool key """
+        scheme, host, port = key
+        if scheme == "https":
+            return httplib.HTTPSConnection(host, port=port,
+                                           timeout=self._timeout)
+        return httplib.HTTPConnection(host, port=port,
+                                      timeout=self._timeout)
+    #----------------------------------------------------------------------
+    def _idle_count(self):
+        """ number of idle connections over all hosts """
+        return sum(len(v) for v in self._idle.itervalues())
+    #----------------------------------------------------------------------
+    def acquire(self, key):
+        """ returns a (connection, reused) tuple for a pool key, blocking
+            while the host is at its connection limit.  Idle connections
+            the server has closed are discarded instead of reused.
+        """
+        with self._lock:
+            while True:
+                idle = self._idle.get(key, [])
+                now = time.time()
+                while len(idle) > 0:
+                    conn, last_used = idle.pop()
+                    if now - last_used <= self._idle_timeout and \
+                       not _dropped(conn):
+                        self._active[key] = self._active.get(key, 0) + 1
+                        return conn, True
+                    conn.close()
+                in_use = self._active.get(key, 0)
+                if self._max_per_host is None or \
+                   in_use < self._max_per_host:
+                    self._active[key] = in_use + 1
+                    return self._new_connection(key), False
+                self._lock.wait()
+    #----------------------------------------------------------------------
+    def release(self, key, conn, reusable=True):
+        """ returns a connection to the pool, closing it if it cannot be
+            reused or the pool is full
+        """
+        with self._lock:
+            self._active[key] = max(self._active.get(key, 1) - 1, 0)
+            if reusable and self._idle_count() < self._max_size:
+                self._idle.setdefault(key, []).append((conn, time.time()))
+            else:
+                conn.close()
+            self._lock.notify_all()
+    #----------------------------------------------------------------------
+    def clear(self):
+        """ closes all idle connections """
+        with self._lock:
+            for idle in self._idle.itervalues():
+                for conn, last_used in idle:
+                    conn.close()
+            self._idle = {}
+    #----------------------------------------------------------------------
+    def request(self, method, url, body=None, headers=None):
+        """ performs an HTTP request over a pooled connection, following
+            redirects, and returns a Response object
+            Inputs:
+               method - GET or POST
+               url - full url including the query string
+               body - request body as a string, a file like object
+                      with read() and seek() or None
+               headers - dictionary of request headers
+        """
+        stream = self.urlopen(method, url, body, headers)
+        try:
+            data = stream.read()
+        finally:
+            stream.close()
+        return Response(stream.url, stream.status, stream.reason,
+                        stream.headers, data, stream.wire_bytes,
+                        stream.timings)
+    #----------------------------------------------------------------------
+    def urlopen(self, method, url, body=None, headers=None):
+        """ performs an HTTP request over a pooled connection, following
+            redirects, and returns a StreamResponse whose body has not
+            been read yet.  The StreamResponse must be closed to give the
+            connection back to the pool.  gzip and deflate encodings are
+            accepted unless the headers ask for another Accept-Encoding.
+        """
+        if headers is None:
+            headers = {}
+        if 'accept-encoding' not in [k.lower() for k in headers]:
+            headers = dict(headers)
+            headers['Accept-Encoding'] = _ACCEPT_ENCODING
+        for redirect in xrange(_MAX_REDIRECTS + 1):
+            stream = self._open(method, url, body, headers)
+            location = stream.headers.getheader('location')
+            if stream.status not in _REDIRECTS or location is None:
+                return stream
+            stream.read()
+            stream.close()
+            url = urlparse.urljoin(url, location)
+            if stream.status in (301, 302, 303) and method == "POST":
+                method = "GET"
+                body = None
+                headers = dict((k, v) for k, v in headers.iteritems()
+                               if k.lower() not in ('content-type',
+                                                    'content-length'))
+        return stream
+    #----------------------------------------------------------------------
+    def _open(self, method, url, body, headers):
+        """ sends a single request, retrying on a fresh connection if a
+            reused keep-alive connection was closed by the server.  A
+            request that went out is sent again if it is a GET or HEAD,
+            or if the reused connection closed without a byte of
+            response, so the server never read it.  A failure before
+            sending is raised as NotSentError.
+        """
+        parsed = urlparse.urlparse(url)
+        key = (parsed.scheme.lower(), parsed.hostname, parsed.port)
+        selector = parsed.path or "/"
+        if parsed.query:
+            selector += "?" + parsed.query
+        while True:
+            conn, reused = self.acquire(key)
+            if hasattr(body, 'seek'):
+                body.seek(0)
+            timings = {'dns': 0.0, 'connect': 0.0, 'ttfb': 0.0}
+            sent = False
+            try:
+                if not reused:
+                    started = time.time()
+                    addresses = socket.getaddrinfo(conn.host, conn.port, 0,
+                                                   socket.SOCK_STREAM)
+                    timings['dns'] = time.time() - started
+                    conn._create_connection = _connector(addresses)
+                    started = time.time()
+                    conn.connect()
+                    timings['connect'] = time.time() - started
+                started = time.time()
+                conn.request(method, selector, body, headers)
+                sent = True
+                response = conn.getresponse()
+                timings['ttfb'] = time.time() - started
+            except (httplib.BadStatusLine, httplib.CannotSendRequest,
+                    httplib.ResponseNotReady, socket.error), e:
+                self.release(key, conn, reusable=False)
+                if reused and (not sent or method in _IDEMPOTENT or
+                               _closed_unanswered(e)):
+                    continue
+                if not sent and not isinstance(e, NotSentError):
+                    raise NotSentError(*e.args), None, sys.exc_info()[2]
+                raise
+            except:
+                self.release(key, conn, reusable=False)
+                raise
+            return StreamResponse(self, key, conn, response, url, timings)
+########################################################################
+class StreamResponse(object):
+    """ an open response on a pooled connection.  The body is read with
+        read(), which decompresses gzip/deflate bodies incrementally, and
+        close() hands the connection back to the pool.
+    """
+    _url = None
+    _response = None
+    _decoder = None
+    _timings = None
+    #----------------------------------------------------------------------
+    def __init__(self, pool, key, conn, response, url, timings=None):
+        """Constructor"""
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._response = response
+        self._url = url
+        if timings is None:
+            timings = {}
+        self._timings = timings
+        self._wire_bytes = 0
+        self._decoded_bytes = 0
+        self._buffer = ''
+        self._eof = False
+        encoding = (response.getheader('content-encoding') or '').lower()
+        if encoding in ('gzip', 'x-gzip', 'deflate'):
+            self._decoder = _Decoder(encoding)
+    #----------------------------------------------------------------------
+    @property
+    def url(self):
+        """ returns the url of the request """
+        return self._url
+    #----------------------------------------------------------------------
+    @property
+    def status(self):
+        """ returns the HTTP status code """
+        return self._response.status
+    #----------------------------------------------------------------------
+    @property
+    def reason(self):
+        """ returns the HTTP reason phrase """
+        return self._response.reason
+    #----------------------------------------------------------------------
+    @property
+    def headers(self):
+        """ returns the response headers as a mimetools.Message """
+        return self._response.msg
+    #----------------------------------------------------------------------
+    @property
+    def wire_bytes(self):
+        """ body bytes received so far, before decompression """
+        return self._wire_bytes
+    #----------------------------------------------------------------------
+    @property
+    def decoded_bytes(self):
+        """ body bytes returned by read() so far """
+        return self._decoded_bytes
+    #----------------------------------------------------------------------
+    @property
+    def timings(self):
+        """ returns a dictionary of the dns, connect and ttfb (time to
+            first byte) durations of the request in seconds
+        """
+        return self._timings
+    #----------------------------------------------------------------------
+    def read(self, amt=None):
+        """ reads amt bytes of the body, or all of it if amt is None """
+        if self._decoder is None:
+            data = self._response.read(amt)
+            self._wire_bytes += len(data)
+        else:
+            while not self._eof and \
+                  (amt is None or len(self._buffer) < amt):
+                raw = self._response.read(amt or 65536)
+                if not raw:
+                    self._buffer += self._decoder.flush()
+                    self._eof = True
+                    break
+                self._wire_bytes += len(raw)
+                self._buffer += self._decoder.decompress(raw)
+            if amt is None:
+                data, self._buffer = self._buffer, ''
+            else:
+                data, self._buffer = self._buffer[:amt], self._buffer[amt:]
+        self._decoded_bytes += len(data)
+        return data
+    #----------------------------------------------------------------------
+    def close(self):
+        """ returns the connection to the pool.  It is only reused if the
+            body was read completely.
+        """
+        if self._conn is None:
+            return
+        reusable = self._response.isclosed() and \
+                   not self._response.will_close
+        self._pool.release(self._key, self._conn, reusable=reusable)
+        self._pool._count(self._wire_bytes, self._decoded_bytes)
+        self._conn = None
+########################################################################
+class _Decoder(object):
+    """ incremental gzip/deflate decompressor.  deflate bodies are
+        accepted with or without the zlib header.
+    """
+    #----------------------------------------------------------------------
+    def __init__(self, encoding):
+        """Constructor"""
+        self._raw = encoding == 'deflate'
+        if self._raw:
+            self._obj = zlib.decompressobj()
+        else:
+            self._obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self._started = False
+    #----------------------------------------------------------------------
+    def decompress(self, data):
+        """ decompresses the next block of the body """
+        if self._raw and not self._started:
+            self._started = True
+            try:
+                return self._obj.decompress(data)
+            except zlib.error:
+                self._obj = zlib.decompressobj(-zlib.MAX_WBITS)
+        return self._obj.decompress(data)
+    #----------------------------------------------------------------------
+    def flush(self):
+        """ returns any remaining decompressed data """
+        return self._obj.flush()
+########################################################################
+default_pool = ConnectionPool()
@@ -0,0 +1,258 @@
+"""
+   Incremental extraction of layers with editor tracking.  A watermark
+   file keeps, per layer, the last edit date seen and the object ids
+   known at the time.  Each run queries only the features edited since
+   the watermark and finds deleted features by comparing the current
+   object ids with the known ones, returning a ChangeSet of upserts and
+   deletes.
+
+   The watermark date is compared by the second, so features edited in
+   the last second of the previous run are returned again; applying an
+   upsert twice leaves the copy unchanged.  The first run (no watermark
+   file) returns every feature as an upsert.
+
+   Example:
+      fl = layer.FeatureLayer(url)
+      changes = fl.extract_changes(r"c:\temp\parcels.watermark",
+                                   commit=False)
+      ... apply changes.featureset and changes.deletes to the copy ...
+      changes.commit()
+"""
+import os
+import json
+import time
+import paging
+import extract
+
+#----------------------------------------------------------------------
+def _ranges(oids):
+    """ compresses sorted object ids into [start, end] runs """
+    runs = []
+    for oid in oids:
+        if runs and runs[-1][1] + 1 == oid:
+            runs[-1][1] = oid
+        else:
+            runs.append([oid, oid])
+    return runs
+#----------------------------------------------------------------------
+def _expand(runs):
+    """ returns the object ids of [start, end] runs """
+    oids = []
+    for start, end in runs:
+        oids.extend(xrange(start, end + 1))
+    return oids
+#----------------------------------------------------------------------
+def _timestamp(value):
+    """ formats an epoch milliseconds value as a UTC timestamp literal """
+    return time.strftime("%Y-%m-%d %H:%M:%S",
+                         time.gmtime(value / 1000))
+########################################################################
+class Watermark(object):
+    """ last edit date and known object ids of a layer, stored in a JSON
+        file
+        Inputs:
+           path - the watermark file, read if it exists
+    """
+    _path = None
+    _url = None
+    _lastEditDate = None
+    _objectIds = None
+    #----------------------------------------------------------------------
+    def __init__(self, path):
+        """Constructor"""
+        self._path = path
+        self._objectIds = []
+        if os.path.isfile(path):
+            with open(path, 'rb') as reader:
+                values = json.load(reader)
+            self._url = values.get('url')
+            self._lastEditDate = values.get('lastEditDate')
+            self._objectIds = _expand(values.get('objectIds', []))
+    #----------------------------------------------------------------------
+    @property
+    def path(self):
+        """ the watermark file """
+        return self._path
+    #----------------------------------------------------------------------
+    @property
+    def url(self):
+        """ url of the layer the watermark belongs to """
+        return self._url
+    #----------------------------------------------------------------------
+    @property
+    def lastEditDate(self):
+        """ newest edit date seen, as epoch milliseconds, or None before
+            the first run
+        """
+        return self._lastEditDate
+    #----------------------------------------------------------------------
+    @property
+    def objectIds(self):
+        """ sorted object ids known at the last run """
+        return self._objectIds
+    #----------------------------------------------------------------------
+    def update(self, url, lastEditDate, objectIds):
+        """ sets the values of the watermark, save() writes them """
+        self._url = url
+        self._lastEditDate = lastEditDate
+        self._objectIds = sorted(objectIds)
+    #----------------------------------------------------------------------
+    def save(self):
+        """ writes the watermark file """
+        folder = os.path.dirname(self._path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        temp = "%s.%s.tmp" % (self._path, os.getpid())
+        with open(temp, 'wb') as writer:
+            json.dump({"url": self._url,
+                       "lastEditDate": self._lastEditDate,
+                       "objectIds": _ranges(self._objectIds)}, writer)
+        if os.name == 'nt' and os.path.isfile(self._path):
+            os.remove(self._path)
+        os.rename(temp, self._path)
+########################################################################
+class ChangeSet(object):
+    """ features added or updated and object ids deleted since a
+        watermark
+    """
+    _upserts = None
+    _deletes = None
+    _info = None
+    _watermark = None
+    _state = None
+    #----------------------------------------------------------------------
+    def __init__(self, upserts, deletes, info, watermark, state):
+        """Constructor"""
+        self._upserts = upserts
+        self._deletes = deletes
+        self._info = info
+        self._watermark = watermark
+        self._state = state
+    #----------------------------------------------------------------------
+    @property
+    def upserts(self):
+        """ esri JSON features added or edited since the watermark """
+        return self._upserts
+    #----------------------------------------------------------------------
+    @property
+    def deletes(self):
+        """ sorted object ids deleted since the watermark """
+        return self._deletes
+    #----------------------------------------------------------------------
+    @property
+    def featureset(self):
+        """ the upserts as a feature set dictionary, e.g. for
+            common.insert_json_features
+        """
+        featureset = dict(self._info)
+        featureset['features'] = self._upserts
+        return featureset
+    #----------------------------------------------------------------------
+    @property
+    def lastEditDate(self):
+        """ the edit date the watermark moves to on commit """
+        return self._state[1]
+    #----------------------------------------------------------------------
+    def __len__(self):
+        """ number of changes """
+        return len(self._upserts) + len(self._deletes)
+    #----------------------------------------------------------------------
+    def commit(self):
+        """ moves the watermark past this change set and saves it """
+        self._watermark.update(*self._state)
+        self._watermark.save()
+########################################################################
+class DeltaExtractor(object):
+    """ returns the changes of a layer since its watermark
+        Inputs:
+           featureLayer - layer.FeatureLayer or layer.TableLayer object
+                          with editor tracking
+           watermark - a Watermark object or the path of its file
+    """
+    _layer = None
+    _watermark = None
+    #----------------------------------------------------------------------
+    def __init__(self, featureLayer, watermark):
+        """Constructor"""
+        self._layer = featureLayer
+        if isinstance(watermark, basestring):
+            watermark = Watermark(watermark)
+        self._watermark = watermark
+    #----------------------------------------------------------------------
+    @property
+    def watermark(self):
+        """ the Watermark object """
+        return self._watermark
+    #----------------------------------------------------------------------
+    @property
+    def editDateField(self):
+        """ the layer's edit date field, ValueError without one """
+        info = self._layer.editFieldsInfo or {}
+        field = info.get('editDateField')
+        if not field:
+            raise ValueError("%s does not track edit dates" %
+                             self._layer._url)
+        return field
+    #----------------------------------------------------------------------
+    def changes(self, where="1=1", out_fields="*", returnGeometry=True):
+        """ queries the features edited since the watermark and the
+            object ids deleted since then
+            Output:
+               ChangeSet, its commit() moves the watermark
+        """
+        layer = self._layer
+        edit_field = self.editDateField
+        watermark = self._watermark
+        if watermark.url is not None and \
+           watermark.url.rstrip('/').lower() != layer._url.rstrip('/').lower():
+            raise ValueError("%s is the watermark of %s" %
+                             (watermark.path, watermark.url))
+        oid_field, oids = extract.Extractor(layer).object_ids(where)
+        known = set(watermark.objectIds)
+        if out_fields != "*":
+            names = [f.strip() for f in out_fields.split(",")]
+            for name in (oid_field, edit_field):
+                if name not in names:
+                    names.append(name)
+            out_fields = ",".join(names)
+        since = where
+        if watermark.lastEditDate is not None:
+            since = "(%s) AND %s >= timestamp '%s'" % \
+                (where, edit_field, _timestamp(watermark.lastEditDate))
+        params = layer._query_params(where=since,
+                                     out_fields=out_fields,
+                                     returnGeometry=returnGeometry)
+        upserts = []
+        info = {}
+        state = {'last': watermark.lastEditDate}
+        seen = set()
+        def consume(pages):
+            for page in pages:
+                if not info:
+                    info.update((k, v) for k, v in page.iteritems()
+                                if k in ('objectIdFieldName', 'geometryType',
+                                         'spatialReference', 'fields'))
+                for feature in page.get('features', []):
+                    attributes = feature.get('attributes', {})
+                    oid = attributes.get(oid_field)
+                    if oid in seen:
+                        continue
+                    seen.add(oid)
+                    upserts.append(feature)
+                    edited = attributes.get(edit_field)
+                    if edited is not None and \
+                       (state['last'] is None or edited > state['last']):
+                        state['last'] = edited
+        consume(paging.prefetch(layer._pages(params)))
+        if watermark.lastEditDate is not None:
+            # features added without an edit date are found by their id
+            added = [oid for oid in oids
+                     if oid not in known and oid not in seen]
+            params = layer._query_params(where=where,
+                                         out_fields=out_fields,
+                                         returnGeometry=returnGeometry)
+            consume(paging.oid_pages(layer._fetch_query, params, added,
+                                     layer.maxRecordCount))
+        deletes = sorted(known.difference(oids))
+        return ChangeSet(upserts, deletes, info, watermark,
+                         (layer._url, state['last'], oids))
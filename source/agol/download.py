@@ -0,0 +1,173 @@
+"""
+   Chunked, resumable file downloads.  Files are streamed to disk in
+   blocks, interrupted transfers are resumed with HTTP Range requests and
+   large files can be fetched as several ranges in parallel.
+"""
+import os
+import socket
+import urllib2
+import httplib
+from cStringIO import StringIO
+from multiprocessing.pool import ThreadPool
+import connection
+
+########################################################################
+class Downloader(object):
+    """ downloads files through the shared connection pool
+        Inputs:
+           blocksize - number of bytes read and written at once
+           retries - number of times an interrupted transfer is resumed
+           parallel - number of range requests used at once for large
+                      files.  1 downloads the file in a single stream.
+           part_size - files smaller than this many bytes are always
+                       downloaded in a single stream
+    """
+    _blocksize = None
+    _retries = None
+    _parallel = None
+    _part_size = None
+    #----------------------------------------------------------------------
+    def __init__(self, blocksize=65536, retries=3, parallel=1,
+                 part_size=16777216):
+        """Constructor"""
+        self._blocksize = blocksize
+        self._retries = retries
+        self._parallel = parallel
+        self._part_size = part_size
+    #----------------------------------------------------------------------
+    def download(self, url, file_path):
+        """ downloads url to file_path and returns file_path.  A
+            file_path + '.part' file left behind by an interrupted run
+            is resumed.
+            Raises:
+               IOError if the downloaded size does not match the size
+               reported by the server
+        """
+        total, ranges = self._probe(url)
+        if self._parallel > 1 and ranges and \
+           total is not None and total > self._part_size:
+            self._download_parallel(url, file_path, total)
+        else:
+            part = file_path + ".part"
+            size = self._fetch(url, part, 0, None, total)
+            self._verify(part, total or size)
+            if os.path.isfile(file_path):
+                os.remove(file_path)
+            os.rename(part, file_path)
+        return file_path
+    #----------------------------------------------------------------------
+    def _probe(self, url):
+        """ returns the (size, supports ranges) of a url, or (None, False)
+            if the server does not answer a HEAD request
+        """
+        try:
+            res = connection.default_pool.request(
+                "HEAD", url, headers={'Accept-Encoding': 'identity'})
+        except (socket.error, httplib.HTTPException):
+            return None, False
+        if res.status >= 400:
+            return None, False
+        length = res.headers.getheader('content-length')
+        ranges = (res.headers.getheader('accept-ranges') or '').lower()
+        if length is None:
+            return None, False
+        return int(length), ranges == 'bytes'
+    #----------------------------------------------------------------------
+    def _download_parallel(self, url, file_path, total):
+        """ downloads fixed size ranges of the file in parallel and joins
+            them into file_path
+        """
+        size = max(self._part_size, total / self._parallel + 1)
+        segments = []
+        for index, start in enumerate(xrange(0, total, size)):
+            end = min(start + size, total) - 1
+            segments.append(("%s.part%s" % (file_path, index), start, end))
+        pool = ThreadPool(self._parallel)
+        try:
+            pool.map(lambda s: self._fetch(url, s[0], s[1], s[2], total),
+                     segments)
+        finally:
+            pool.close()
+            pool.join()
+        with open(file_path, 'wb') as writer:
+            for part, start, end in segments:
+                self._verify(part, end - start + 1)
+                with open(part, 'rb') as reader:
+                    while True:
+                        block = reader.read(self._blocksize)
+                        if not block:
+                            break
+                        writer.write(block)
+        for part, start, end in segments:
+            os.remove(part)
+        self._verify(file_path, total)
+    #----------------------------------------------------------------------
+    def _fetch(self, url, part, start, end, total):
+        """ streams bytes start to end (inclusive, None for the end of the
+            file) of url into part, resuming from whatever part already
+            holds.  Returns the size of part.
+        """
+        if end is None:
+            expected = None
+            if total is not None:
+                expected = total - start
+        else:
+            expected = end - start + 1
+        attempt = 0
+        while True:
+            done = 0
+            if os.path.isfile(part):
+                done = os.path.getsize(part)
+            if expected is not None and done >= expected:
+                return done
+            headers = {'Accept-Encoding': 'identity'}
+            if start + done > 0 or end is not None:
+                if end is None:
+                    headers['Range'] = 'bytes=%s-' % (start + done)
+                else:
+                    headers['Range'] = 'bytes=%s-%s' % (start + done, end)
+            try:
+                stream = connection.default_pool.urlopen("GET", url,
+                                                         headers=headers)
+                try:
+                    if stream.status >= 400:
+                        raise urllib2.HTTPError(stream.url, stream.status,
+                                                stream.reason,
+                                                stream.headers,
+                                                StringIO(stream.read()))
+                    if stream.status == 200:
+                        if start > 0:
+                            raise IOError("%s does not support range "
+                                          "requests" % url)
+                        done = 0
+                        length = stream.headers.getheader('content-length')
+                        if length is not None:
+                            expected = int(length)
+                    mode = 'wb'
+                    if done > 0:
+                        mode = 'ab'
+                    with open(part, mode) as writer:
+                        while True:
+                            block = stream.read(self._blocksize)
+                            if not block:
+                                break
+                            writer.write(block)
+                finally:
+                    stream.close()
+            except (socket.error, httplib.HTTPException):
+                attempt += 1
+                if attempt > self._retries:
+                    raise
+                continue
+            size = os.path.getsize(part)
+            if expected is None or size >= expected:
+                return size
+            attempt += 1
+            if attempt > self._retries:
+                return size
+    #----------------------------------------------------------------------
+    def _verify(self, file_path, size):
+        """ checks that a downloaded file has the expected size """
+        if size is not None and os.path.getsize(file_path) != size:
+            raise IOError("%s is %s bytes, expected %s" %
+                          (file_path, os.path.getsize(file_path), size))
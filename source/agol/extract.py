@@ -0,0 +1,323 @@
+"""
+   Parallel extraction of a layer by object id ranges.  The matching
+   object ids are split into ranges of at most maxRecordCount ids; the
+   range queries run on a bounded pool of worker threads and the pages
+   are handed back (or written to the output) in object id order.
+
+   TiledExtractor splits the layer's extent into a quadtree of envelopes
+   instead, so services where object id ranges hit hot spots, or where
+   dense polygons make pages uneven, are read in balanced spatial tiles.
+
+   Example:
+      fl = layer.FeatureLayer(url)
+      def report(done, total):
+          print "%s of %s features" % (done, total)
+      extract.Extractor(fl, workers=6, progress=report).to_featureclass(
+          r"c:\temp\data.gdb\copy")
+"""
+import os
+import json
+import uuid
+import paging
+import filters
+from common import Envelope
+
+#----------------------------------------------------------------------
+def _create(page, out_fc):
+    """ creates an output feature class from a query response """
+    # common needs arcpy, reading the pages does not
+    import common
+    temp = os.path.join(common.scratchFolder(),
+                        uuid.uuid4().get_hex() + ".json")
+    with open(temp, 'wb') as writer:
+        json.dump(page, writer)
+    try:
+        return common.json_to_featureclass(json_file=temp,
+                                           out_fc=out_fc)
+    finally:
+        os.remove(temp)
+#----------------------------------------------------------------------
+def to_featureclass(featureLayer, pages, out_fc, out_fields="*"):
+    """ writes query responses to a new feature class or table.  The
+        first page creates the output, the others are appended to it.
+        Without pages an empty output is created from the layer's schema.
+        Output:
+           path to the output feature class
+    """
+    import common
+    created = False
+    for page in pages:
+        if not created:
+            out_fc = _create(page, out_fc)
+            created = True
+        else:
+            common.insert_json_features(out_fc, page)
+    if not created:
+        params = featureLayer._query_params(where="1=0",
+                                            out_fields=out_fields)
+        page = featureLayer._fetch_query(params)
+        if 'error' in page:
+            raise ValueError(page)
+        out_fc = _create(page, out_fc)
+    return out_fc
+########################################################################
+class Extractor(object):
+    """ extracts the features of a layer by object id ranges
+        Inputs:
+           featureLayer - layer.FeatureLayer or layer.TableLayer object
+           workers - number of range queries run at once.  Keep this at
+                     or below the connection pool's max_per_host.
+           page_size - object ids per range, defaults to the layer's
+                       maxRecordCount
+           progress - optional function called as progress(done, total)
+                      with the number of features handled so far
+    """
+    _layer = None
+    _workers = None
+    _page_size = None
+    _progress = None
+    #----------------------------------------------------------------------
+    def __init__(self, featureLayer, workers=4, page_size=None,
+                 progress=None):
+        """Constructor"""
+        self._layer = featureLayer
+        self._workers = workers
+        self._page_size = page_size
+        self._progress = progress
+    #----------------------------------------------------------------------
+    @property
+    def workers(self):
+        """ number of range queries run at once """
+        return self._workers
+    #----------------------------------------------------------------------
+    def object_ids(self, where="1=1", geometryFilter=None):
+        """ returns the object id field name and the sorted object ids
+            matching a where clause
+        """
+        params = self._layer._query_params(where=where,
+                                           geometryFilter=geometryFilter)
+        return self._object_ids(params)
+    #----------------------------------------------------------------------
+    def _object_ids(self, params):
+        """ returns the object id field name and the sorted object ids
+            matching query parameters
+        """
+        id_params = dict(params)
+        id_params['returnIdsOnly'] = True
+        id_params['returnGeometry'] = False
+        result = self._layer._fetch_query(id_params)
+        if 'error' in result:
+            raise ValueError(result)
+        oids = result.get('objectIds') or []
+        oids.sort()
+        oid_field = result.get('objectIdFieldName',
+                               self._layer.objectIdField)
+        return oid_field, oids
+    #----------------------------------------------------------------------
+    def _fetch_range(self, params, oid_field, batch):
+        """ queries the features of a sorted batch of object ids by their
+            id range.  If the server still cuts the response the batch is
+            split in half.
+        """
+        range_params = dict(params)
+        range_params['where'] = "(%s) AND %s >= %s AND %s <= %s" % \
+            (params.get('where', '1=1'), oid_field, batch[0],
+             oid_field, batch[-1])
+        page = self._layer._fetch_query(range_params)
+        if 'error' in page:
+            raise ValueError(page)
+        if page.get('exceededTransferLimit', False) and len(batch) > 1:
+            half = len(batch) / 2
+            page = self._fetch_range(params, oid_field, batch[:half])
+            rest = self._fetch_range(params, oid_field, batch[half:])
+            page['features'].extend(rest.get('features', []))
+            page.pop('exceededTransferLimit', None)
+        return page
+    #----------------------------------------------------------------------
+    def pages(self, where="1=1", out_fields="*", returnGeometry=True,
+              geometryFilter=None):
+        """ yields the query response of each object id range in object
+            id order, calling the progress function after each one
+        """
+        params = self._layer._query_params(where=where,
+                                           out_fields=out_fields,
+                                           geometryFilter=geometryFilter,
+                                           returnGeometry=returnGeometry)
+        return self.query_pages(params)
+    #----------------------------------------------------------------------
+    def query_pages(self, params, oid_field=None, oids=None):
+        """ yields the responses of query parameters by object id range.
+            The object ids are queried unless given.
+        """
+        if oids is None:
+            oid_field, oids = self._object_ids(params)
+        page_size = self._page_size or self._layer.maxRecordCount
+        total = len(oids)
+        done = 0
+        fetch = lambda batch: self._fetch_range(params, oid_field, batch)
+        for page in paging.ordered_map(fetch,
+                                       paging.oid_batches(oids, page_size),
+                                       self._workers):
+            done += len(page.get('features', []))
+            if self._progress is not None:
+                self._progress(done, total)
+            yield page
+    #----------------------------------------------------------------------
+    def to_featureclass(self, out_fc, where="1=1", out_fields="*"):
+        """ extracts the layer into a new feature class or table.  The
+            first range creates the output, the others are appended to
+            it in object id order as they arrive.
+            Output:
+               path to the output feature class
+        """
+        return to_featureclass(self._layer,
+                               self.pages(where=where, out_fields=out_fields),
+                               out_fc, out_fields)
+########################################################################
+class TiledExtractor(Extractor):
+    """ extracts the features of a layer by spatial tiles.  The layer's
+        extent is split into four tiles, and every tile holding more
+        than page_size features is split again, up to max_depth levels;
+        tiles still too full at that depth are paged.  The tiles of a
+        level are queried at once.  Features crossing tile borders are
+        returned once, by object id.
+        Inputs:
+           featureLayer - layer.FeatureLayer object
+           workers - number of tile queries run at once
+           page_size - features per tile, defaults to the layer's
+                       maxRecordCount
+           progress - optional function called as progress(done, total)
+           extent - optional extent dictionary, defaults to the layer's
+                    extent or the service's fullExtent
+           max_depth - number of times a tile is split at most
+    """
+    _extent = None
+    _max_depth = None
+    #----------------------------------------------------------------------
+    def __init__(self, featureLayer, workers=4, page_size=None,
+                 progress=None, extent=None, max_depth=8):
+        """Constructor"""
+        Extractor.__init__(self, featureLayer, workers, page_size, progress)
+        self._extent = extent
+        self._max_depth = max_depth
+    #----------------------------------------------------------------------
+    @property
+    def extent(self):
+        """ the extent dictionary that is tiled """
+        if self._extent is None:
+            self._extent = self._layer.extent or \
+                           self._layer.parentLayer.fullExtent
+        return self._extent
+    #----------------------------------------------------------------------
+    def _tile_params(self, params, tile):
+        """ adds an envelope filter on a (xmin, ymin, xmax, ymax) tile """
+        sr = self.extent.get('spatialReference') or {}
+        wkid = sr.get('latestWkid', sr.get('wkid'))
+        gf = filters.GeometryFilter(Envelope(tile[0], tile[1], tile[2],
+                                             tile[3], wkid))
+        tile_params = self._layer._query_params(geometryFilter=gf)
+        result = dict(params)
+        for key in ('geometry', 'geometryType', 'spatialRel', 'inSR'):
+            result[key] = tile_params[key]
+        return result
+    #----------------------------------------------------------------------
+    def _fetch_tile(self, params, tile, depth, page_size):
+        """ counts the features of a tile and either queries them or
+            returns the four sub tiles
+            Output:
+               tuple of (query responses, list of sub tiles).  The
+               responses of a tile still too full at max_depth are a
+               generator the consumer pages through.
+        """
+        tile_params = self._tile_params(params, tile)
+        count_params = dict(tile_params)
+        count_params['returnCountOnly'] = True
+        count_params['returnGeometry'] = False
+        result = self._layer._fetch_query(count_params)
+        if 'error' in result:
+            raise ValueError(result)
+        count = result.get('count', 0)
+        if count == 0:
+            return [], []
+        if count > page_size and depth < self._max_depth:
+            xmin, ymin, xmax, ymax = tile
+            x = (xmin + xmax) / 2.0
+            y = (ymin + ymax) / 2.0
+            return [], [(xmin, ymin, x, y), (x, ymin, xmax, y),
+                        (xmin, y, x, ymax), (x, y, xmax, ymax)]
+        if count > page_size:
+            return self._layer._pages(tile_params, page_size), []
+        page = self._layer._fetch_query(tile_params)
+        if 'error' in page:
+            raise ValueError(page)
+        if page.get('exceededTransferLimit', False):
+            return self._layer._pages(tile_params, page_size), []
+        return [page], []
+    #----------------------------------------------------------------------
+    def pages(self, where="1=1", out_fields="*", returnGeometry=True):
+        """ yields the query response of each tile, level by level,
+            without features already returned by another tile, calling
+            the progress function after each one
+        """
+        params = self._layer._query_params(where=where,
+                                           out_fields=out_fields,
+                                           returnGeometry=returnGeometry)
+        return self.query_pages(params)
+    #----------------------------------------------------------------------
+    def query_pages(self, params, total=None):
+        """ yields the responses of query parameters by tile.  The
+            features are counted unless total is given.  The object id
+            field is always queried, to find the features returned by
+            more than one tile, and removed again when params leave it
+            out.
+        """
+        page_size = self._page_size or self._layer.maxRecordCount
+        if total is None:
+            count_params = dict(params)
+            count_params['returnCountOnly'] = True
+            result = self._layer._fetch_query(count_params)
+            if 'error' in result:
+                raise ValueError(result)
+            total = result.get('count', 0)
+        extent = self.extent
+        tiles = [(extent['xmin'], extent['ymin'],
+                  extent['xmax'], extent['ymax'])]
+        oid_field = self._layer.objectIdField
+        names = [f.strip() for f in params.get('outFields', "*").split(",")]
+        drop_oid = "*" not in names and \
+                   oid_field.lower() not in [n.lower() for n in names]
+        if drop_oid:
+            params = dict(params)
+            params['outFields'] = ",".join([n for n in names if n] +
+                                           [oid_field])
+        seen = set()
+        done = 0
+        depth = 0
+        while tiles:
+            fetch = lambda tile, depth=depth: self._fetch_tile(
+                params, tile, depth, page_size)
+            children = []
+            for tile_pages, sub_tiles in paging.ordered_map(fetch, tiles,
+                                                            self._workers):
+                children.extend(sub_tiles)
+                for page in tile_pages:
+                    features = []
+                    for feature in page.get('features', []):
+                        attributes = feature.get('attributes', {})
+                        if drop_oid:
+                            oid = attributes.pop(oid_field, None)
+                        else:
+                            oid = attributes.get(oid_field)
+                        if oid is None or oid not in seen:
+                            seen.add(oid)
+                            features.append(feature)
+                    page['features'] = features
+                    if drop_oid and 'fields' in page:
+                        page['fields'] = [f for f in page['fields']
+                                          if f.get('name') != oid_field]
+                    done += len(features)
+                    if self._progress is not None:
+                        self._progress(done, total)
+                    yield page
+            tiles = children
+            depth += 1
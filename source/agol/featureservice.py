@@ -1,43 +1,39 @@
 from base import BaseAGOLClass
 import layer as servicelayers
+import metadata
 from common import SpatialReference
 from filters import LayerDefinitionFilter, GeometryFilter, TimeFilter
 from base import Geometry
 import urlparse
 import urllib
+import urllib2
 import os
 import json
 import mimetypes
+import threading
+from multiprocessing.pool import ThreadPool
 
+########################################################################
+class ServiceInfo(metadata.Record):
+    """ keys of a feature service's REST JSON """
+    __slots__ = ("currentVersion", "serviceDescription", "hasVersionedData",
+                 "supportsDisconnectedEditing", "hasStaticData",
+                 "maxRecordCount", "supportedQueryFormats", "capabilities",
+                 "description", "copyrightText", "spatialReference",
+                 "initialExtent", "fullExtent", "allowGeometryUpdates",
+                 "units", "syncEnabled", "syncCapabilities",
+                 "editorTrackingInfo", "documentInfo", "enableZDefaults",
+                 "zDefault", "size", "xssPreventionInfo")
 ########################################################################
 class FeatureService(BaseAGOLClass):
-    """ contains information about a feature service """
-    _url = None
-    _currentVersion = None
-    _serviceDescription = None
-    _hasVersionedData = None
-    _supportsDisconnectedEditing = None
-    _hasStaticData = None
-    _maxRecordCount = None
-    _supportedQueryFormats = None
-    _capabilities = None
-    _description = None
-    _copyrightText = None
-    _spatialReference = None
-    _initialExtent = None
-    _fullExtent = None
-    _allowGeometryUpdates = None
-    _units = None
-    _syncEnabled = None
-    _syncCapabilities = None
-    _editorTrackingInfo = None
-    _documentInfo = None
-    _layers = None
-    _tables = None
-    _enableZDefaults = None
-    _zDefault = None
-    _size = None
-    _xssPreventionInfo = None
+    """ contains information about a feature service.  The service's
+        REST JSON is held in a ServiceInfo record; keys without a
+        property are available from the raw property.
+    """
+    __slots__ = ("_url", "_token_url", "_username", "_password",
+                 "_static_token", "_info", "_loaded", "_load_lock",
+                 "_layers", "_tables", "_layersLoaded")
+    _load_threads = 6
     #----------------------------------------------------------------------
     def __init__(self, url,  token_url=None, username=None, password=None):
         """Constructor"""
@@ -45,248 +41,174 @@ class FeatureService(BaseAGOLClass):
         self._username = username
         self._password = password
         self._token_url = token_url        
+        self._static_token = None
+        self._info = ServiceInfo()
+        self._loaded = False
+        self._load_lock = threading.RLock()
+        self._layers = None
+        self._tables = None
+        self._layersLoaded = False
         if not username is None and \
            not password is None:
             self._token = self.generate_token(tokenURL=token_url)[0]
     #----------------------------------------------------------------------
     def __init(self):
-        """ loads the data into the class """
-        if self._token is None:
-            param_dict = {"f": "json"}
-        else:
-            param_dict = {"f": "json",
-                          "token" : self._token
-                          }            
-        json_dict = self._do_get(self._url, param_dict) 
-        attributes = [attr for attr in dir(self) 
-                    if not attr.startswith('__') and \
-                    not attr.startswith('_')]          
-        for k,v in json_dict.iteritems(): 
-            if k in attributes:
-                setattr(self, "_"+ k, json_dict[k])
+        """ loads the data into the class.  The service JSON is loaded
+            once, concurrent callers wait for the running load, and null
+            properties do not trigger another load.
+        """
+        if self._loaded:
+            return
+        with self._load_lock:
+            if self._loaded:
+                return
+            if self._token is None:
+                param_dict = {"f": "json"}
             else:
-                print k, " - attribute not implmented."     
-    #----------------------------------------------------------------------
-    @property
-    def xssPreventionInfo(self):
-        """returns the xssPreventionInfo information """
-        if self._xssPreventionInfo is None:
-            self.__init()
-        return self._xssPreventionInfo
+                param_dict = {"f": "json",
+                              "token" : self._token
+                              }            
+            json_dict = dict(self._get_metadata(self._url, param_dict))
+            layers = json_dict.pop("layers", [])
+            tables = json_dict.pop("tables", [])
+            self._info = ServiceInfo(json_dict)
+            self._layers = self._buildLayers(layers,
+                                             servicelayers.FeatureLayer)
+            self._tables = self._buildLayers(tables,
+                                             servicelayers.TableLayer)
+            self._layersLoaded = False
+            self._loaded = True
+    #----------------------------------------------------------------------
+    def _load(self):
+        """ loads the service's metadata from the server """
+        self.__init()
     #----------------------------------------------------------------------
     @property
-    def size(self):
-        """returns the size parameter"""
-        if self._size is None:
-            self.__init()
-        return self._size
-        
+    def raw(self):
+        """ returns the service JSON keys that have no property """
+        self.__init()
+        return self._info.raw
+    #----------------------------------------------------------------------
+    currentVersion = metadata.field(
+        "currentVersion", "returns the map service current version")
+    serviceDescription = metadata.field(
+        "serviceDescription",
+        "returns the serviceDescription of the map service")
+    hasVersionedData = metadata.field("hasVersionedData",
+                                      "returns boolean for versioned data")
+    supportsDisconnectedEditing = metadata.field(
+        "supportsDisconnectedEditing",
+        "returns boolean is disconnecting editted supported")
+    hasStaticData = metadata.field("hasStaticData")
+    maxRecordCount = metadata.field("maxRecordCount",
+                                    "returns the max record count")
+    supportedQueryFormats = metadata.field("supportedQueryFormats")
+    capabilities = metadata.field("capabilities",
+                                  "returns a list of capabilities")
+    description = metadata.field("description",
+                                 "returns the service description")
+    copyrightText = metadata.field("copyrightText",
+                                   "returns the copyright text")
+    spatialReference = metadata.field("spatialReference",
+                                      "returns the spatial reference")
+    initialExtent = metadata.field(
+        "initialExtent", "returns the initial extent of the feature service")
+    fullExtent = metadata.field(
+        "fullExtent", "returns the full extent of the feature service")
+    allowGeometryUpdates = metadata.field(
+        "allowGeometryUpdates",
+        "informs the user if the data allows geometry updates")
+    units = metadata.field("units", "returns the measurement unit")
+    syncEnabled = metadata.field(
+        "syncEnabled", "informs the user if sync of data can be performed")
+    syncCapabilities = metadata.field("syncCapabilities",
+                                      "type of sync that can be performed")
+    editorTrackingInfo = metadata.field("editorTrackingInfo")
+    documentInfo = metadata.field("documentInfo")
+    enableZDefaults = metadata.field("enableZDefaults")
+    zDefault = metadata.field("zDefault")
+    size = metadata.field("size", "returns the size parameter")
+    xssPreventionInfo = metadata.field(
+        "xssPreventionInfo", "returns the xssPreventionInfo information")
     #----------------------------------------------------------------------
     def refresh_service(self):
         """ repopulates the properties of the service """
-        self._tables = None
-        self._layers = None
-        self.__init()
-    #----------------------------------------------------------------------
-    @property
-    def maxRecordCount(self):
-        """returns the max record count"""
-        if self._maxRecordCount is None:
-            self.__init()
-        return self._maxRecordCount
-    #----------------------------------------------------------------------
-    @property
-    def supportedQueryFormats(self):
-        """"""
-        if self._supportedQueryFormats is None:
-            self.__init()
-        return self._supportedQueryFormats
-    #----------------------------------------------------------------------
-    @property
-    def capabilities(self):
-        """ returns a list of capabilities """
-        if self._capabilities is None:
+        with self._load_lock:
+            self._tables = None
+            self._layers = None
+            self._invalidate_metadata(self._url)
+            self._invalidate_metadata(self._url + "/layers")
+            self._loaded = False
             self.__init()
-        return self._capabilities
     #----------------------------------------------------------------------
-    @property
-    def description(self):
-        """ returns the service description """
-        if self._description is None:
-            self.__init()
-        return self._description
-    #----------------------------------------------------------------------
-    @property
-    def copyrightText(self):
-        """ returns the copyright text """
-        if self._copyrightText is None:
-            self.__init()
-        return self._copyrightText
-    #----------------------------------------------------------------------
-    @property
-    def spatialReference(self):
-        """ returns the spatial reference """
-        if self._spatialReference is None:
-            self.__init()
-        return self._spatialReference
-    #----------------------------------------------------------------------
-    @property
-    def initialExtent(self):
-        """ returns the initial extent of the feature service """
-        if self._initialExtent is None:
-            self.__init()
-        return self._initialExtent
-    #----------------------------------------------------------------------
-    @property
-    def fullExtent(self):
-        """ returns the full extent of the feature service """
-        if self._fullExtent is None:
-            self.__init()
-        return self._fullExtent
-    #----------------------------------------------------------------------
-    @property
-    def allowGeometryUpdates(self):
-        """ informs the user if the data allows geometry updates """
-        if self._allowGeometryUpdates is None:
-            self.__init()
-        return self._allowGeometryUpdates
-    #----------------------------------------------------------------------
-    @property
-    def units(self):
-        """ returns the measurement unit """
-        if self._units is None:
-            self.__init()
-        return self._units
-    #----------------------------------------------------------------------
-    @property
-    def syncEnabled(self):
-        """ informs the user if sync of data can be performed """
-        if self._syncEnabled is None:
-            self.__init()
-        return self._syncEnabled
-    #----------------------------------------------------------------------
-    @property
-    def syncCapabilities(self):
-        """ type of sync that can be performed """
-        if self._syncCapabilities is None:
-            self.__init()
-        return self._syncCapabilities
-    #----------------------------------------------------------------------
-    @property
-    def editorTrackingInfo(self):
-        """"""
-        if self._editorTrackingInfo is None:
-            self.__init()
-        return self._editorTrackingInfo
-    #----------------------------------------------------------------------
-    @property
-    def documentInfo(self):
-        """"""
-        if self._documentInfo is None:
-            self.__init()
-        return self._documentInfo
-    #----------------------------------------------------------------------
-    def _getLayers(self):
-        """ gets layers for the featuer service """
-        if self._token is None:
-            param_dict = {"f": "json"}
-        else:
-            param_dict = {"f": "json",
-                          "token" : self._token
-                          }            
-        json_dict = self._do_get(self._url, param_dict)
-        self._layers = []
-        if json_dict.has_key("layers"):
-            for l in json_dict["layers"]:
-                self._layers.append(
-                    servicelayers.FeatureLayer(url=self._url + "/%s" % l['id'],
-                                               username=self._username,
-                                               password=self._password,
-                                               token_url=self._token_url)
-                )
-    #----------------------------------------------------------------------
-    def _getTables(self):
-        """ gets layers for the featuer service """
-        if self._token is None:
-            param_dict = {"f": "json"}
-        else:
-            param_dict = {"f": "json",
-                          "token" : self._token
-                          }            
-        json_dict = self._do_get(self._url, param_dict)
-        self._tables = []
-        if json_dict.has_key("tables"):
-            for l in json_dict["tables"]:
-                self._tables.append(
-                    servicelayers.TableLayer(url=self._url + "/%s" % l['id'],
-                                               username=self._username,
-                                               password=self._password,
-                                               token_url=self._token_url)
-                )
+    def _buildLayers(self, layer_infos, layer_class):
+        """ creates unloaded layer objects from the layer summaries of the
+            service JSON.  The layers share this object as their parent.
+        """
+        layers = []
+        for l in layer_infos:
+            fl = layer_class(url=self._url + "/%s" % l['id'],
+                             username=self._username,
+                             password=self._password,
+                             token_url=self._token_url,
+                             parent=self)
+            fl._hydrate(l)
+            layers.append(fl)
+        return layers
+    #----------------------------------------------------------------------
+    def _loadLayers(self):
+        """ loads the definitions of every layer and table with a single
+            request to the service's /layers resource.  Servers without
+            the resource are handled by loading the layers in parallel,
+            one request each.
+        """
+        with self._load_lock:
+            if self._layersLoaded:
+                return
+            if self._token is None:
+                param_dict = {"f": "json"}
+            else:
+                param_dict = {"f": "json",
+                              "token" : self._token
+                              }
+            try:
+                json_dict = self._get_metadata(self._url + "/layers",
+                                               param_dict)
+            except urllib2.HTTPError:
+                json_dict = {}
+            layers = dict((l.id, l) for l in self._layers + self._tables)
+            infos = json_dict.get("layers", []) + json_dict.get("tables", [])
+            if 'error' in json_dict or len(infos) == 0:
+                if len(layers) > 0:
+                    pool = ThreadPool(min(self._load_threads, len(layers)))
+                    try:
+                        pool.map(lambda l: l._load(), layers.values())
+                    finally:
+                        pool.close()
+                        pool.join()
+            else:
+                for info in infos:
+                    if info.get('id') in layers:
+                        layers[info['id']]._load(info)
+            self._layersLoaded = True
     #----------------------------------------------------------------------
     @property
     def layers(self):
         """ returns a list of layer objects """
         if self._layers is None:
-            self._getLayers()
+            self.__init()
+        if not self._layersLoaded:
+            self._loadLayers()
         return self._layers
     #----------------------------------------------------------------------
     @property
     def tables(self):
         """"""
         if self._tables is None:
-            self._getTables()
-        return self._tables
-    #----------------------------------------------------------------------
-    @property
-    def enableZDefaults(self):
-        """"""
-        if self._enableZDefaults is None:
-            self.__init()
-        return self._enableZDefaults
-    #----------------------------------------------------------------------
-    @property
-    def zDefault(self):
-        """"""
-        if self._zDefault is None:
-            self.__init()
-        return self._zDefault
-    #----------------------------------------------------------------------
-    @property
-    def hasStaticData(self):
-        """"""
-        if self._hasStaticData is None:
-            self.__init()
-        return self._hasStaticData
-    
-    #----------------------------------------------------------------------
-    @property
-    def currentVersion(self):
-        """ returns the map service current version """
-        if self._currentVersion is None:
-            self.__init()
-        return self._currentVersion    
-    #----------------------------------------------------------------------
-    @property
-    def serviceDescription(self):
-        """ returns the serviceDescription of the map service """
-        if self._serviceDescription is None:
             self.__init()
-        return self._serviceDescription  
-    #----------------------------------------------------------------------
-    @property
-    def hasVersionedData(self):
-        """ returns boolean for versioned data """
-        if self._hasVersionedData is None:
-            self.__init()
-        return self._hasVersionedData
-    #----------------------------------------------------------------------
-    @property
-    def supportsDisconnectedEditing(self):
-        """ returns boolean is disconnecting editted supported """
-        if self._supportsDisconnectedEditing is None:
-            self.__init()
-        return self._supportsDisconnectedEditing
+        if not self._layersLoaded:
+            self._loadLayers()
+        return self._tables
     #----------------------------------------------------------------------
     def query(self, 
               layerDefsFilter=None, 
@@ -327,7 +249,7 @@ class FeatureService(BaseAGOLClass):
         if not timeFilter is None and \
            isinstance(timeFilter, TimeFilter):
             params['time'] = timeFilter.filter
-        return self._do_get(url=qurl, param_dict=params)
+        return self._cached_get(url=qurl, param_dict=params)
     #----------------------------------------------------------------------
     def query_related_records(self,
                               objectIds,
@@ -464,7 +386,8 @@ class FeatureService(BaseAGOLClass):
                       returnAttachments=False, 
                       returnAttachmentDatabyURL=True,
                       returnAsFeatureClass=False,
-                      out_path=None
+                      out_path=None,
+                      download_threads=1
                       ):
         """ generates a replica 
             Inputs:
@@ -493,6 +416,8 @@ class FeatureService(BaseAGOLClass):
                                       json file.
                out_path - Path where the FGDB will be saved.  Only used with returnAsFeatureClass is
                           True.
+               download_threads - number of parallel range requests used to download large
+                                  replicas.  Only used with returnAsFeatureClass is True.
         """
         if self.syncEnabled:
             url = self._url + "/createReplica"
@@ -523,7 +448,8 @@ class FeatureService(BaseAGOLClass):
                     zipURL = res["responseUrl"]
                     dl_file = self._download_file(url=zipURL, 
                                         save_path=out_path, 
-                                        file_name=os.path.basename(zipURL)
+                                        file_name=os.path.basename(zipURL),
+                                        parallel=download_threads
                                         )
                     self._unzip_file(zip_file=dl_file, out_folder=out_path)
                     os.remove(dl_file)
@@ -2,7 +2,11 @@ from common import Geometry
 import os
 import json
 import time
-import arcpy
+try:
+    import arcpy
+except ImportError:
+    # arcpy is only needed to convert arcpy geometries
+    arcpy = None
 import calendar
 import datetime
 ########################################################################
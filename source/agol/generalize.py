@@ -0,0 +1,125 @@
+"""
+   Helpers that shrink the geometry of query responses.  A map drawn at
+   a scale can not show detail finer than a pixel, so the query can ask
+   the server to generalize the geometries (maxAllowableOffset), round
+   the coordinates (geometryPrecision) or send them as integers on a
+   grid (quantizationParameters).
+
+   Example:
+      options = generalize.for_scale(24000, spatialReference={"wkid": 3857})
+      features = fl.query(where="1=1", **options)
+"""
+import math
+
+DPI = 96
+INCHES_PER_METER = 39.3700787
+METERS_PER_DEGREE = 111319.49
+METERS_PER_UNIT = {"meters": 1.0,
+                   "feet": 0.3048,
+                   "usfeet": 1200 / 3937.0,
+                   "degrees": METERS_PER_DEGREE}
+#----------------------------------------------------------------------
+def units(spatialReference):
+    """ guesses the units of a spatial reference dictionary: degrees for
+        geographic coordinate systems, otherwise meters
+    """
+    spatialReference = spatialReference or {}
+    wkid = spatialReference.get('latestWkid', spatialReference.get('wkid'))
+    if wkid is not None and (4000 <= wkid < 5000 or
+                             104000 <= wkid < 105000):
+        return "degrees"
+    wkt = spatialReference.get('wkt') or ""
+    if wkt.upper().startswith("GEOGCS"):
+        return "degrees"
+    return "meters"
+#----------------------------------------------------------------------
+def resolution(scale, dpi=DPI, unit="meters"):
+    """ returns the size of a pixel in map units at a map scale """
+    meters = scale / (dpi * INCHES_PER_METER)
+    return meters / METERS_PER_UNIT[unit]
+#----------------------------------------------------------------------
+def precision(pixel):
+    """ returns the decimal places that keep coordinates within half a
+        pixel of their value
+    """
+    if pixel <= 0:
+        return None
+    return max(0, int(math.ceil(-math.log10(pixel / 2.0))))
+#----------------------------------------------------------------------
+def for_resolution(pixel, tolerance=1.0):
+    """ returns the maxAllowableOffset and geometryPrecision query
+        options for a pixel size in map units
+        Inputs:
+           pixel - size of a pixel in the units of the output spatial
+                   reference
+           tolerance - pixels a generalized geometry may move
+        Output:
+           dictionary of query() keyword arguments
+    """
+    return {"maxAllowableOffset": pixel * tolerance,
+            "geometryPrecision": precision(pixel)}
+#----------------------------------------------------------------------
+def for_scale(scale, spatialReference=None, dpi=DPI, tolerance=1.0):
+    """ returns the maxAllowableOffset and geometryPrecision query
+        options for drawing at a map scale
+        Inputs:
+           scale - map scale denominator, e.g. 24000
+           spatialReference - spatial reference dictionary of the output
+                              coordinates, used to find their units
+           dpi - resolution of the display
+           tolerance - pixels a generalized geometry may move
+        Output:
+           dictionary of query() keyword arguments
+    """
+    return for_resolution(resolution(scale, dpi, units(spatialReference)),
+                          tolerance)
+#----------------------------------------------------------------------
+def quantization(extent, pixel, mode="view"):
+    """ returns quantizationParameters snapping coordinates to a grid of
+        pixel size over an extent dictionary
+    """
+    return {"mode": mode,
+            "originPosition": "upperLeft",
+            "tolerance": pixel,
+            "extent": extent}
+#----------------------------------------------------------------------
+def _vertices(part, point):
+    """ decodes the delta encoded integer vertices of a part """
+    x = y = 0
+    vertices = []
+    for vertex in part:
+        x += vertex[0]
+        y += vertex[1]
+        vertices.append(point(x, y) + list(vertex[2:]))
+    return vertices
+#----------------------------------------------------------------------
+def dequantize(featureset):
+    """ converts the quantized geometries of a query response back to
+        coordinates, in place.  Responses without a transform are
+        returned unchanged.
+    """
+    transform = featureset.pop('transform', None)
+    if transform is None:
+        return featureset
+    sx, sy = transform['scale'][:2]
+    tx, ty = transform['translate'][:2]
+    if transform.get('originPosition', "upperLeft") == "upperLeft":
+        point = lambda x, y: [tx + x * sx, ty - y * sy]
+    else:
+        point = lambda x, y: [tx + x * sx, ty + y * sy]
+    for feature in featureset.get('features', []):
+        geometry = feature.get('geometry')
+        if not geometry:
+            continue
+        if 'x' in geometry:
+            if geometry['x'] is not None:
+                geometry['x'], geometry['y'] = point(geometry['x'],
+                                                     geometry['y'])
+        elif 'points' in geometry:
+            geometry['points'] = _vertices(geometry['points'], point)
+        else:
+            for key in ('paths', 'rings'):
+                if key in geometry:
+                    geometry[key] = [_vertices(part, point)
+                                     for part in geometry[key]]
+    return featureset
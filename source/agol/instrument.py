@@ -0,0 +1,208 @@
+"""
+   Per request instrumentation.  Hooks registered here are called before
+   and after every REST call made through BaseAGOLClass with a dictionary
+   describing the request:
+
+      url, endpoint, method - the request
+      request_bytes - size of the request body
+      status - HTTP status code (None if the request failed)
+      wire_bytes, response_bytes - response body size before and after
+                                   decompression
+      dns, connect, ttfb - seconds spent resolving the host, opening the
+                           connection (0 for reused keep-alive
+                           connections) and waiting for the first byte
+      total - seconds for the whole call, including retries
+      decode - seconds spent decoding the JSON response
+      error - the exception raised, if any
+
+   EndpointStats is a ready made after hook that keeps latency
+   histograms per endpoint:
+      stats = instrument.EndpointStats()
+      instrument.register(after=stats.record)
+      ...
+      print stats.report()
+"""
+import time
+import bisect
+import urlparse
+import threading
+
+_before_hooks = []
+_after_hooks = []
+#----------------------------------------------------------------------
+def register(before=None, after=None):
+    """ adds functions called with the request dictionary before and
+        after each request
+    """
+    if before is not None:
+        _before_hooks.append(before)
+    if after is not None:
+        _after_hooks.append(after)
+#----------------------------------------------------------------------
+def unregister(before=None, after=None):
+    """ removes hooks added with register """
+    if before in _before_hooks:
+        _before_hooks.remove(before)
+    if after in _after_hooks:
+        _after_hooks.remove(after)
+#----------------------------------------------------------------------
+def before(method, url, body=None):
+    """ starts the record of a request and calls the before hooks """
+    if body is None:
+        request_bytes = 0
+    else:
+        request_bytes = len(body)
+    info = {"url": url,
+            "endpoint": urlparse.urlparse(url).path,
+            "method": method,
+            "request_bytes": request_bytes,
+            "status": None,
+            "wire_bytes": 0,
+            "response_bytes": 0,
+            "dns": 0.0,
+            "connect": 0.0,
+            "ttfb": 0.0,
+            "total": 0.0,
+            "decode": 0.0,
+            "error": None,
+            "_started": time.time()}
+    for hook in _before_hooks:
+        hook(info)
+    return info
+#----------------------------------------------------------------------
+def response(info, res):
+    """ copies the details of a connection.Response into a record """
+    info['status'] = res.status
+    info['wire_bytes'] = res.wire_bytes
+    info['response_bytes'] = res.decoded_bytes
+    info.update(res.timings)
+#----------------------------------------------------------------------
+def after(info):
+    """ completes the record of a request and calls the after hooks """
+    info['total'] = time.time() - info.pop('_started')
+    for hook in _after_hooks:
+        hook(info)
+########################################################################
+class Histogram(object):
+    """ latency histogram with logarithmic buckets in milliseconds """
+    _bounds = (1, 2, 5, 10, 20, 50, 100, 200, 500,
+               1000, 2000, 5000, 10000, 20000, 60000)
+    #----------------------------------------------------------------------
+    def __init__(self):
+        """Constructor"""
+        self._counts = [0] * (len(self._bounds) + 1)
+        self._count = 0
+        self._sum = 0.0
+        self._max = 0.0
+    #----------------------------------------------------------------------
+    def add(self, seconds):
+        """ records a duration given in seconds """
+        ms = seconds * 1000.0
+        self._counts[bisect.bisect_left(self._bounds, ms)] += 1
+        self._count += 1
+        self._sum += ms
+        if ms > self._max:
+            self._max = ms
+    #----------------------------------------------------------------------
+    @property
+    def count(self):
+        """ number of recorded values """
+        return self._count
+    #----------------------------------------------------------------------
+    @property
+    def mean(self):
+        """ mean in milliseconds """
+        if self._count == 0:
+            return 0.0
+        return self._sum / self._count
+    #----------------------------------------------------------------------
+    @property
+    def max(self):
+        """ largest value in milliseconds """
+        return self._max
+    #----------------------------------------------------------------------
+    @property
+    def buckets(self):
+        """ list of (upper bound in ms, count) tuples, the last bound is
+            None for values above the largest bucket
+        """
+        return zip(list(self._bounds) + [None], self._counts)
+    #----------------------------------------------------------------------
+    def percentile(self, p):
+        """ returns the upper bound in ms of the bucket holding the p-th
+            percentile (0-100)
+        """
+        if self._count == 0:
+            return 0.0
+        target = self._count * p / 100.0
+        seen = 0
+        for bound, count in self.buckets:
+            seen += count
+            if seen >= target:
+                if bound is None:
+                    return self._max
+                return min(bound, self._max)
+        return self._max
+########################################################################
+class EndpointStats(object):
+    """ after hook that aggregates request records per endpoint """
+    _phases = ("total", "dns", "connect", "ttfb", "decode")
+    #----------------------------------------------------------------------
+    def __init__(self):
+        """Constructor"""
+        self._endpoints = {}
+        self._lock = threading.Lock()
+    #----------------------------------------------------------------------
+    def record(self, info):
+        """ adds a request record, use as instrument.register(after=...) """
+        with self._lock:
+            stats = self._endpoints.get(info['endpoint'])
+            if stats is None:
+                stats = dict((phase, Histogram()) for phase in self._phases)
+                stats.update({"requests": 0, "errors": 0,
+                              "request_bytes": 0, "wire_bytes": 0,
+                              "response_bytes": 0})
+                self._endpoints[info['endpoint']] = stats
+            for phase in self._phases:
+                stats[phase].add(info[phase])
+            stats['requests'] += 1
+            if info['error'] is not None or \
+               (info['status'] is not None and info['status'] >= 400):
+                stats['errors'] += 1
+            stats['request_bytes'] += info['request_bytes']
+            stats['wire_bytes'] += info['wire_bytes']
+            stats['response_bytes'] += info['response_bytes']
+    #----------------------------------------------------------------------
+    def reset(self):
+        """ removes all recorded values """
+        with self._lock:
+            self._endpoints = {}
+    #----------------------------------------------------------------------
+    @property
+    def endpoints(self):
+        """ dictionary of endpoint -> statistics, where each phase
+            (total, dns, connect, ttfb, decode) is a Histogram
+        """
+        return self._endpoints
+    #----------------------------------------------------------------------
+    def report(self):
+        """ returns a text table of the recorded endpoints, slowest total
+            time first
+        """
+        lines = ["%-60s %7s %9s %9s %9s %9s %9s %12s" %
+                 ("endpoint", "count", "mean ms", "p50 ms", "p95 ms",
+                  "ttfb ms", "decode ms", "wire bytes")]
+        with self._lock:
+            items = sorted(self._endpoints.iteritems(),
+                           key=lambda kv: -kv[1]['total'].mean *
+                           kv[1]['total'].count)
+            for endpoint, stats in items:
+                lines.append("%-60s %7d %9.1f %9.1f %9.1f %9.1f %9.1f %12d" %
+                             (endpoint[-60:], stats['requests'],
+                              stats['total'].mean,
+                              stats['total'].percentile(50),
+                              stats['total'].percentile(95),
+                              stats['ttfb'].mean,
+                              stats['decode'].mean,
+                              stats['wire_bytes']))
+        return "\n".join(lines)
@@ -0,0 +1,69 @@
+"""
+   Single pass JSON decoding for REST responses.  Strings are encoded to
+   utf-8 str while the document is parsed, instead of rebuilding the
+   whole decoded object a second time.  simplejson is used when it is
+   installed since its C scanner is faster and already returns str for
+   ascii text.
+"""
+try:
+    import simplejson as json
+except ImportError:
+    import json
+from itertools import chain
+
+_NUMBERS = frozenset([int, long, float, bool, type(None)])
+_LISTS = frozenset([list])
+#----------------------------------------------------------------------
+def _encode_list(values):
+    """ encodes the unicode items of a (nested) list in place.  A list
+        is only skipped when all of its items, or all items of its item
+        lists, are numbers or None, so coordinate arrays are checked at
+        C speed instead of walked vertex by vertex; any list holding a
+        string is walked in full.
+    """
+    types = set(map(type, values))
+    if types <= _NUMBERS:
+        return values
+    if types == _LISTS and \
+       _NUMBERS.issuperset(map(type, chain.from_iterable(values))):
+        return values
+    for index, value in enumerate(values):
+        if isinstance(value, unicode):
+            values[index] = value.encode('utf-8')
+        elif isinstance(value, list):
+            _encode_list(value)
+    return values
+#----------------------------------------------------------------------
+def _encode_pairs(pairs):
+    """ object_pairs_hook that builds a dictionary of utf-8 str """
+    result = {}
+    for key, value in pairs:
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        elif isinstance(value, list):
+            _encode_list(value)
+        result[key] = value
+    return result
+#----------------------------------------------------------------------
+def loads(text):
+    """ decodes a JSON string to python objects with utf-8 str values """
+    obj = json.loads(text, object_pairs_hook=_encode_pairs)
+    if isinstance(obj, unicode):
+        return obj.encode('utf-8')
+    elif isinstance(obj, list):
+        return _encode_list(obj)
+    return obj
+#----------------------------------------------------------------------
+def unicode_convert(obj):
+    """ converts unicode to anscii """
+    if isinstance(obj, dict):
+        return {unicode_convert(key): unicode_convert(value)
+                for key, value in obj.iteritems()}
+    elif isinstance(obj, list):
+        return [unicode_convert(element) for element in obj]
+    elif isinstance(obj, unicode):
+        return obj.encode('utf-8')
+    else:
+        return obj
@@ -1,6 +1,17 @@
 import common
 import filters
 import featureservice
+import jsonutils
+import metadata
+import paging
+import extract
+import querycache
+import aggregate
+import delta
+import planner
+import generalize
+import pbf
+import instrument
 from base import BaseAGOLClass
 import os
 import json
@@ -8,372 +19,197 @@ import math
 import urlparse
 import mimetypes
 import uuid
+import threading
+import time
+import urllib
+import urllib2
+########################################################################
+class LayerInfo(metadata.Record):
+    """ keys of a layer or table's REST JSON """
+    __slots__ = ("currentVersion", "id", "name", "type", "description",
+                 "copyrightText", "definitionExpression", "geometryType",
+                 "hasZ", "hasM", "subLayers", "minScale", "maxScale",
+                 "effectiveMinScale", "effectiveMaxScale",
+                 "defaultVisibility", "extent", "timeInfo", "drawingInfo",
+                 "hasAttachments", "htmlPopupType", "displayField",
+                 "typeIdField", "objectIdField", "globalIdField", "fields",
+                 "types", "relationships", "maxRecordCount",
+                 "canModifyLayer", "supportsStatistics",
+                 "supportsAdvancedQueries", "hasLabels", "canScaleSymbols",
+                 "capabilities", "supportedQueryFormats", "isDataVersioned",
+                 "ownershipBasedAccessControlForFeatures",
+                 "useStandardizedQueries", "allowGeometryUpdates",
+                 "templates", "indexes", "hasStaticData",
+                 "supportsRollbackOnFailureParameter",
+                 "advancedQueryCapabilities", "editFieldsInfo")
 ########################################################################
 class FeatureLayer(BaseAGOLClass):
     """
        This contains information about a feature service's layer.
+       The layer's REST JSON is held in a LayerInfo record; keys without
+       a property are available from the raw property.
     """
-    _objectIdField = None
-    _allowGeometryUpdates = None
-    _globalIdField = None
-    _token_url = None
-    _currentVersion = None
-    _id = None
-    _name = None
-    _type = None
-    _description = None
-    _definitionExpression = None
-    _geometryType = None
-    _hasZ = None
-    _hasM = None
-    _copyrightText = None
-    _parentLayer = None
-    _subLayers = None
-    _minScale = None
-    _maxScale = None
-    _effectiveMinScale = None
-    _effectiveMaxScale = None
-    _defaultVisibility = None
-    _extent = None
-    _timeInfo = None
-    _drawingInfo = None
-    _hasAttachments = None
-    _htmlPopupType = None
-    _displayField = None
-    _typeIdField = None
-    _fields = None
-    _types = None # sub-types
-    _relationships = None
-    _maxRecordCount = None
-    _canModifyLayer = None
-    _supportsStatistics = None
-    _supportsAdvancedQueries = None
-    _hasLabels = None
-    _canScaleSymbols = None
-    _capabilities = None
-    _supportedQueryFormats =  None
-    _isDataVersioned = None
-    _ownershipBasedAccessControlForFeatures = None
-    _useStandardizedQueries = None
-    _templates = None
-    _indexes = None
-    _hasStaticData = None
-    _supportsRollbackOnFailureParameter = None
-    _advancedQueryCapabilities = None
+    __slots__ = ("_url", "_token_url", "_username", "_password",
+                 "_static_token", "_parentLayer", "_info", "_loaded",
+                 "_load_lock", "_use_pbf")
     #----------------------------------------------------------------------
     def __init__(self, url,
                  username=None,
                  password=None,
-                 token_url=None):
-        """Constructor"""
+                 token_url=None,
+                 parent=None):
+        """Constructor
+           The layer's metadata is loaded on first access of a property.
+           parent is the FeatureService the layer belongs to; when None
+           it is created on first access of parentLayer.
+        """
         self._url = url
         self._token_url = token_url
         self._username = username
         self._password = password
+        self._static_token = None
+        self._parentLayer = parent
+        self._info = LayerInfo()
+        self._loaded = False
+        self._load_lock = threading.RLock()
+        self._use_pbf = None
         if not username is None and\
            not password is None:
             if not token_url is None:
                 self._token = self.generate_token(tokenURL=token_url)[0]
             else:
                 self._token = self.generate_token()[0]
-        self.__init()
     #----------------------------------------------------------------------
     def __init(self):
-        """ initializes the service """
-        params = {
-            "f" : "json",
-        }
-        if self._token is not None:
-            params['token'] = self._token
-        json_dict = self._do_get(self._url, params)
-        attributes = [attr for attr in dir(self)
-                      if not attr.startswith('__') and \
-                      not attr.startswith('_')]
-        for k,v in json_dict.iteritems():
-            if k in attributes:
-                setattr(self, "_"+ k, json_dict[k])
-            else:
-                print k, " - attribute not implmented."
-        self._parentLayer = featureservice.FeatureService(
-            url=os.path.dirname(self._url),
-            token_url=self._token_url,
-            username=self._username,
-            password=self._password)
-    #----------------------------------------------------------------------
-    @property
-    def advancedQueryCapabilities(self):
-        """ returns the advanced query capabilities """
-        if self._advancedQueryCapabilities is None:
-            self.__init()
-        return self._advancedQueryCapabilities
-    #----------------------------------------------------------------------
-    @property
-    def supportsRollbackOnFailureParameter(self):
-        """ returns if rollback on failure supported """
-        if self._supportsRollbackOnFailureParameter is None:
-            self.__init()
-        return self._supportsRollbackOnFailureParameter
-    #----------------------------------------------------------------------
-    @property
-    def hasStaticData(self):
-        """boolean T/F if static data is present """
-        if self._hasStaticData is None:
-            self.__init()
-        return self._hasStaticData
-    #----------------------------------------------------------------------
-    @property
-    def indexes(self):
-        """gets the indexes"""
-        if self._indexes is None:
-            self.__init()
-        return self._indexes
-    #----------------------------------------------------------------------
-    @property
-    def templates(self):
-        """ gets the template """
-        if self._templates is None:
-            self.__init()
-        return self._templates
-    #----------------------------------------------------------------------
-    @property
-    def allowGeometryUpdates(self):
-        """ returns boolean if geometry updates are allowed """
-        if self._allowGeometryUpdates is None:
-            self.__init()
-        return self._allowGeometryUpdates
-    #----------------------------------------------------------------------
-    @property
-    def globalIdField(self):
-        """ returns the global id field """
-        if self._globalIdField is None:
-            self.__init()
-        return self._globalIdField
-
-    #----------------------------------------------------------------------
-    @property
-    def objectIdField(self):
-        if self._objectIdField is None:
-            self.__init()
-        return self._objectIdField
-    #----------------------------------------------------------------------
-    @property
-    def currentVersion(self):
-        """ returns the current version """
-        if self._currentVersion is None:
-            self.__init()
-        return self._currentVersion
-    #----------------------------------------------------------------------
-    @property
-    def id(self):
-        """ returns the id """
-        if self._id is None:
-            self.__init()
-        return self._id
-    #----------------------------------------------------------------------
-    @property
-    def name(self):
-        """ returns the name """
-        if self._name is None:
-            self.__init()
-        return self._name
-    #----------------------------------------------------------------------
-    @property
-    def type(self):
-        """ returns the type """
-        if self._type is None:
-            self.__init()
-        return self._type
-    #----------------------------------------------------------------------
-    @property
-    def description(self):
-        """ returns the layer's description """
-        if self._description is None:
-            self.__init()
-        return self._description
+        """ initializes the service.  The metadata is loaded once; threads
+            calling while a load is running wait for it instead of
+            sending their own request.  Properties that are null on the
+            server do not trigger another load.
+        """
+        if self._loaded:
+            return
+        with self._load_lock:
+            if self._loaded:
+                return
+            params = {
+                "f" : "json",
+            }
+            if self._token is not None:
+                params['token'] = self._token
+            json_dict = self._get_metadata(self._url, params)
+            self._info = LayerInfo(json_dict)
+            self._loaded = True
     #----------------------------------------------------------------------
-    @property
-    def definitionExpression(self):
-        """returns the definitionExpression"""
-        if self._definitionExpression is None:
+    def _load(self, json_dict=None):
+        """ loads the layer's metadata from the server, or from json_dict
+            when the definition was already fetched (e.g. by the
+            service's /layers resource)
+        """
+        if json_dict is None:
             self.__init()
-        return self._definitionExpression
+        else:
+            with self._load_lock:
+                self._info = LayerInfo(json_dict)
+                self._loaded = True
     #----------------------------------------------------------------------
-    @property
-    def geometryType(self):
-        """returns the geometry type"""
-        if self._geometryType is None:
-            self.__init()
-        return self._geometryType
+    def _hydrate(self, json_dict):
+        """ sets known values, such as the layer summary of the service
+            JSON, without marking the layer as loaded
+        """
+        self._info.update(json_dict)
     #----------------------------------------------------------------------
-    @property
-    def hasZ(self):
-        """ returns if it has a Z value or not """
-        if self._hasZ is None:
+    def refresh(self):
+        """ reloads the layer's metadata from the server """
+        with self._load_lock:
+            self._invalidate_metadata(self._url)
+            self._loaded = False
             self.__init()
-        return self._hasZ
     #----------------------------------------------------------------------
     @property
-    def hasM(self):
-        """ returns if it has a m value or not """
-        if self._hasM is None:
-            self.__init()
-        return self._hasM
+    def raw(self):
+        """ returns the layer JSON keys that have no property """
+        self.__init()
+        return self._info.raw
     #----------------------------------------------------------------------
-    @property
-    def copyrightText(self):
-        """ returns the copyright text """
-        if self._copyrightText is None:
-            self.__init()
-        return self._copyrightText
+    currentVersion = metadata.field("currentVersion",
+                                    "returns the current version")
+    id = metadata.field("id", "returns the id")
+    name = metadata.field("name", "returns the name")
+    type = metadata.field("type", "returns the type")
+    description = metadata.field("description",
+                                 "returns the layer's description")
+    copyrightText = metadata.field("copyrightText",
+                                   "returns the copyright text")
+    definitionExpression = metadata.field(
+        "definitionExpression", "returns the definitionExpression")
+    geometryType = metadata.field("geometryType",
+                                  "returns the geometry type")
+    hasZ = metadata.field("hasZ", "returns if it has a Z value or not")
+    hasM = metadata.field("hasM", "returns if it has a m value or not")
+    subLayers = metadata.field("subLayers", "returns sublayers for layer")
+    minScale = metadata.field("minScale", "minimum scale layer will show")
+    maxScale = metadata.field("maxScale", "sets the max scale")
+    effectiveMinScale = metadata.field("effectiveMinScale")
+    effectiveMaxScale = metadata.field("effectiveMaxScale")
+    defaultVisibility = metadata.field("defaultVisibility")
+    extent = metadata.field("extent")
+    timeInfo = metadata.field("timeInfo")
+    drawingInfo = metadata.field("drawingInfo")
+    hasAttachments = metadata.field("hasAttachments")
+    htmlPopupType = metadata.field("htmlPopupType")
+    displayField = metadata.field("displayField")
+    typeIdField = metadata.field("typeIdField")
+    objectIdField = metadata.field("objectIdField")
+    globalIdField = metadata.field("globalIdField",
+                                   "returns the global id field")
+    fields = metadata.field("fields")
+    types = metadata.field("types")
+    relationships = metadata.field("relationships")
+    canModifyLayer = metadata.field("canModifyLayer")
+    supportsStatistics = metadata.field("supportsStatistics")
+    supportsAdvancedQueries = metadata.field("supportsAdvancedQueries")
+    hasLabels = metadata.field("hasLabels")
+    canScaleSymbols = metadata.field("canScaleSymbols")
+    capabilities = metadata.field("capabilities")
+    supportedQueryFormats = metadata.field("supportedQueryFormats")
+    isDataVersioned = metadata.field("isDataVersioned")
+    ownershipBasedAccessControlForFeatures = metadata.field(
+        "ownershipBasedAccessControlForFeatures")
+    useStandardizedQueries = metadata.field("useStandardizedQueries")
+    allowGeometryUpdates = metadata.field(
+        "allowGeometryUpdates", "returns boolean if geometry updates are allowed")
+    templates = metadata.field("templates", "gets the template")
+    indexes = metadata.field("indexes", "gets the indexes")
+    hasStaticData = metadata.field("hasStaticData",
+                                   "boolean T/F if static data is present")
+    supportsRollbackOnFailureParameter = metadata.field(
+        "supportsRollbackOnFailureParameter",
+        "returns if rollback on failure supported")
+    advancedQueryCapabilities = metadata.field(
+        "advancedQueryCapabilities", "returns the advanced query capabilities")
+    editFieldsInfo = metadata.field(
+        "editFieldsInfo", "returns the editor tracking fields of the layer")
     #----------------------------------------------------------------------
     @property
     def parentLayer(self):
-        """ returns information about the parent """
+        """ returns the FeatureService the layer belongs to """
         if self._parentLayer is None:
-            self.__init()
+            self._parentLayer = featureservice.FeatureService(
+                url=os.path.dirname(self._url),
+                token_url=self._token_url,
+                username=self._username,
+                password=self._password)
         return self._parentLayer
     #----------------------------------------------------------------------
     @property
-    def subLayers(self):
-        """ returns sublayers for layer """
-        if self._subLayers is None:
-            self.__init()
-        return self._subLayers
-    #----------------------------------------------------------------------
-    @property
-    def minScale(self):
-        """ minimum scale layer will show """
-        if self._minScale is None:
-            self.__init()
-        return self._minScale
-    @property
-    def maxScale(self):
-        """ sets the max scale """
-        if self._maxScale is None:
-            self.__init()
-        return self._maxScale
-    @property
-    def effectiveMinScale(self):
-        if self._effectiveMinScale is None:
-            self.__init()
-        return self._effectiveMinScale
-    @property
-    def effectiveMaxScale(self):
-        if self._effectiveMaxScale is None:
-            self.__init()
-        return self._effectiveMaxScale
-    @property
-    def defaultVisibility(self):
-        if self._defaultVisibility is None:
-            self.__init()
-        return self._defaultVisibility
-    @property
-    def extent(self):
-        if self._extent is None:
-            self.__init()
-        return self._extent
-    @property
-    def timeInfo(self):
-        if self._timeInfo is None:
-            self.__init()
-        return self._timeInfo
-    @property
-    def drawingInfo(self):
-        if self._drawingInfo is None:
-            self.__init()
-        return self._drawingInfo
-    @property
-    def hasAttachments(self):
-        if self._hasAttachments is None:
-            self.__init()
-        return self._hasAttachments
-    @property
-    def htmlPopupType(self):
-        if self._htmlPopupType is None:
-            self.__init()
-        return self._htmlPopupType
-    @property
-    def displayField(self):
-        if self._displayField is None:
-            self.__init()
-        return self._displayField
-    @property
-    def typeIdField(self):
-        if self._typeIdField is None:
-            self.__init()
-        return self._typeIdField
-    @property
-    def fields(self):
-        if self._fields is None:
-            self.__init()
-        return self._fields
-    @property
-    def types(self):
-        if self._types is None:
-            self.__init()
-        return self._types
-    @property
-    def relationships(self):
-        if self._relationships is None:
-            self.__init()
-        return self._relationships
-    @property
     def maxRecordCount(self):
-        if self._maxRecordCount is None:
-            self.__init()
-            if self._maxRecordCount is None:
-                self._maxRecordCount = 1000
-        return self._maxRecordCount
-    @property
-    def canModifyLayer(self):
-        if self._canModifyLayer is None:
-            self.__init()
-        return self._canModifyLayer
-    @property
-    def supportsStatistics(self):
-        if self._supportsStatistics is None:
-            self.__init()
-        return self._supportsStatistics
-    @property
-    def supportsAdvancedQueries(self):
-        if self._supportsAdvancedQueries is None:
-            self.__init()
-        return self._supportsAdvancedQueries
-    @property
-    def hasLabels(self):
-        if self._hasLabels is None:
-            self.__init()
-        return self._hasLabels
-    @property
-    def canScaleSymbols(self):
-        if self._canScaleSymbols is None:
-            self.__init()
-        return self._canScaleSymbols
-    @property
-    def capabilities(self):
-        if self._capabilities is None:
-            self.__init()
-        return self._capabilities
-    @property
-    def supportedQueryFormats(self):
-        if self._supportedQueryFormats is None:
-            self.__init()
-        return self._supportedQueryFormats
-    @property
-    def isDataVersioned(self):
-        if self._isDataVersioned is None:
-            self.__init()
-        return self._isDataVersioned
-    @property
-    def ownershipBasedAccessControlForFeatures(self):
-        if self._ownershipBasedAccessControlForFeatures is None:
-            self.__init()
-        return self._ownershipBasedAccessControlForFeatures
-    @property
-    def useStandardizedQueries(self):
-        if self._useStandardizedQueries is None:
-            self.__init()
-        return self._useStandardizedQueries
+        """ returns the max record count, 1000 if the layer does not
+            report one
+        """
+        self.__init()
+        if self._info.get("maxRecordCount") is None:
+            return 1000
+        return self._info.maxRecordCount
     #----------------------------------------------------------------------
     def addAttachment(self, oid, file_path):
         """ Adds an attachment to a feature service
@@ -399,7 +235,7 @@ class FeatureLayer(BaseAGOLClass):
                                        fields=params,
                                        port=port,
                                        ssl=parsed.scheme.lower() == 'https')
-            return self._unicode_convert(json.loads(res))
+            return jsonutils.loads(res)
         else:
             return "Attachments are not supported for this feature service."
     #----------------------------------------------------------------------
@@ -446,7 +282,7 @@ class FeatureLayer(BaseAGOLClass):
                                    port=port,
                                    fields=params,
                                    ssl=parsed.scheme.lower() == 'https')
-        return self._unicode_convert(json.loads(res))
+        return jsonutils.loads(res)
     #----------------------------------------------------------------------
     def listAttachments(self, oid):
         """ list attachements for a given OBJECT ID """
@@ -480,7 +316,11 @@ class FeatureLayer(BaseAGOLClass):
               returnIDsOnly=False,
               returnCountOnly=False,
               returnFeatureClass=False,
-              out_fc=None):
+              out_fc=None,
+              outSR=None,
+              maxAllowableOffset=None,
+              geometryPrecision=None,
+              quantizationParameters=None):
         """ queries a feature service based on a sql statement
             Inputs:
                where - the selection sql statement
@@ -503,32 +343,36 @@ class FeatureLayer(BaseAGOLClass):
                                     returned as feature class
                out_fc - only valid if returnFeatureClass is set to True.
                         Output location of query.
+               outSR - wkid of the spatial reference of the returned
+                       geometries
+               maxAllowableOffset - generalizes the returned geometries
+                                    so they move at most this distance
+                                    (in outSR units), see generalize
+               geometryPrecision - number of decimal places of the
+                                   returned coordinates
+               quantizationParameters - dictionary sending the
+                                        coordinates as integers on a
+                                        grid, see generalize.quantization.
+                                        They are converted back before
+                                        they are returned.
             Output:
                A list of Feature Objects (default) or a path to the output featureclass if
                returnFeatureClass is set to True.
          """
-        params = {"f": "json",
-                  "where": where,
-                  "outFields": out_fields,
-                  "returnGeometry" : returnGeometry,
-                  "returnIdsOnly" : returnIDsOnly,
-                  "returnCountOnly" : returnCountOnly,
-                  }
-        if not self._token is None:
-            params["token"] = self._token
-        if not timeFilter is None and \
-           isinstance(timeFilter, filters.TimeFilter):
-            params['time'] = timeFilter.filter
-        if not geometryFilter is None and \
-           isinstance(geometryFilter, filters.GeometryFilter):
-            gf = geometryFilter.filter
-            params['geometry'] = gf['geometry']
-            params['geometryType'] = gf['geometryType']
-            params['spatialRelationship'] = gf['spatialRel']
-            params['inSR'] = gf['inSR']
-        fURL = self._url + "/query"
-        results = self._do_get(fURL, params)
+        params = self._query_params(where=where,
+                                    out_fields=out_fields,
+                                    timeFilter=timeFilter,
+                                    geometryFilter=geometryFilter,
+                                    returnGeometry=returnGeometry,
+                                    returnIDsOnly=returnIDsOnly,
+                                    returnCountOnly=returnCountOnly,
+                                    outSR=outSR,
+                                    maxAllowableOffset=maxAllowableOffset,
+                                    geometryPrecision=geometryPrecision,
+                                    quantizationParameters=quantizationParameters)
+        results = self._fetch_query(params, cache=True)
         if not returnCountOnly and not returnIDsOnly:
+            generalize.dequantize(results)
             if returnFeatureClass:
                 json_text = json.dumps(results)
                 temp = common.scratchFolder() + os.sep + uuid.uuid4().get_hex() + ".json"
@@ -549,6 +393,377 @@ class FeatureLayer(BaseAGOLClass):
             return results
         return
     #----------------------------------------------------------------------
+    def _query_params(self,
+                      where="1=1",
+                      out_fields="*",
+                      timeFilter=None,
+                      geometryFilter=None,
+                      returnGeometry=True,
+                      returnIDsOnly=False,
+                      returnCountOnly=False,
+                      outSR=None,
+                      maxAllowableOffset=None,
+                      geometryPrecision=None,
+                      quantizationParameters=None):
+        """ builds the parameters of a query request, see query() """
+        params = {"f": "json",
+                  "where": where,
+                  "outFields": out_fields,
+                  "returnGeometry" : returnGeometry,
+                  "returnIdsOnly" : returnIDsOnly,
+                  "returnCountOnly" : returnCountOnly,
+                  }
+        if not timeFilter is None and \
+           isinstance(timeFilter, filters.TimeFilter):
+            params['time'] = timeFilter.filter
+        if not geometryFilter is None and \
+           isinstance(geometryFilter, filters.GeometryFilter):
+            gf = geometryFilter.filter
+            params['geometry'] = json.dumps(gf['geometry'])
+            params['geometryType'] = gf['geometryType']
+            params['spatialRel'] = gf['spatialRel']
+            params['inSR'] = json.dumps(gf['inSR'])
+        if outSR is not None:
+            params['outSR'] = outSR
+        if maxAllowableOffset is not None:
+            params['maxAllowableOffset'] = maxAllowableOffset
+        if geometryPrecision is not None:
+            params['geometryPrecision'] = geometryPrecision
+        if quantizationParameters is not None:
+            params['quantizationParameters'] = json.dumps(
+                quantizationParameters)
+        return params
+    #----------------------------------------------------------------------
+    def _fetch_query(self, params, cache=False):
+        """ sends query parameters to the layer's query endpoint with the
+            current token and returns the decoded response.  If cache is
+            True the result may come from querycache.default_cache.
+            Layers listing PBF in supportedQueryFormats are queried with
+            f=pbf, falling back to JSON.
+        """
+        params = dict(params)
+        if not self._token is None:
+            params["token"] = self._token
+        url = self._url + "/query"
+        if self._pbf_query(params):
+            result = self._fetch_pbf(url, params, cache)
+            if result is not None:
+                return result
+        if cache:
+            return self._cached_get(url, params)
+        return self._do_get(url, params)
+    #----------------------------------------------------------------------
+    @property
+    def use_pbf(self):
+        """ gets/sets if queries are sent as f=pbf.  None (default) uses
+            pbf when the layer lists it in supportedQueryFormats, False
+            always uses JSON.
+        """
+        return self._use_pbf
+    #----------------------------------------------------------------------
+    @use_pbf.setter
+    def use_pbf(self, value):
+        """ sets if queries are sent as f=pbf """
+        self._use_pbf = value
+    #----------------------------------------------------------------------
+    def _pbf_query(self, params):
+        """ True when a query can be sent as f=pbf """
+        if self._use_pbf is False or params.get('f') != "json" or \
+           'outStatistics' in params:
+            return False
+        if self._use_pbf:
+            return True
+        formats = self.supportedQueryFormats or ""
+        return "PBF" in [f.strip().upper() for f in formats.split(",")]
+    #----------------------------------------------------------------------
+    def _fetch_pbf(self, url, params, cache=False):
+        """ sends a query as f=pbf and decodes the buffer.  Returns None
+            when the server refuses pbf or the buffer can not be decoded,
+            so the query is repeated as JSON; after a failed decode the
+            layer stays on JSON.
+        """
+        store = querycache.default_cache
+        if cache and store.enabled:
+            value = store.get(url, params, self._metadata_scope)
+            if value is not None:
+                return value
+        pbf_params = dict(params)
+        pbf_params['f'] = "pbf"
+        query = urllib.urlencode(pbf_params)
+        method = "GET"
+        body = None
+        headers = {}
+        target = url + "?%s" % query
+        if len(target) > self._max_url_length:
+            method = "POST"
+            body = query
+            target = url
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        info = instrument.before(method, target, body)
+        try:
+            try:
+                res = self._send(method, target, body, headers, info)
+            except urllib2.HTTPError:
+                return None
+            started = time.time()
+            if res.data[:1] == "{":
+                # errors are answered as JSON
+                value = jsonutils.loads(res.data)
+                if 'error' in value:
+                    return None
+            else:
+                try:
+                    value = pbf.decode(res.data)
+                except pbf.DecodeError:
+                    self._use_pbf = False
+                    return None
+            info['decode'] = time.time() - started
+        finally:
+            instrument.after(info)
+        if cache and store.enabled:
+            store.put(url, params, value, self._metadata_scope)
+        return value
+    #----------------------------------------------------------------------
+    def _invalidate_queries(self):
+        """ drops the cached query results of the layer and its service,
+            called after every edit
+        """
+        querycache.default_cache.invalidate(self._url)
+    #----------------------------------------------------------------------
+    def _pages(self, params, page_size=None):
+        """ returns a generator of the query responses of params, read
+            with the strategy planner.QueryPlanner chooses for the layer.
+            Quantized geometries are converted back to coordinates.
+        """
+        return (generalize.dequantize(page) for page in
+                planner.QueryPlanner(self).pages(params, page_size))
+    #----------------------------------------------------------------------
+    def plan_query(self,
+                   where="1=1",
+                   timeFilter=None,
+                   geometryFilter=None,
+                   page_size=None,
+                   strategy=None):
+        """ returns how iter_query, query_columns and get_local_copy would
+            read a query, without reading it
+            Inputs:
+               where, timeFilter, geometryFilter - see query()
+               page_size - features per request, defaults to the layer's
+                           maxRecordCount
+               strategy - forces one of planner.STRATEGIES
+            Output:
+               planner.Plan with the strategy, page size, feature count
+               and estimated number of requests
+        """
+        params = self._query_params(where=where,
+                                    timeFilter=timeFilter,
+                                    geometryFilter=geometryFilter)
+        return planner.QueryPlanner(self, strategy=strategy).plan(params,
+                                                                  page_size)
+    #----------------------------------------------------------------------
+    def iter_query(self,
+                   where="1=1",
+                   out_fields="*",
+                   timeFilter=None,
+                   geometryFilter=None,
+                   returnGeometry=True,
+                   page_size=None,
+                   pages=False,
+                   prefetch=True,
+                   outSR=None,
+                   maxAllowableOffset=None,
+                   geometryPrecision=None,
+                   quantizationParameters=None):
+        """ queries the layer page by page and yields the features as the
+            pages arrive, so results are not cut at the maxRecordCount
+            and do not have to fit in memory
+            Inputs:
+               where, out_fields, timeFilter, geometryFilter,
+               returnGeometry - see query()
+               page_size - features per request, defaults to the layer's
+                           maxRecordCount
+               pages - if True a list of Feature objects is yielded per
+                       page instead of single features
+               prefetch - if True the next page is requested while the
+                          current one is processed
+               outSR, maxAllowableOffset, geometryPrecision,
+               quantizationParameters - see query()
+            Output:
+               generator of common.Feature objects (or lists of them)
+        """
+        params = self._query_params(where=where,
+                                    out_fields=out_fields,
+                                    timeFilter=timeFilter,
+                                    geometryFilter=geometryFilter,
+                                    returnGeometry=returnGeometry,
+                                    outSR=outSR,
+                                    maxAllowableOffset=maxAllowableOffset,
+                                    geometryPrecision=geometryPrecision,
+                                    quantizationParameters=quantizationParameters)
+        results = self._pages(params, page_size)
+        if prefetch:
+            results = paging.prefetch(results)
+        for result in results:
+            feats = [common.Feature(res) for res in result.get('features', [])]
+            if pages:
+                yield feats
+            else:
+                for feat in feats:
+                    yield feat
+    #----------------------------------------------------------------------
+    def query_columns(self,
+                      where="1=1",
+                      out_fields="*",
+                      timeFilter=None,
+                      geometryFilter=None,
+                      returnGeometry=True,
+                      page_size=None,
+                      outSR=None,
+                      maxAllowableOffset=None,
+                      geometryPrecision=None,
+                      quantizationParameters=None):
+        """ queries the layer page by page and decodes the results into
+            NumPy arrays, one per field, without building Feature
+            objects.  Needs NumPy but not arcpy.
+            Inputs:
+               where, out_fields, timeFilter, geometryFilter,
+               returnGeometry - see query()
+               page_size - features per request, defaults to the layer's
+                           maxRecordCount
+               outSR, maxAllowableOffset, geometryPrecision,
+               quantizationParameters - see query()
+            Output:
+               columnar.ColumnarResult
+        """
+        # numpy is only needed for columnar results
+        import columnar
+        params = self._query_params(where=where,
+                                    out_fields=out_fields,
+                                    timeFilter=timeFilter,
+                                    geometryFilter=geometryFilter,
+                                    returnGeometry=returnGeometry,
+                                    outSR=outSR,
+                                    maxAllowableOffset=maxAllowableOffset,
+                                    geometryPrecision=geometryPrecision,
+                                    quantizationParameters=quantizationParameters)
+        results = []
+        for page in paging.prefetch(self._pages(params, page_size)):
+            results.append(columnar.ColumnarResult(page, self.fields))
+        return columnar.ColumnarResult.concat(results)
+    #----------------------------------------------------------------------
+    def statistics(self,
+                   stats,
+                   groupBy=None,
+                   having=None,
+                   where="1=1",
+                   timeFilter=None,
+                   geometryFilter=None,
+                   partitions=None,
+                   workers=4):
+        """ computes statistics on the server (outStatistics) instead of
+            downloading the features
+            Inputs:
+               stats - list of (statistic, field, alias) tuples, e.g.
+                       [("count", "OBJECTID", "n"), ("sum", "POP", "pop")].
+                       The alias may be left out.  Statistics are count,
+                       sum, min, max, avg, stddev, var and, without
+                       partitions, percentile_cont/percentile_disc.
+               groupBy - list of fields to group the statistics by
+               having - optional having clause on the groups
+               where, timeFilter, geometryFilter - see query()
+               partitions - None sends one request and, if the server cuts
+                            it (exceededTransferLimit), repeats it over
+                            object id ranges of at most maxRecordCount
+                            ids.  Server errors are raised.  An
+                            integer splits the object ids into that many
+                            ranges, a list of where clauses uses those as
+                            partitions.  Partial results are combined per
+                            group.
+               workers - number of partition requests run at once
+            Output:
+               ordered dictionary of column name -> list of values, the
+               group by fields first, then the statistic aliases
+        """
+        if self.supportsStatistics is False:
+            raise ValueError("%s does not support statistics" % self._url)
+        specs = aggregate.normalize(stats)
+        if isinstance(groupBy, basestring):
+            groupBy = [f.strip() for f in groupBy.split(",")]
+        group_by = list(groupBy or [])
+        params = self._query_params(where=where,
+                                    out_fields="",
+                                    timeFilter=timeFilter,
+                                    geometryFilter=geometryFilter,
+                                    returnGeometry=False)
+        if len(group_by) > 0:
+            params['groupByFieldsForStatistics'] = ",".join(group_by)
+        if partitions is None:
+            single = dict(params)
+            single['outStatistics'] = json.dumps(
+                aggregate.out_statistics(specs))
+            if len(group_by) > 0:
+                single['orderByFields'] = ",".join(group_by)
+            if having is not None:
+                single['having'] = having
+            result = self._fetch_query(single, cache=True)
+            if 'error' in result:
+                raise ValueError(result)
+            if not result.get('exceededTransferLimit', False):
+                names = [alias for statistic, field, alias in specs]
+                return aggregate.columns(
+                    aggregate.rows(result, group_by, names), group_by, specs)
+        aggregate.check_partitioned(specs, having)
+        out_statistics = aggregate.out_statistics(specs, partitioned=True)
+        params['outStatistics'] = json.dumps(out_statistics)
+        names = [s['outStatisticFieldName'] for s in out_statistics]
+        if isinstance(partitions, (list, tuple)):
+            def fetch(clause):
+                part = dict(params)
+                part['where'] = "(%s) AND (%s)" % (where, clause)
+                result = self._fetch_query(part, cache=True)
+                if result.get('exceededTransferLimit', False):
+                    raise ValueError("partition %s exceeds the transfer "
+                                     "limit" % clause)
+                return aggregate.rows(result, group_by, names)
+            items = partitions
+        else:
+            id_params = dict(params)
+            del id_params['outStatistics']
+            id_params.pop('groupByFieldsForStatistics', None)
+            id_params['returnIdsOnly'] = True
+            result = self._fetch_query(id_params)
+            if 'error' in result:
+                raise ValueError(result)
+            oids = sorted(result.get('objectIds') or [])
+            oid_field = result.get('objectIdFieldName', self.objectIdField)
+            size = self.maxRecordCount
+            if partitions is not None:
+                size = max(1, int(math.ceil(len(oids) /
+                                            float(max(1, partitions)))))
+            fetch = lambda batch: self._statistics_range(
+                params, oid_field, batch, group_by, names)
+            items = paging.oid_batches(oids, size)
+        results = paging.ordered_map(fetch, items, workers)
+        return aggregate.columns(aggregate.combine(results, specs),
+                                 group_by, specs)
+    #----------------------------------------------------------------------
+    def _statistics_range(self, params, oid_field, batch, group_by, names):
+        """ returns the statistics rows of a sorted batch of object ids,
+            splitting the batch in half while the server cuts the result
+        """
+        part = dict(params)
+        part['where'] = "(%s) AND %s >= %s AND %s <= %s" % \
+            (params.get('where', '1=1'), oid_field, batch[0],
+             oid_field, batch[-1])
+        result = self._fetch_query(part, cache=True)
+        if result.get('exceededTransferLimit', False) and len(batch) > 1:
+            half = len(batch) / 2
+            return self._statistics_range(params, oid_field, batch[:half],
+                                          group_by, names) + \
+                   self._statistics_range(params, oid_field, batch[half:],
+                                          group_by, names)
+        return aggregate.rows(result, group_by, names)
+    #----------------------------------------------------------------------
     def query_related_records(self,
                               objectIds,
                               relationshipId,
@@ -667,12 +882,25 @@ class FeatureLayer(BaseAGOLClass):
             yield l[i*newn:i*newn+newn]
         yield l[n*newn-newn:]
     #----------------------------------------------------------------------
-    def get_local_copy(self, out_path, includeAttachments=False):
+    def get_local_copy(self, out_path, includeAttachments=False,
+                       workers=4, progress=None, tiled=False,
+                       outSR=None, maxAllowableOffset=None,
+                       geometryPrecision=None):
         """ exports the whole feature service to a feature class
             Input:
                out_path - path to where the data will be placed
                includeAttachments - default False. If sync is not supported
                                     then the paramter is ignored.
+               workers - number of queries run at once
+                         when sync is not supported
+               progress - optional function called as progress(done, total)
+                          with the number of features written so far when
+                          sync is not supported
+               tiled - if True the layer is read by spatial tiles of its
+                       extent when sync is not supported, otherwise the
+                       query planner chooses how it is read
+               outSR, maxAllowableOffset, geometryPrecision - see query(),
+                       used when sync is not supported
             Output:
                path to exported feature class or fgdb (as list)
         """
@@ -690,32 +918,40 @@ class FeatureLayer(BaseAGOLClass):
                                                   returnAsFeatureClass=True,
                                                   out_path=out_path)[0]
         else:
-            result_features = []
-            res = self.query(returnIDsOnly=True)
-            OIDS = res['objectIds']
-            OIDS.sort()
-            OIDField = res['objectIdFieldName']
-            count = len(OIDS)
-            if count <= self.maxRecordCount:
-                bins = 1
-            else:
-                bins = count / self.maxRecordCount
-                v = count % self.maxRecordCount
-                if v > 0:
-                    bins += 1
-            chunks = self._chunks(OIDS, bins)
-            for chunk in chunks:
-                chunk.sort()
-                sql = "%s >= %s and %s <= %s" % (OIDField, chunk[0],
-                                                 OIDField, chunk[len(chunk) -1])
-                temp_base = "a" + uuid.uuid4().get_hex()[:6] + "a"
-                temp_fc = r"%s\%s" % (common.scratchGDB(), temp_base)
-                temp_fc = self.query(where=sql,
-                                     returnFeatureClass=True,
-                                     out_fc=temp_fc)
-                result_features.append(temp_fc)
-            return common.merge_feature_class(merges=result_features,
-                                              out_fc=out_path)
+            strategy = None
+            if tiled:
+                strategy = planner.TILES
+            query_planner = planner.QueryPlanner(self, workers=workers,
+                                                 progress=progress,
+                                                 strategy=strategy)
+            return extract.to_featureclass(
+                self, query_planner.pages(self._query_params(
+                    outSR=outSR,
+                    maxAllowableOffset=maxAllowableOffset,
+                    geometryPrecision=geometryPrecision)), out_path)
+    #----------------------------------------------------------------------
+    def extract_changes(self, watermark, where="1=1", out_fields="*",
+                        returnGeometry=True, commit=True):
+        """ returns the features added, edited or deleted since the last
+            run, using the layer's editor tracking edit date and the
+            object ids stored in a watermark file
+            Inputs:
+               watermark - path of the layer's watermark file (created on
+                           the first run) or a delta.Watermark object
+               where - limits the features tracked
+               out_fields, returnGeometry - see query()
+               commit - if True the watermark is saved right away.  Pass
+                        False and call commit() on the result once the
+                        changes are applied, so a failed run is repeated.
+            Output:
+               delta.ChangeSet with the upserts and deletes
+        """
+        changes = delta.DeltaExtractor(self, watermark).changes(
+            where=where, out_fields=out_fields,
+            returnGeometry=returnGeometry)
+        if commit:
+            changes.commit()
+        return changes
     #----------------------------------------------------------------------
     def updateFeature(self,
                       features,
@@ -750,6 +986,7 @@ class FeatureLayer(BaseAGOLClass):
         updateURL = self._url + "/updateFeatures"
         res = self._do_post(url=updateURL,
                             param_dict=params)
+        self._invalidate_queries()
         return res
     #----------------------------------------------------------------------
     def deleteFeatures(self,
@@ -801,7 +1038,8 @@ class FeatureLayer(BaseAGOLClass):
         if not self._token is None:
             params['token'] = self._token
         result = self._do_post(url=dURL, param_dict=params)
-        self.__init()
+        self._invalidate_queries()
+        self.refresh()
         return result
     #----------------------------------------------------------------------
     def applyEdits(self,
@@ -846,7 +1084,9 @@ class FeatureLayer(BaseAGOLClass):
         if deleteFeatures is not None and \
            isinstance(deleteFeatures, str):
             params['deletes'] = deleteFeatures
-        return self._do_post(url=editURL, param_dict=params)
+        result = self._do_post(url=editURL, param_dict=params)
+        self._invalidate_queries()
+        return result
     #----------------------------------------------------------------------
     def addFeatures(self, fc, attachmentTable=None,
                     nameField="ATT_NAME", blobField="DATA",
@@ -870,8 +1110,7 @@ class FeatureLayer(BaseAGOLClass):
             bins = 1
             uURL = self._url + "/addFeatures"
             max_chunk = 250
-            js = self._unicode_convert(
-                common.featureclass_to_json(fc))
+            js = common.featureclass_to_json(fc)
             js = js['features']
             if len(js) <= max_chunk:
                 bins = 1
@@ -892,6 +1131,7 @@ class FeatureLayer(BaseAGOLClass):
                 messages.append(result)
                 del params
                 del result
+            self._invalidate_queries()
             return True, messages
         else:
             oid_field = common.get_OID_field(fc)
@@ -920,7 +1160,7 @@ class FeatureLayer(BaseAGOLClass):
 ########################################################################
 class TableLayer(FeatureLayer):
     """Table object is exactly like FeatureLayer object"""
-    pass
+    __slots__ = ()
 
 if __name__ == "__main__":
     url = "https://services2.arcgis.com/PWJUSsdoJDp7SgLj/arcgis/rest/services/GridIndexFeatures/FeatureServer/0"
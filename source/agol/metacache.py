@@ -0,0 +1,154 @@
+"""
+   Persistent cache for service, layer and portal item JSON.  Entries are
+   stored as files under a cache folder, keyed by the resource url and
+   the credential scope (user name and token url, never the token), so
+   short lived processes can skip loading metadata that another process
+   already fetched.
+
+   Within the TTL a cached document is returned without a request.  Once
+   it is older it is revalidated with a conditional GET using the
+   ETag/Last-Modified validators the server returned; a 304 answer keeps
+   the stored document for another TTL.
+
+   The cache is off until a folder is set:
+      metacache.default_cache.configure(cache_dir=r"c:\temp\agol_cache",
+                                        ttl=3600)
+"""
+import os
+import time
+import json
+import urllib
+import hashlib
+import threading
+import jsonutils
+
+########################################################################
+class MetadataCache(object):
+    """ on disk cache of REST metadata documents
+        Inputs:
+           cache_dir - folder holding the cache files.  None disables the
+                       cache.
+           ttl - seconds a document is used without asking the server
+    """
+    _cache_dir = None
+    _ttl = None
+    #----------------------------------------------------------------------
+    def __init__(self, cache_dir=None, ttl=3600):
+        """Constructor"""
+        self._cache_dir = cache_dir
+        self._ttl = ttl
+        self._lock = threading.Lock()
+    #----------------------------------------------------------------------
+    def configure(self, cache_dir=None, ttl=None):
+        """ sets the cache folder and/or the TTL """
+        if cache_dir is not None:
+            self._cache_dir = cache_dir
+        if ttl is not None:
+            self._ttl = ttl
+    #----------------------------------------------------------------------
+    def disable(self):
+        """ turns the cache off, leaving the files in place """
+        self._cache_dir = None
+    #----------------------------------------------------------------------
+    @property
+    def enabled(self):
+        """ True when a cache folder is set """
+        return self._cache_dir is not None
+    #----------------------------------------------------------------------
+    @property
+    def cache_dir(self):
+        """ folder holding the cache files """
+        return self._cache_dir
+    #----------------------------------------------------------------------
+    @property
+    def ttl(self):
+        """ seconds a document is used without asking the server """
+        return self._ttl
+    #----------------------------------------------------------------------
+    def key(self, url, params=None, scope=None):
+        """ returns the cache key of a resource.  The token parameter is
+            left out; scope identifies the credential instead.
+        """
+        params = dict(params or {})
+        params.pop('token', None)
+        text = "%s?%s|%s" % (url.rstrip('/'),
+                             urllib.urlencode(sorted(params.items())),
+                             scope)
+        return hashlib.sha1(text).hexdigest()
+    #----------------------------------------------------------------------
+    def _path(self, key):
+        """ file holding the entry of a key """
+        return os.path.join(self._cache_dir, key[:2], key + ".json")
+    #----------------------------------------------------------------------
+    def get(self, key):
+        """ returns the stored entry of a key or None.  An entry is a
+            dictionary with the keys value, stored, etag and
+            last_modified.
+        """
+        if not self.enabled:
+            return None
+        try:
+            with open(self._path(key), 'rb') as reader:
+                return jsonutils.loads(reader.read())
+        except (IOError, OSError, ValueError):
+            return None
+    #----------------------------------------------------------------------
+    def is_fresh(self, entry):
+        """ True if an entry is younger than the TTL """
+        return time.time() - entry['stored'] < self._ttl
+    #----------------------------------------------------------------------
+    def put(self, key, value, etag=None, last_modified=None):
+        """ stores a document.  Files are written to a temporary name and
+            then renamed, so concurrent processes never read a partial
+            entry.
+        """
+        if not self.enabled:
+            return
+        entry = {"value": value,
+                 "stored": time.time(),
+                 "etag": etag,
+                 "last_modified": last_modified}
+        path = self._path(key)
+        folder = os.path.dirname(path)
+        temp = "%s.%s.%s.tmp" % (path, os.getpid(),
+                                 threading.current_thread().ident)
+        try:
+            with self._lock:
+                if not os.path.isdir(folder):
+                    os.makedirs(folder)
+            with open(temp, 'wb') as writer:
+                json.dump(entry, writer)
+            if os.name == 'nt' and os.path.isfile(path):
+                os.remove(path)
+            os.rename(temp, path)
+        except (IOError, OSError):
+            # the cache is an optimization, a failed write is not an error
+            if os.path.isfile(temp):
+                os.remove(temp)
+    #----------------------------------------------------------------------
+    def touch(self, key, entry):
+        """ marks a revalidated entry as fresh again """
+        self.put(key, entry['value'], entry['etag'], entry['last_modified'])
+    #----------------------------------------------------------------------
+    def invalidate(self, key):
+        """ removes the entry of a key """
+        if not self.enabled:
+            return
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+    #----------------------------------------------------------------------
+    def clear(self):
+        """ removes every entry from the cache folder """
+        if not self.enabled or not os.path.isdir(self._cache_dir):
+            return
+        for root, dirs, files in os.walk(self._cache_dir):
+            for name in files:
+                if name.endswith(".json") or name.endswith(".tmp"):
+                    try:
+                        os.remove(os.path.join(root, name))
+                    except OSError:
+                        pass
+########################################################################
+default_cache = MetadataCache()
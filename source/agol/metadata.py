@@ -0,0 +1,80 @@
+"""
+   Declarative metadata records for the REST JSON of services and layers.
+   A record class lists the JSON keys it knows in __slots__.  update()
+   copies a document into the record in a single pass; keys the class
+   does not declare are kept in the raw dictionary, so documents from
+   newer servers load without changes.  Records have no per instance
+   __dict__, which keeps objects small when thousands of layers are held.
+
+   Example:
+      class LayerInfo(metadata.Record):
+          __slots__ = ("id", "name", "fields")
+
+      class Layer(object):
+          name = metadata.field("name", "returns the name")
+"""
+
+########################################################################
+class RecordType(type):
+    """ collects the slot names of a record class and its bases """
+    def __init__(cls, name, bases, attrs):
+        super(RecordType, cls).__init__(name, bases, attrs)
+        keys = set()
+        for klass in cls.__mro__:
+            keys.update(klass.__dict__.get('__slots__', ()))
+        keys.discard('_raw')
+        cls._keys = frozenset(keys)
+########################################################################
+class Record(object):
+    """ base class of the metadata records """
+    __metaclass__ = RecordType
+    __slots__ = ('_raw',)
+    #----------------------------------------------------------------------
+    def __init__(self, json_dict=None):
+        """Constructor"""
+        self._raw = {}
+        if json_dict is not None:
+            self.update(json_dict)
+    #----------------------------------------------------------------------
+    def update(self, json_dict):
+        """ copies the values of a JSON dictionary into the record """
+        keys = self._keys
+        raw = self._raw
+        for k, v in json_dict.iteritems():
+            if k in keys:
+                setattr(self, k, v)
+            else:
+                raw[k] = v
+    #----------------------------------------------------------------------
+    def get(self, key, default=None):
+        """ returns the value of a key, declared or raw """
+        if key in self._keys:
+            return getattr(self, key, default)
+        return self._raw.get(key, default)
+    #----------------------------------------------------------------------
+    @property
+    def raw(self):
+        """ dictionary of the keys without a slot """
+        return self._raw
+    #----------------------------------------------------------------------
+    def as_dict(self):
+        """ returns the record as a JSON dictionary """
+        value = dict(self._raw)
+        for k in self._keys:
+            if hasattr(self, k):
+                value[k] = getattr(self, k)
+        return value
+#----------------------------------------------------------------------
+def field(key, doc=None):
+    """ returns a read only property for a key of the owner's metadata
+        record.  The owner provides _info (a Record), _loaded and
+        _load(); the metadata is loaded the first time a key without a
+        value is read.
+    """
+    def fget(self):
+        value = self._info.get(key)
+        if value is None and not self._loaded:
+            self._load()
+            value = self._info.get(key)
+        return value
+    return property(fget, doc=doc)
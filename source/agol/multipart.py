@@ -0,0 +1,80 @@
+"""
+   Streaming multipart/form-data request body.  Files are read from disk
+   in fixed size blocks while the request is sent, so memory use does not
+   grow with the size of the upload.
+"""
+import os
+
+########################################################################
+class MultipartBody(object):
+    """ file like multipart body that httplib can send with read()
+        Inputs:
+           blocksize - number of bytes read from an uploaded file at once
+    """
+    _blocksize = None
+    #----------------------------------------------------------------------
+    def __init__(self, blocksize=65536):
+        """Constructor"""
+        self._blocksize = blocksize
+        self._parts = []
+        self._length = 0
+        self._index = 0
+        self._offset = 0
+        self._file = None
+    #----------------------------------------------------------------------
+    def add_data(self, data):
+        """ appends a string to the body """
+        self._parts.append((False, data))
+        self._length += len(data)
+    #----------------------------------------------------------------------
+    def add_file(self, file_path):
+        """ appends the contents of a file to the body without reading
+            it into memory
+        """
+        self._parts.append((True, file_path))
+        self._length += os.path.getsize(file_path)
+    #----------------------------------------------------------------------
+    def __len__(self):
+        """ returns the Content-Length of the body """
+        return self._length
+    #----------------------------------------------------------------------
+    def seek(self, offset, whence=0):
+        """ rewinds the body so a request can be resent.  Only seeking to
+            the start is supported.
+        """
+        if offset != 0 or whence != 0:
+            raise IOError("MultipartBody can only seek to the start")
+        self.close()
+        self._index = 0
+        self._offset = 0
+    #----------------------------------------------------------------------
+    def close(self):
+        """ closes the file currently being read """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+    #----------------------------------------------------------------------
+    def read(self, size=-1):
+        """ reads up to size bytes of the body """
+        if size is None or size < 0:
+            size = self._length
+        chunks = []
+        while size > 0 and self._index < len(self._parts):
+            is_file, value = self._parts[self._index]
+            if is_file:
+                if self._file is None:
+                    self._file = open(value, 'rb')
+                chunk = self._file.read(min(size, self._blocksize))
+                if chunk == '':
+                    self.close()
+                    self._index += 1
+                    continue
+            else:
+                chunk = value[self._offset:self._offset + size]
+                self._offset += len(chunk)
+                if self._offset >= len(value):
+                    self._index += 1
+                    self._offset = 0
+            chunks.append(chunk)
+            size -= len(chunk)
+        return ''.join(chunks)
@@ -0,0 +1,110 @@
+"""
+   Paging of layer queries.  A query larger than the server's
+   maxRecordCount is read as a series of pages, either with
+   resultOffset/resultRecordCount while the server reports
+   exceededTransferLimit, or as batches of object ids for servers that
+   do not support pagination.  prefetch() requests the next page on a
+   worker thread while the caller works on the current one.
+
+   ordered_map() runs independent requests (object id ranges, tiles) on
+   a bounded pool of worker threads and yields the results in order.
+
+   The page generators take a fetch(params) function returning the
+   decoded query response, so they are independent of the layer class.
+"""
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+#----------------------------------------------------------------------
+def _check(page):
+    """ raises ValueError for an error response """
+    if 'error' in page:
+        raise ValueError(page)
+    return page
+#----------------------------------------------------------------------
+def offset_pages(fetch, params, page_size, order_by=None):
+    """ yields the query responses of params, page_size features at a
+        time, using resultOffset/resultRecordCount
+        Inputs:
+           fetch - function sending the query parameters
+           params - query parameters
+           page_size - features per page, at most the maxRecordCount
+           order_by - orderByFields value keeping the paging stable,
+                      usually the object id field
+    """
+    offset = 0
+    while True:
+        page_params = dict(params)
+        page_params['resultOffset'] = offset
+        page_params['resultRecordCount'] = page_size
+        if order_by is not None and not 'orderByFields' in page_params:
+            page_params['orderByFields'] = order_by
+        page = _check(fetch(page_params))
+        features = page.get('features', [])
+        yield page
+        if not page.get('exceededTransferLimit', False) or \
+           len(features) == 0:
+            break
+        offset += len(features)
+#----------------------------------------------------------------------
+def oid_batches(oids, size):
+    """ splits a list of object ids into sorted batches of size ids """
+    oids = sorted(oids)
+    for i in xrange(0, len(oids), size):
+        yield oids[i:i + size]
+#----------------------------------------------------------------------
+def oid_pages(fetch, params, oids, page_size):
+    """ yields the query responses of params for batches of page_size
+        object ids
+    """
+    for batch in oid_batches(oids, page_size):
+        page_params = dict(params)
+        page_params['objectIds'] = ",".join(str(oid) for oid in batch)
+        yield _check(fetch(page_params))
+#----------------------------------------------------------------------
+def prefetch(pages):
+    """ iterates pages one step ahead: while the caller handles a page
+        the next one is requested on a worker thread.  Only one page is
+        held in reserve, so memory stays flat.
+    """
+    pool = ThreadPool(1)
+    pending = pool.apply_async(next, (pages,))
+    try:
+        while True:
+            try:
+                page = pending.get()
+            except StopIteration:
+                return
+            pending = pool.apply_async(next, (pages,))
+            yield page
+    finally:
+        # wait for a running request before closing the generator
+        pending.wait()
+        pool.close()
+        pool.join()
+        if hasattr(pages, 'close'):
+            pages.close()
+#----------------------------------------------------------------------
+def ordered_map(func, items, workers=4, window=None):
+    """ yields func(item) for each item, in the order of items, while up
+        to workers calls run at once.  At most window results (default
+        twice the workers) are requested ahead of the caller, so memory
+        is bounded when the caller writes results slower than they
+        arrive.
+    """
+    if window is None:
+        window = workers * 2
+    pool = ThreadPool(workers)
+    pending = deque()
+    try:
+        for item in items:
+            pending.append(pool.apply_async(func, (item,)))
+            if len(pending) >= window:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        for result in pending:
+            result.wait()
+        pool.close()
+        pool.join()
@@ -0,0 +1,339 @@
+"""
+   Decoder of query responses sent as protocol buffers (f=pbf), the
+   esriPBuffer.FeatureCollectionPBuffer message.  The buffer is read
+   directly from the protobuf wire format, so no protobuf package is
+   needed, and is returned as the dictionary the JSON response would
+   have given: a feature set, {"count": n} or the object ids.
+
+   Geometries in the buffer are quantized: integer coordinates, delta
+   encoded along each geometry, that the response's transform scales
+   and translates back to map coordinates.
+"""
+import struct
+
+GEOMETRY_TYPES = {0: "esriGeometryPoint",
+                  1: "esriGeometryMultipoint",
+                  2: "esriGeometryPolyline",
+                  3: "esriGeometryPolygon",
+                  4: "esriGeometryMultiPatch"}
+FIELD_TYPES = {0: "esriFieldTypeSmallInteger",
+               1: "esriFieldTypeInteger",
+               2: "esriFieldTypeSingle",
+               3: "esriFieldTypeDouble",
+               4: "esriFieldTypeString",
+               5: "esriFieldTypeDate",
+               6: "esriFieldTypeOID",
+               7: "esriFieldTypeGeometry",
+               8: "esriFieldTypeBlob",
+               9: "esriFieldTypeRaster",
+               10: "esriFieldTypeGUID",
+               11: "esriFieldTypeGlobalID",
+               12: "esriFieldTypeXML"}
+########################################################################
+class DecodeError(ValueError):
+    """ raised for a buffer that is not a FeatureCollectionPBuffer """
+    pass
+#----------------------------------------------------------------------
+def _varint(data, pos):
+    """ reads a varint, returns (value, next position) """
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+#----------------------------------------------------------------------
+def _signed(value):
+    """ two's complement value of a 64 bit varint """
+    if value >= 0x8000000000000000:
+        return value - 0x10000000000000000
+    return value
+#----------------------------------------------------------------------
+def _zigzag(value):
+    """ decodes a zigzag encoded sint32/sint64 """
+    return (value >> 1) ^ -(value & 1)
+#----------------------------------------------------------------------
+def _message(data, start=0, end=None):
+    """ yields the (field number, wire type, value) of a message.  The
+        value of a length delimited field is its (start, end) span.
+    """
+    if end is None:
+        end = len(data)
+    pos = start
+    try:
+        while pos < end:
+            key, pos = _varint(data, pos)
+            number = key >> 3
+            wire = key & 7
+            if wire == 0:
+                value, pos = _varint(data, pos)
+            elif wire == 2:
+                size, pos = _varint(data, pos)
+                value = (pos, pos + size)
+                pos += size
+            elif wire == 1:
+                value = (pos, pos + 8)
+                pos += 8
+            elif wire == 5:
+                value = (pos, pos + 4)
+                pos += 4
+            else:
+                raise DecodeError("unsupported wire type %s" % wire)
+            if pos > end:
+                raise DecodeError("truncated message")
+            yield number, wire, value
+    except IndexError:
+        raise DecodeError("truncated message")
+#----------------------------------------------------------------------
+def _packed(data, span):
+    """ returns the varints of a packed repeated field """
+    values = []
+    pos, end = span
+    while pos < end:
+        value, pos = _varint(data, pos)
+        values.append(value)
+    return values
+#----------------------------------------------------------------------
+def _text(data, span):
+    """ returns a string field as a utf-8 str """
+    return str(data[span[0]:span[1]])
+#----------------------------------------------------------------------
+def _double(data, span):
+    """ reads a double (fixed64) field """
+    return struct.unpack("<d", str(data[span[0]:span[1]]))[0]
+#----------------------------------------------------------------------
+def _float(data, span):
+    """ reads a float (fixed32) field """
+    return struct.unpack("<f", str(data[span[0]:span[1]]))[0]
+#----------------------------------------------------------------------
+def _value(data, span):
+    """ decodes a Value message, None when no value is set """
+    for number, wire, value in _message(data, *span):
+        if number == 1:
+            return _text(data, value)
+        elif number == 2:
+            return _float(data, value)
+        elif number == 3:
+            return _double(data, value)
+        elif number in (4, 8):
+            return _zigzag(value)
+        elif number in (5, 7):
+            return value
+        elif number == 6:
+            return _signed(value)
+        elif number == 9:
+            return value != 0
+    return None
+#----------------------------------------------------------------------
+def _spatial_reference(data, span):
+    """ decodes a SpatialReference message """
+    sr = {}
+    for number, wire, value in _message(data, *span):
+        if number == 1 and value:
+            sr['wkid'] = value
+        elif number == 2 and value:
+            sr['latestWkid'] = value
+        elif number == 3 and value:
+            sr['vcsWkid'] = value
+        elif number == 4 and value:
+            sr['latestVcsWkid'] = value
+        elif number == 5:
+            sr['wkt'] = _text(data, value)
+    return sr
+#----------------------------------------------------------------------
+def _doubles(data, span):
+    """ decodes a Scale or Translate message into [x, y, m, z] """
+    values = [0.0, 0.0, 0.0, 0.0]
+    for number, wire, value in _message(data, *span):
+        if 1 <= number <= 4:
+            values[number - 1] = _double(data, value)
+    return values
+#----------------------------------------------------------------------
+def _transform(data, span):
+    """ decodes a Transform message """
+    transform = {"upperLeft": True,
+                 "scale": [1.0, 1.0, 1.0, 1.0],
+                 "translate": [0.0, 0.0, 0.0, 0.0]}
+    for number, wire, value in _message(data, *span):
+        if number == 1:
+            transform['upperLeft'] = value == 0
+        elif number == 2:
+            transform['scale'] = _doubles(data, value)
+        elif number == 3:
+            transform['translate'] = _doubles(data, value)
+    return transform
+#----------------------------------------------------------------------
+def _field(data, span):
+    """ decodes a Field message """
+    field = {"name": None, "type": FIELD_TYPES[0], "alias": None}
+    for number, wire, value in _message(data, *span):
+        if number == 1:
+            field['name'] = _text(data, value)
+        elif number == 2:
+            field['type'] = FIELD_TYPES.get(value, "esriFieldTypeString")
+        elif number == 3:
+            field['alias'] = _text(data, value)
+    if field['alias'] is None:
+        field['alias'] = field['name']
+    return field
+#----------------------------------------------------------------------
+def _geometry(data, span, geometry_type, hasZ, hasM, transform):
+    """ decodes a Geometry message into an esri JSON geometry """
+    lengths = []
+    coords = []
+    for number, wire, value in _message(data, *span):
+        if number == 2:
+            if wire == 2:
+                lengths.extend(_packed(data, value))
+            else:
+                lengths.append(value)
+        elif number == 3:
+            if wire == 2:
+                coords.extend(_zigzag(v) for v in _packed(data, value))
+            else:
+                coords.append(_zigzag(value))
+    dims = 2 + int(hasZ) + int(hasM)
+    sx, sy, sm, sz = transform['scale']
+    tx, ty, tm, tz = transform['translate']
+    if transform['upperLeft']:
+        sy = -sy
+    scales = [sx, sy]
+    offsets = [tx, ty]
+    if hasZ:
+        scales.append(sz)
+        offsets.append(tz)
+    if hasM:
+        scales.append(sm)
+        offsets.append(tm)
+    current = [0] * dims
+    vertices = []
+    for i in xrange(0, len(coords) - dims + 1, dims):
+        vertex = []
+        for k in xrange(dims):
+            current[k] += coords[i + k]
+            vertex.append(current[k] * scales[k] + offsets[k])
+        vertices.append(vertex)
+    if geometry_type == "esriGeometryPoint":
+        if len(vertices) == 0:
+            return {"x": None, "y": None}
+        point = {"x": vertices[0][0], "y": vertices[0][1]}
+        if hasZ:
+            point['z'] = vertices[0][2]
+        if hasM:
+            point['m'] = vertices[0][-1]
+        return point
+    if geometry_type == "esriGeometryMultipoint":
+        return {"points": vertices}
+    parts = []
+    start = 0
+    for length in lengths or [len(vertices)]:
+        parts.append(vertices[start:start + length])
+        start += length
+    if geometry_type == "esriGeometryPolyline":
+        return {"paths": parts}
+    return {"rings": parts}
+#----------------------------------------------------------------------
+def _feature(data, span, names, geometry_type, hasZ, hasM, transform):
+    """ decodes a Feature message into an esri JSON feature """
+    values = []
+    geometry = None
+    for number, wire, value in _message(data, *span):
+        if number == 1:
+            values.append(_value(data, value))
+        elif number == 2 and geometry_type is not None:
+            geometry = _geometry(data, value, geometry_type, hasZ, hasM,
+                                 transform)
+    feature = {"attributes": dict(zip(names, values))}
+    if geometry is not None:
+        feature['geometry'] = geometry
+    return feature
+#----------------------------------------------------------------------
+def _feature_result(data, span):
+    """ decodes a FeatureResult message into a feature set """
+    result = {}
+    fields = []
+    features = []
+    geometry_type = None
+    hasZ = hasM = False
+    transform = None
+    for number, wire, value in _message(data, *span):
+        if number == 1:
+            result['objectIdFieldName'] = _text(data, value)
+        elif number == 3:
+            result['globalIdFieldName'] = _text(data, value)
+        elif number == 7:
+            geometry_type = GEOMETRY_TYPES.get(value)
+        elif number == 8:
+            result['spatialReference'] = _spatial_reference(data, value)
+        elif number == 9:
+            if value:
+                result['exceededTransferLimit'] = True
+        elif number == 10:
+            hasZ = value != 0
+        elif number == 11:
+            hasM = value != 0
+        elif number == 12:
+            transform = _transform(data, value)
+        elif number == 13:
+            fields.append(_field(data, value))
+        elif number == 15:
+            features.append(value)
+    if transform is None:
+        transform = _transform(data, (0, 0))
+        transform['upperLeft'] = False
+    if geometry_type is not None:
+        result['geometryType'] = geometry_type
+    if hasZ:
+        result['hasZ'] = True
+    if hasM:
+        result['hasM'] = True
+    names = [field['name'] for field in fields]
+    result['fields'] = fields
+    result['features'] = [_feature(data, feature, names, geometry_type,
+                                   hasZ, hasM, transform)
+                          for feature in features]
+    return result
+#----------------------------------------------------------------------
+def decode(buffer):
+    """ decodes a FeatureCollectionPBuffer query response
+        Inputs:
+           buffer - the response body
+        Output:
+           dictionary in the form of the JSON response
+        Raises:
+           DecodeError for buffers that can not be decoded
+    """
+    try:
+        return _decode(bytearray(buffer))
+    except (IndexError, struct.error), e:
+        raise DecodeError("truncated message: %s" % e)
+#----------------------------------------------------------------------
+def _decode(data):
+    """ decodes the QueryResult of a FeatureCollectionPBuffer """
+    for number, wire, value in _message(data):
+        if number != 2 or wire != 2:
+            continue
+        for kind, kind_wire, span in _message(data, *value):
+            if kind == 1:
+                return _feature_result(data, span)
+            elif kind == 2:
+                count = 0
+                for n, w, v in _message(data, *span):
+                    if n == 1:
+                        count = v
+                return {"count": count}
+            elif kind == 3:
+                result = {"objectIds": []}
+                for n, w, v in _message(data, *span):
+                    if n == 1:
+                        result['objectIdFieldName'] = _text(data, v)
+                    elif n == 3:
+                        if w == 2:
+                            result['objectIds'].extend(_packed(data, v))
+                        else:
+                            result['objectIds'].append(v)
+                return result
+    raise DecodeError("the buffer holds no query result")
@@ -0,0 +1,281 @@
+"""
+   Chooses how the features of a query are read.  The planner looks at
+   the layer's metadata (advancedQueryCapabilities, maxRecordCount,
+   geometry and extent) and at a count of the query, and if needed its
+   object ids, then picks one of:
+
+      single - everything fits in one request
+      offset - resultOffset paging, for layers supporting pagination
+               when the result is a few pages, so no id list is needed
+      oid_ranges - "OID >= a AND OID <= b" where clauses over the sorted
+                   object ids, run in parallel, used when the ids are
+                   dense
+      oid_lists - explicit objectIds batches, run in parallel, used when
+                  the ids are sparse so ranges would scan large gaps
+      tiles - a quadtree of the layer's extent, used when the ids can not
+              be listed and the layer does not support pagination
+
+   The Plan records the choice, the page size, the reason and an
+   estimate of the requests it takes, for inspection:
+      print fl.plan_query(where="STATUS = 'A'")
+"""
+import math
+import paging
+import extract
+
+SINGLE = "single"
+OFFSET = "offset"
+OID_RANGES = "oid_ranges"
+OID_LISTS = "oid_lists"
+TILES = "tiles"
+STRATEGIES = (SINGLE, OFFSET, OID_RANGES, OID_LISTS, TILES)
+# results of up to this many pages are read with resultOffset
+OFFSET_MAX_PAGES = 10
+# share of the object id range that must be used for oid_ranges
+DENSE = 0.5
+#----------------------------------------------------------------------
+def _tile_requests(pages):
+    """ estimated requests of a tiled read of a number of pages: tiles
+        end up about two thirds full, every tile is counted and the
+        split tiles add a third to the count requests
+    """
+    leaves = 1.5 * pages
+    return int(math.ceil(leaves + leaves * 4 / 3.0)) + 1
+########################################################################
+class Plan(object):
+    """ the strategy chosen for a query """
+    _strategy = None
+    _page_size = None
+    _count = None
+    _requests = None
+    _reason = None
+    _density = None
+    _oid_field = None
+    _oids = None
+    #----------------------------------------------------------------------
+    def __init__(self, strategy, page_size, count, requests, reason,
+                 density=None, oid_field=None, oids=None):
+        """Constructor"""
+        self._strategy = strategy
+        self._page_size = page_size
+        self._count = count
+        self._requests = requests
+        self._reason = reason
+        self._density = density
+        self._oid_field = oid_field
+        self._oids = oids
+    #----------------------------------------------------------------------
+    @property
+    def strategy(self):
+        """ one of single, offset, oid_ranges, oid_lists or tiles """
+        return self._strategy
+    #----------------------------------------------------------------------
+    @property
+    def page_size(self):
+        """ features per request """
+        return self._page_size
+    #----------------------------------------------------------------------
+    @property
+    def count(self):
+        """ number of features the query returns """
+        return self._count
+    #----------------------------------------------------------------------
+    @property
+    def requests(self):
+        """ estimated number of requests, the planning requests included """
+        return self._requests
+    #----------------------------------------------------------------------
+    @property
+    def reason(self):
+        """ why the strategy was chosen """
+        return self._reason
+    #----------------------------------------------------------------------
+    @property
+    def density(self):
+        """ share of the object id range holding features, None when the
+            ids were not queried
+        """
+        return self._density
+    #----------------------------------------------------------------------
+    @property
+    def as_dict(self):
+        """ returns the plan as a dictionary """
+        return {"strategy": self._strategy,
+                "page_size": self._page_size,
+                "count": self._count,
+                "requests": self._requests,
+                "reason": self._reason,
+                "density": self._density}
+    #----------------------------------------------------------------------
+    def __repr__(self):
+        return "<Plan %s: %s features, pages of %s, ~%s requests (%s)>" % \
+               (self._strategy, self._count, self._page_size,
+                self._requests, self._reason)
+########################################################################
+class QueryPlanner(object):
+    """ plans and reads the pages of a layer query
+        Inputs:
+           featureLayer - layer.FeatureLayer or layer.TableLayer object
+           workers - number of requests run at once by the parallel
+                     strategies
+           progress - optional function called as progress(done, total)
+           strategy - forces a strategy instead of choosing one
+    """
+    _layer = None
+    _workers = None
+    _progress = None
+    _strategy = None
+    #----------------------------------------------------------------------
+    def __init__(self, featureLayer, workers=4, progress=None,
+                 strategy=None):
+        """Constructor"""
+        if strategy is not None and strategy not in STRATEGIES:
+            raise ValueError("strategy must be one of %s" %
+                             ", ".join(STRATEGIES))
+        self._layer = featureLayer
+        self._workers = workers
+        self._progress = progress
+        self._strategy = strategy
+    #----------------------------------------------------------------------
+    def _can_tile(self, params):
+        """ True when the layer has an extent to tile and the query has
+            no geometry filter of its own
+        """
+        layer = self._layer
+        return 'geometry' not in params and \
+               layer.geometryType is not None and \
+               (layer.extent or layer.parentLayer.fullExtent) is not None
+    #----------------------------------------------------------------------
+    def plan(self, params, page_size=None):
+        """ counts the features of query parameters and chooses how to
+            read them
+            Output:
+               Plan
+        """
+        layer = self._layer
+        max_records = layer.maxRecordCount
+        page_size = min(page_size or max_records, max_records)
+        caps = layer.advancedQueryCapabilities or {}
+        paginate = caps.get('supportsPagination', False)
+        count_params = dict(params)
+        count_params['returnCountOnly'] = True
+        count_params['returnGeometry'] = False
+        result = layer._fetch_query(count_params)
+        if 'error' in result:
+            raise ValueError(result)
+        count = result.get('count', 0)
+        pages = int(math.ceil(count / float(page_size)))
+        probes = 1
+        strategy = self._strategy
+        if strategy is None:
+            if count <= page_size:
+                return Plan(SINGLE, page_size, count, probes + 1,
+                            "the result fits in one request")
+            if paginate and pages <= OFFSET_MAX_PAGES:
+                return Plan(OFFSET, page_size, count, probes + pages,
+                            "pagination is supported and the result is "
+                            "%s pages" % pages)
+        elif strategy in (SINGLE, OFFSET):
+            return Plan(strategy, page_size, count,
+                        probes + (1 if strategy == SINGLE else pages),
+                        "requested")
+        if strategy == TILES:
+            return Plan(TILES, page_size, count, probes + _tile_requests(pages),
+                        "requested")
+        id_params = dict(params)
+        id_params['returnIdsOnly'] = True
+        id_params['returnGeometry'] = False
+        ids = layer._fetch_query(id_params)
+        probes += 1
+        if 'error' in ids:
+            if strategy is not None:
+                raise ValueError(ids)
+            if paginate:
+                return Plan(OFFSET, page_size, count, probes + pages,
+                            "the object ids can not be listed")
+            if self._can_tile(params):
+                return Plan(TILES, page_size, count,
+                            probes + _tile_requests(pages),
+                            "the object ids can not be listed and "
+                            "pagination is not supported")
+            raise ValueError(ids)
+        oids = sorted(ids.get('objectIds') or [])
+        oid_field = ids.get('objectIdFieldName', layer.objectIdField)
+        density = None
+        if len(oids) > 0:
+            density = len(oids) / float(oids[-1] - oids[0] + 1)
+        if strategy is None:
+            if density is not None and density < DENSE:
+                strategy = OID_LISTS
+                reason = "the object ids are sparse (%.2f)" % density
+            else:
+                strategy = OID_RANGES
+                reason = "the object ids are dense (%.2f)" % (density or 1)
+        else:
+            reason = "requested"
+        pages = int(math.ceil(len(oids) / float(page_size)))
+        return Plan(strategy, page_size, len(oids), probes + pages, reason,
+                    density, oid_field, oids)
+    #----------------------------------------------------------------------
+    def pages(self, params, page_size=None, plan=None):
+        """ yields the query responses of query parameters, read with
+            the given plan or a new one
+        """
+        if plan is None:
+            plan = self.plan(params, page_size)
+        layer = self._layer
+        if plan.strategy == OID_RANGES:
+            return extract.Extractor(layer, self._workers, plan.page_size,
+                                     self._progress).query_pages(
+                params, plan._oid_field, plan._oids)
+        if plan.strategy == TILES:
+            return extract.TiledExtractor(layer, self._workers,
+                                          plan.page_size,
+                                          self._progress).query_pages(
+                params, plan.count)
+        if plan.strategy == OID_LISTS:
+            def fetch(batch):
+                batch_params = dict(params)
+                batch_params['objectIds'] = ",".join(str(oid)
+                                                     for oid in batch)
+                page = layer._fetch_query(batch_params)
+                if 'error' in page:
+                    raise ValueError(page)
+                return page
+            pages = paging.ordered_map(fetch,
+                                       paging.oid_batches(plan._oids,
+                                                          plan.page_size),
+                                       self._workers)
+        elif plan.strategy == OFFSET:
+            pages = paging.offset_pages(layer._fetch_query, params,
+                                        plan.page_size,
+                                        order_by=layer.objectIdField)
+        else:
+            pages = self._single(params, plan.page_size)
+        return self._report(pages, plan.count)
+    #----------------------------------------------------------------------
+    def _single(self, params, page_size):
+        """ yields the response of a single request, paging it if the
+            server still cuts it
+        """
+        page = self._layer._fetch_query(params)
+        if 'error' in page:
+            raise ValueError(page)
+        if not page.get('exceededTransferLimit', False):
+            yield page
+            return
+        caps = self._layer.advancedQueryCapabilities or {}
+        strategy = OFFSET if caps.get('supportsPagination', False) \
+                   else OID_LISTS
+        planner = QueryPlanner(self._layer, self._workers, None, strategy)
+        for page in planner.pages(params, page_size):
+            yield page
+    #----------------------------------------------------------------------
+    def _report(self, pages, total):
+        """ calls the progress function after each page """
+        done = 0
+        for page in pages:
+            done += len(page.get('features', []))
+            if self._progress is not None:
+                self._progress(done, total)
+            yield page
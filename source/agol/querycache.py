@@ -0,0 +1,280 @@
+"""
+   Optional cache of query results.  Entries are keyed by a canonical
+   fingerprint of the query url, the request parameters (where clause,
+   out fields, time, geometry and layer definition filters, ...) and the
+   credential scope; the token is left out.  The cache is told about
+   edits made through FeatureLayer (applyEdits, updateFeature,
+   addFeatures, deleteFeatures) and drops the entries of the edited
+   layer and of its service.
+
+   Two backends are available, both evicting the least recently used
+   entries beyond max_entries and entries older than max_age seconds:
+      MemoryBackend - entries live in the process
+      DiskBackend - entries are files under a folder, shared by the
+                    processes using the same folder
+
+   The cache is off until a backend is set:
+      querycache.default_cache.configure(
+          querycache.MemoryBackend(max_entries=256, max_age=60))
+"""
+import os
+import time
+import json
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+import jsonutils
+
+#----------------------------------------------------------------------
+def _canonical(value):
+    """ returns a stable text form of a request parameter value """
+    if isinstance(value, (dict, list, tuple)):
+        return json.dumps(value, sort_keys=True)
+    if isinstance(value, bool):
+        return str(value).lower()
+    if isinstance(value, basestring):
+        text = value.strip()
+        if text[:1] in ('{', '['):
+            try:
+                return json.dumps(json.loads(text), sort_keys=True)
+            except ValueError:
+                pass
+        if isinstance(value, unicode):
+            return value.encode('utf-8')
+        return value
+    return str(value)
+#----------------------------------------------------------------------
+def fingerprint(url, params, scope=None):
+    """ returns the cache key of a query: a hash of the url, the
+        canonical parameters without the token, and the credential scope
+    """
+    items = sorted((k, _canonical(v)) for k, v in params.iteritems()
+                   if k != 'token')
+    text = json.dumps([url.rstrip('/'), items, scope])
+    return hashlib.sha1(text).hexdigest()
+#----------------------------------------------------------------------
+def _resource(url):
+    """ normalized form of a layer or service url """
+    return url.rstrip('/').lower()
+#----------------------------------------------------------------------
+def _resource_of(url):
+    """ layer or service url a query url's results are filed under, the
+        query url without its operation (/query)
+    """
+    return _resource(url).rsplit('/', 1)[0]
+########################################################################
+class MemoryBackend(object):
+    """ in process LRU store of query results
+        Inputs:
+           max_entries - number of results kept
+           max_age - seconds a result is used
+    """
+    _max_entries = None
+    _max_age = None
+    #----------------------------------------------------------------------
+    def __init__(self, max_entries=256, max_age=60):
+        """Constructor"""
+        self._max_entries = max_entries
+        self._max_age = max_age
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    #----------------------------------------------------------------------
+    def get(self, key, resource):
+        """ returns the stored text of a key or None """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            if time.time() - entry[0] >= self._max_age:
+                return None
+            self._entries[key] = entry
+            return entry[2]
+    #----------------------------------------------------------------------
+    def put(self, key, resource, text):
+        """ stores the text of a result filed under a resource url """
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time(), resource, text)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+    #----------------------------------------------------------------------
+    def invalidate(self, resource):
+        """ removes the entries filed under a resource url """
+        with self._lock:
+            for key in [k for k, v in self._entries.iteritems()
+                        if v[1] == resource]:
+                del self._entries[key]
+    #----------------------------------------------------------------------
+    def clear(self):
+        """ removes all entries """
+        with self._lock:
+            self._entries = OrderedDict()
+    #----------------------------------------------------------------------
+    def __len__(self):
+        return len(self._entries)
+########################################################################
+class DiskBackend(object):
+    """ on disk store of query results.  Each resource url has its own
+        sub folder, so an edit removes its entries with one call.  The
+        file modification time records the last use; the folder is
+        trimmed to max_entries every 16 writes.
+        Inputs:
+           cache_dir - folder holding the cache files
+           max_entries - number of results kept
+           max_age - seconds a result is used
+    """
+    _cache_dir = None
+    _max_entries = None
+    _max_age = None
+    #----------------------------------------------------------------------
+    def __init__(self, cache_dir, max_entries=1024, max_age=300):
+        """Constructor"""
+        self._cache_dir = cache_dir
+        self._max_entries = max_entries
+        self._max_age = max_age
+        self._lock = threading.Lock()
+        self._puts = 0
+    #----------------------------------------------------------------------
+    def _folder(self, resource):
+        """ folder holding the entries of a resource url """
+        return os.path.join(self._cache_dir,
+                            hashlib.sha1(resource).hexdigest())
+    #----------------------------------------------------------------------
+    def get(self, key, resource):
+        """ returns the stored text of a key or None """
+        path = os.path.join(self._folder(resource), key + ".json")
+        try:
+            with open(path, 'rb') as reader:
+                stored, text = reader.read().split("\n", 1)
+            if time.time() - float(stored) >= self._max_age:
+                os.remove(path)
+                return None
+            os.utime(path, None)
+            return text
+        except (IOError, OSError, ValueError):
+            return None
+    #----------------------------------------------------------------------
+    def put(self, key, resource, text):
+        """ stores the text of a result filed under a resource url """
+        folder = self._folder(resource)
+        path = os.path.join(folder, key + ".json")
+        temp = "%s.%s.%s.tmp" % (path, os.getpid(),
+                                 threading.current_thread().ident)
+        try:
+            with self._lock:
+                if not os.path.isdir(folder):
+                    os.makedirs(folder)
+            with open(temp, 'wb') as writer:
+                writer.write("%r\n" % time.time())
+                writer.write(text)
+            if os.name == 'nt' and os.path.isfile(path):
+                os.remove(path)
+            os.rename(temp, path)
+        except (IOError, OSError):
+            # the cache is an optimization, a failed write is not an error
+            if os.path.isfile(temp):
+                os.remove(temp)
+            return
+        with self._lock:
+            self._puts += 1
+            evict = self._puts % 16 == 0
+        if evict:
+            self._evict()
+    #----------------------------------------------------------------------
+    def _evict(self):
+        """ removes expired entries and the least recently used ones
+            beyond max_entries
+        """
+        files = []
+        now = time.time()
+        for root, dirs, names in os.walk(self._cache_dir):
+            for name in names:
+                if name.endswith(".json"):
+                    path = os.path.join(root, name)
+                    try:
+                        files.append((os.path.getmtime(path), path))
+                    except OSError:
+                        pass
+        files.sort()
+        excess = len(files) - self._max_entries
+        for index, (used, path) in enumerate(files):
+            if index < excess or now - used >= self._max_age:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+    #----------------------------------------------------------------------
+    def invalidate(self, resource):
+        """ removes the entries filed under a resource url """
+        folder = self._folder(resource)
+        if os.path.isdir(folder):
+            shutil.rmtree(folder, ignore_errors=True)
+    #----------------------------------------------------------------------
+    def clear(self):
+        """ removes all entries """
+        if os.path.isdir(self._cache_dir):
+            for folder in os.listdir(self._cache_dir):
+                shutil.rmtree(os.path.join(self._cache_dir, folder),
+                              ignore_errors=True)
+########################################################################
+class QueryCache(object):
+    """ caches query results in a backend
+        Inputs:
+           backend - MemoryBackend or DiskBackend, None disables the cache
+    """
+    _backend = None
+    #----------------------------------------------------------------------
+    def __init__(self, backend=None):
+        """Constructor"""
+        self._backend = backend
+    #----------------------------------------------------------------------
+    def configure(self, backend):
+        """ sets the backend, None disables the cache """
+        self._backend = backend
+    #----------------------------------------------------------------------
+    @property
+    def enabled(self):
+        """ True when a backend is set """
+        return self._backend is not None
+    #----------------------------------------------------------------------
+    @property
+    def backend(self):
+        """ the backend holding the entries """
+        return self._backend
+    #----------------------------------------------------------------------
+    def get(self, url, params, scope=None):
+        """ returns a new copy of the cached result of a query or None """
+        if self._backend is None:
+            return None
+        text = self._backend.get(fingerprint(url, params, scope),
+                                 _resource_of(url))
+        if text is None:
+            return None
+        return jsonutils.loads(text)
+    #----------------------------------------------------------------------
+    def put(self, url, params, value, scope=None):
+        """ stores the result of a query """
+        if self._backend is None:
+            return
+        self._backend.put(fingerprint(url, params, scope),
+                          _resource_of(url), json.dumps(value))
+    #----------------------------------------------------------------------
+    def invalidate(self, url):
+        """ drops the results of a layer url and of its service, called
+            after an edit of the layer
+        """
+        if self._backend is None:
+            return
+        resource = _resource(url)
+        self._backend.invalidate(resource)
+        parent = resource.rsplit('/', 1)[0]
+        if resource.rsplit('/', 1)[-1].isdigit():
+            self._backend.invalidate(parent)
+    #----------------------------------------------------------------------
+    def clear(self):
+        """ removes all entries """
+        if self._backend is not None:
+            self._backend.clear()
+########################################################################
+default_cache = QueryCache()
@@ -0,0 +1,212 @@
+"""
+   Adaptive per host rate limiting and throttling aware retries.  Each
+   host gets a request rate and concurrency budget.  Throttled or
+   transient failures (429, 502, 503, 504, timeouts) are retried with a
+   jittered exponential backoff and cut the host's rate in half; every
+   success slowly raises it again (additive increase, multiplicative
+   decrease).
+
+   A POST may already have been applied when its response is lost, so
+   POSTs are only retried on 429 and 503, which the server sends
+   without acting on the request, or when the connection failed before
+   the request was sent.
+"""
+import time
+import socket
+import random
+import httplib
+import urlparse
+import threading
+from collections import deque
+import connection
+
+RETRY_STATUS = (429, 502, 503, 504)
+# statuses a POST is retried on
+RETRY_POST_STATUS = (429, 503)
+# methods retried on every transient failure
+SAFE_METHODS = ("GET", "HEAD")
+########################################################################
+class HostThrottle(object):
+    """ rate and concurrency budget for a single host
+        Inputs:
+           max_rate - highest requests per second allowed.  None means
+                      no limit until the host throttles a request.
+           min_rate - lowest requests per second the rate is cut to
+           max_concurrency - requests in flight at once, None for no
+                             limit
+           increase - requests per second added to the rate for every
+                      successful request
+           decrease - factor the rate is multiplied by when throttled
+           cooldown - seconds after a cut during which further throttled
+                      requests do not cut the rate again
+    """
+    _rate = None
+    #----------------------------------------------------------------------
+    def __init__(self, max_rate=None, min_rate=0.5, max_concurrency=None,
+                 increase=0.1, decrease=0.5, cooldown=1.0):
+        """Constructor"""
+        self._max_rate = max_rate
+        self._min_rate = min_rate
+        self._max_concurrency = max_concurrency
+        self._increase = increase
+        self._decrease = decrease
+        self._cooldown = cooldown
+        self._rate = max_rate
+        self._next = 0
+        self._decreased = 0
+        self._in_flight = 0
+        self._recent = deque()
+        self._lock = threading.Condition(threading.Lock())
+    #----------------------------------------------------------------------
+    @property
+    def rate(self):
+        """ current requests per second, None when not limited """
+        return self._rate
+    #----------------------------------------------------------------------
+    def acquire(self):
+        """ blocks until a request may be sent to the host and returns
+            the time the request was admitted
+        """
+        with self._lock:
+            while self._max_concurrency is not None and \
+                  self._in_flight >= self._max_concurrency:
+                self._lock.wait()
+            self._in_flight += 1
+            now = time.time()
+            self._recent.append(now)
+            while self._recent and self._recent[0] < now - 1.0:
+                self._recent.popleft()
+            wait = 0
+            if self._rate is not None:
+                wait = max(0, self._next - now)
+                self._next = max(now, self._next) + 1.0 / self._rate
+        if wait > 0:
+            time.sleep(wait)
+        return now + wait
+    #----------------------------------------------------------------------
+    def release(self, started, throttled=False):
+        """ ends a request admitted at started and adjusts the rate.  The
+            rate is only cut once per throttling event: requests that
+            were in flight when it was cut, or that fail within the
+            cooldown, do not cut it again.
+        """
+        with self._lock:
+            self._in_flight -= 1
+            if throttled:
+                now = time.time()
+                if started >= self._decreased and \
+                   now - self._decreased >= self._cooldown:
+                    self._decreased = now
+                    rate = self._rate
+                    if rate is None:
+                        rate = max(len(self._recent), self._min_rate)
+                    self._rate = max(self._min_rate, rate * self._decrease)
+            elif self._rate is not None:
+                self._rate += self._increase
+                if self._max_rate is not None and \
+                   self._rate > self._max_rate:
+                    self._rate = self._max_rate
+            self._lock.notify_all()
+########################################################################
+class RequestScheduler(object):
+    """ sends requests through per host HostThrottle budgets and retries
+        throttled or transient failures
+        Inputs:
+           max_rate - highest requests per second per host, None for no
+                      limit until throttled
+           min_rate - lowest requests per second per host
+           max_concurrency - requests in flight per host, None for no
+                             limit
+           retries - number of times a throttled request is retried
+           backoff - base delay in seconds of the exponential backoff
+           max_backoff - longest delay in seconds between retries
+    """
+    _max_rate = None
+    _min_rate = None
+    _max_concurrency = None
+    _retries = None
+    _backoff = None
+    _max_backoff = None
+    #----------------------------------------------------------------------
+    def __init__(self, max_rate=None, min_rate=0.5, max_concurrency=None,
+                 retries=5, backoff=0.5, max_backoff=60):
+        """Constructor"""
+        self._max_rate = max_rate
+        self._min_rate = min_rate
+        self._max_concurrency = max_concurrency
+        self._retries = retries
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._hosts = {}
+        self._lock = threading.Lock()
+    #----------------------------------------------------------------------
+    def configure(self, **kwargs):
+        """ changes the scheduler settings.  Accepts the constructor
+            arguments; hosts already seen keep their current budget
+            unless reset() is called.
+        """
+        for key, value in kwargs.iteritems():
+            if not hasattr(self, "_" + key):
+                raise AttributeError("unknown setting: %s" % key)
+            setattr(self, "_" + key, value)
+    #----------------------------------------------------------------------
+    def reset(self):
+        """ forgets the learned rate of every host """
+        with self._lock:
+            self._hosts = {}
+    #----------------------------------------------------------------------
+    def host(self, url):
+        """ returns the HostThrottle for the host of a url """
+        key = urlparse.urlparse(url).netloc.lower()
+        with self._lock:
+            if key not in self._hosts:
+                self._hosts[key] = HostThrottle(
+                    max_rate=self._max_rate,
+                    min_rate=self._min_rate,
+                    max_concurrency=self._max_concurrency)
+            return self._hosts[key]
+    #----------------------------------------------------------------------
+    def _delay(self, attempt, response):
+        """ seconds to wait before a retry, honoring Retry-After """
+        if response is not None:
+            retry_after = response.headers.getheader('retry-after')
+            if retry_after is not None and retry_after.isdigit():
+                return min(int(retry_after), self._max_backoff)
+        delay = min(self._max_backoff, self._backoff * 2 ** attempt)
+        return delay * random.uniform(0.5, 1.5)
+    #----------------------------------------------------------------------
+    def execute(self, url, send, method="GET"):
+        """ calls send() within the url's host budget and returns its
+            connection.Response, retrying throttled and transient
+            failures.  Requests of other methods than GET and HEAD are
+            only retried on 429, 503 or a connection.NotSentError.  The
+            last response or error is returned/raised when the retries
+            are used up.
+        """
+        throttle = self.host(url)
+        safe = method.upper() in SAFE_METHODS
+        retry_status = RETRY_STATUS if safe else RETRY_POST_STATUS
+        attempt = 0
+        while True:
+            started = throttle.acquire()
+            response = None
+            throttled = False
+            try:
+                response = send()
+                throttled = response.status in RETRY_STATUS
+            except (socket.timeout, socket.error,
+                    httplib.BadStatusLine, httplib.IncompleteRead), e:
+                throttled = True
+                if attempt >= self._retries or \
+                   not (safe or isinstance(e, connection.NotSentError)):
+                    raise
+            finally:
+                throttle.release(started, throttled=throttled)
+            if response is not None and \
+               (response.status not in retry_status or
+                attempt >= self._retries):
+                return response
+            time.sleep(self._delay(attempt, response))
+            attempt += 1
+########################################################################
+default_scheduler = RequestScheduler()
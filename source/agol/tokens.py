@@ -0,0 +1,167 @@
+"""
+   Process wide token cache shared by every AGOL object.  A token is
+   generated once per (username, token url, referer) and refreshed in the
+   background before it expires.
+"""
+import time
+import json
+import urllib
+import threading
+import connection
+
+DEFAULT_TOKEN_URL = 'https://arcgis.com/sharing/rest/generateToken'
+DEFAULT_REFERER = 'https://www.arcgis.com'
+########################################################################
+class TokenManager(object):
+    """ caches tokens per credential and refreshes them before expiry
+        Inputs:
+           expiration - token lifetime requested from the server in
+                        minutes
+           refresh_margin - seconds before expiry at which the token is
+                            refreshed in the background
+    """
+    _expiration = None
+    _refresh_margin = None
+    #----------------------------------------------------------------------
+    def __init__(self, expiration=60, refresh_margin=300):
+        """Constructor"""
+        self._expiration = expiration
+        self._refresh_margin = refresh_margin
+        self._entries = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+    #----------------------------------------------------------------------
+    @property
+    def expiration(self):
+        """ gets/sets the requested token lifetime in minutes """
+        return self._expiration
+    #----------------------------------------------------------------------
+    @expiration.setter
+    def expiration(self, value):
+        """ gets/sets the requested token lifetime in minutes """
+        self._expiration = value
+    #----------------------------------------------------------------------
+    @property
+    def refresh_margin(self):
+        """ gets/sets the seconds before expiry a token is refreshed """
+        return self._refresh_margin
+    #----------------------------------------------------------------------
+    @refresh_margin.setter
+    def refresh_margin(self, value):
+        """ gets/sets the seconds before expiry a token is refreshed """
+        self._refresh_margin = value
+    #----------------------------------------------------------------------
+    def _key(self, username, token_url, referer):
+        """ builds the cache key for a credential """
+        if token_url is None:
+            token_url = DEFAULT_TOKEN_URL
+        if referer is None:
+            referer = DEFAULT_REFERER
+        return (username, token_url, referer)
+    #----------------------------------------------------------------------
+    def _key_lock(self, key):
+        """ returns the lock that serializes token requests for a key """
+        with self._lock:
+            if key not in self._locks:
+                self._locks[key] = threading.Lock()
+            return self._locks[key]
+    #----------------------------------------------------------------------
+    def get_token(self, username, password, token_url=None, referer=None):
+        """ returns a (token, ssl) tuple for a credential, generating a
+            new token only if none is cached or the cached one expired.
+            None is returned if the server did not issue a token.
+        """
+        key = self._key(username, token_url, referer)
+        entry = self._entries.get(key)
+        if self._is_valid(entry, password):
+            return entry['token'], entry['ssl']
+        with self._key_lock(key):
+            entry = self._entries.get(key)
+            if not self._is_valid(entry, password):
+                entry = self._generate(key, password)
+            if entry is None:
+                return None
+            return entry['token'], entry['ssl']
+    #----------------------------------------------------------------------
+    def _is_valid(self, entry, password):
+        """ checks if a cache entry can be handed out """
+        return entry is not None and \
+               entry['password'] == password and \
+               entry['expires'] > time.time()
+    #----------------------------------------------------------------------
+    def _generate(self, key, password):
+        """ requests a token from the server and caches it """
+        username, token_url, referer = key
+        query_dict = {'username': username,
+                      'password': password,
+                      'expiration': str(self._expiration),
+                      'referer': referer,
+                      'f': 'json'}
+        res = connection.default_pool.request(
+            "POST", token_url + "?f=json",
+            urllib.urlencode(query_dict),
+            {'Content-Type': 'application/x-www-form-urlencoded'})
+        token = json.loads(res.data)
+        if "token" not in token:
+            self.invalidate(username, token_url, referer)
+            return None
+        if 'expires' in token:
+            expires = token['expires'] / 1000.0
+        else:
+            expires = time.time() + self._expiration * 60
+        entry = {'token': token['token'].encode('utf-8'),
+                 'ssl': token.get('ssl', False) == True,
+                 'expires': expires,
+                 'password': password}
+        with self._lock:
+            old = self._entries.get(key)
+            if old is not None and old.get('timer') is not None:
+                old['timer'].cancel()
+            self._entries[key] = entry
+            self._schedule(key, entry)
+        return entry
+    #----------------------------------------------------------------------
+    def _schedule(self, key, entry):
+        """ starts a background timer that refreshes the token before it
+            expires
+        """
+        delay = entry['expires'] - time.time() - self._refresh_margin
+        if delay <= 0:
+            entry['timer'] = None
+            return
+        timer = threading.Timer(delay, self._refresh, args=(key,))
+        timer.daemon = True
+        entry['timer'] = timer
+        timer.start()
+    #----------------------------------------------------------------------
+    def _refresh(self, key):
+        """ background refresh of a cached token """
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        with self._key_lock(key):
+            try:
+                self._generate(key, entry['password'])
+            except Exception:
+                # the cached token stays usable until it expires, after
+                # which get_token requests a new one
+                pass
+    #----------------------------------------------------------------------
+    def invalidate(self, username, token_url=None, referer=None):
+        """ removes a cached token so the next request generates one """
+        key = self._key(username, token_url, referer)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is not None and entry.get('timer') is not None:
+            entry['timer'].cancel()
+    #----------------------------------------------------------------------
+    def clear(self):
+        """ removes all cached tokens and stops their refresh timers """
+        with self._lock:
+            entries = self._entries
+            self._entries = {}
+        for entry in entries.itervalues():
+            if entry.get('timer') is not None:
+                entry['timer'].cancel()
+########################################################################
+default_manager = TokenManager()